@@ -25,6 +25,9 @@ setup(
         "matplotlib",
         "PyGObject",
     ],
+    extras_require={
+        "fast": ["numba"],  # Compiled simulation kernel
+    },
     entry_points={"console_scripts": ["nemo_bldc = nemo_bldc.nemo:nemo_main"]},
     include_package_data=True,
     zip_safe=False,
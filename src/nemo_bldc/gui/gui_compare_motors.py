@@ -11,6 +11,11 @@ from .widget_motor_creation import DisplayMotor
 from .abstract_tab import AbstractTab
 from .utils import *
 from ..ressources import get_ressource_path
+from ..simulation.batch import simulate_batch, SimulationCache
+from ..simulation.simulate import ControlType
+
+import threading
+import queue
 
 
 def motor_to_treeview(mot):
@@ -23,6 +28,41 @@ def motor_to_treeview(mot):
     ]
 
 
+def run_batch_simulation_thread(motors, scenario, cache, queue):
+    try:
+        queue.put(simulate_batch(motors, *scenario, cache=cache, gui_queue=queue))
+    except Exception as e:
+        queue.put(e)
+
+
+def plot_simulation_comparison(fig, motors, results):
+    """
+    Overlay the tracking and quadrature current of the simulations of
+    several motors, each in the color of its motor.
+    """
+    axs = fig.subplots(2, 1, sharex=True)
+    control_type = results[0].control_type
+    for m, r in zip(motors, results):
+        if control_type == ControlType.POSITION:
+            axs[0].plot(r.time, r.theta, color=m.color, label=m.name)
+        else:
+            axs[0].plot(r.time, r.dtheta, color=m.color, label=m.name)
+        axs[1].plot(r.time, r.idq[1], color=m.color, label=m.name)
+    r = results[0]
+    if control_type == ControlType.POSITION:
+        axs[0].plot(r.time, r.pos_target, color="k", linestyle="dashed", label="Target")
+        axs[0].set_ylabel("Position (rad)")
+    else:
+        if control_type == ControlType.VELOCITY:
+            axs[0].plot(r.time, r.vel_target, color="k", linestyle="dashed", label="Target")
+        axs[0].set_ylabel("Velocity (rad/s)")
+    axs[1].set_ylabel("Quadrature current (A)")
+    axs[1].set_xlabel("Time (s)")
+    for a in axs:
+        a.grid()
+        a.legend()
+
+
 class CompareMotors(AbstractTab):
     """
     GUI tab: compare two motors
@@ -46,12 +86,7 @@ class CompareMotors(AbstractTab):
             left=0.2, bottom=0.15, right=0.97, top=0.97, wspace=0, hspace=0
         )
 
-        def format_coord(x, y):
-            return (
-                f"Velocity: {x:.1f}rad/s ({x * 30 / np.pi:.1f}rpm), Torque: {y:.1f}Nm"
-            )
-
-        ax.format_coord = format_coord
+        ax.format_coord = self.format_coord
 
         self.configure_plot(self.mpl_fig)
 
@@ -83,8 +118,39 @@ class CompareMotors(AbstractTab):
             grid_labels.insert_row(2 * i + 2)
             grid_labels.attach(Gtk.Separator(), 0, 2 * i + 2, 2, 1)
 
+        # Simulation of all the motors, with the scenario of the simulation tab.
+        self.simulation_tab = None
+        self.simulation_results = None
+        self.simulation_cache = SimulationCache()
+        self.simulation_queue = queue.Queue()
+        self.button_simulate = Gtk.Button(label="Simulate all motors")
+        self.button_simulate.set_tooltip_text("Run the scenario of the simulation tab for all the motors")
+        self.button_simulate.connect("clicked", self.simulate_clicked)
+        self.check_show_simulation = Gtk.CheckButton(label="Show simulation results")
+        self.check_show_simulation.set_sensitive(False)
+        self.check_show_simulation.connect("toggled", lambda *args: self.plot_need_update())
+        self.progress_bar_simu = Gtk.ProgressBar()
+        self.progress_bar_simu.set_show_text(True)
+        self.progress_bar_simu.show()
+        self.simulation_box = Gtk.Box(orientation=Gtk.Orientation.VERTICAL, spacing=5)
+        self.simulation_box.pack_start(self.button_simulate, False, False, 0)
+        self.simulation_box.pack_end(self.check_show_simulation, False, False, 0)
+        box.pack_end(self.simulation_box, False, False, 0)
+
         builder.connect_signals(self)
 
+    def set_simulation_tab(self, tab):
+        """
+        Set the simulation tab (SimulateMotor), providing the scenario to simulate.
+        """
+        self.simulation_tab = tab
+
+    @staticmethod
+    def format_coord(x, y):
+        return (
+            f"Velocity: {x:.1f}rad/s ({x * 30 / np.pi:.1f}rpm), Torque: {y:.1f}Nm"
+        )
+
     def param_update(self):
         for i, m in enumerate(self.motors):
             self.grid_column[i][0].set_markup(f"<b>{m.name}</b>")
@@ -93,11 +159,62 @@ class CompareMotors(AbstractTab):
         self.plot_need_update()
 
     def update_plot(self):
-        plot_caracteristics(
-            self.mpl_fig.gca(), self.motors, [m.color for m in self.motors]
-        )
+        if self.check_show_simulation.get_active() and self.simulation_results is not None:
+            self.mpl_fig.clear()
+            plot_simulation_comparison(self.mpl_fig, *self.simulation_results)
+        else:
+            if len(self.mpl_fig.axes) != 1:
+                self.mpl_fig.clear()
+                ax = self.mpl_fig.add_subplot()
+                ax.format_coord = self.format_coord
+            plot_caracteristics(
+                self.mpl_fig.gca(), self.motors, [m.color for m in self.motors]
+            )
         self.mpl_fig.canvas.draw()
 
+    def simulate_clicked(self, button):
+        if self.simulation_tab is None or len(self.motors) == 0:
+            return
+        scenario = self.simulation_tab.get_scenario()
+        if scenario is None:
+            return
+        motors = list(self.motors)
+        th = threading.Thread(target=run_batch_simulation_thread,
+                              args=(motors, scenario, self.simulation_cache, self.simulation_queue),
+                              daemon=True)
+        th.start()
+        self.simulation_box.remove(self.button_simulate)
+        self.progress_bar_simu.set_fraction(0.0)
+        self.simulation_box.pack_start(self.progress_bar_simu, False, False, 0)
+        GLib.timeout_add(50, self.check_simu_state, motors)
+
+    def check_simu_state(self, motors):
+        try:
+            it = self.simulation_queue.get(block=False)
+            if isinstance(it, float):
+                self.progress_bar_simu.set_fraction(it)
+            else:
+                if isinstance(it, Exception):
+                    dialog = Gtk.MessageDialog(
+                        message_type=Gtk.MessageType.INFO,
+                        buttons=Gtk.ButtonsType.OK,
+                        text="Warning: an error occured during simulation !",
+                    )
+                    dialog.format_secondary_text(str(it))
+                    dialog.run()
+                    dialog.destroy()
+                else:
+                    self.simulation_results = (motors, it)
+                    self.check_show_simulation.set_sensitive(True)
+                    self.check_show_simulation.set_active(True)
+                self.simulation_box.remove(self.progress_bar_simu)
+                self.simulation_box.pack_start(self.button_simulate, False, False, 0)
+                self.user_asked_for_update()
+                return False
+        except queue.Empty:
+            pass
+        return True
+
     def motor_updated(self, *args):
         if self.selected_motor is not None:
             motor = self.motor_widget.motor
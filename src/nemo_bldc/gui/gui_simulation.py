@@ -4,6 +4,7 @@ import numpy as np
 from matplotlib.figure import Figure
 from matplotlib.gridspec import GridSpec
 import math
+import copy
 
 import gi
 gi.require_version("Gtk", "3.0")
@@ -18,6 +19,7 @@ from ..ressources import get_ressource_path
 
 from ..simulation.pi_controller import PIController
 from ..simulation.simulate import SimulationResult, simulate, ControlType
+from ..simulation.cache import DiskSimulationCache, cached_simulate
 
 import threading
 import queue
@@ -94,9 +96,9 @@ SIMULATION_PLOTS = [("Position tracking", True, plot_position_tracking),
                     ("Phase voltage", True, plot_uphase),
                    ]
 
-def run_simulation_thread(simulation_arguments, queue):
+def run_simulation_thread(simulation_arguments, cache, queue):
     try:
-        queue.put(simulate(*simulation_arguments, gui_queue = queue))
+        queue.put(cached_simulate(cache, *simulation_arguments, gui_queue = queue))
     except Exception as e:
         queue.put(e)
 
@@ -167,31 +169,45 @@ class SimulateMotor(AbstractTab):
         self.position_pi_widget.set_gains(10.0, 0.5, 10.0)
 
         self.simulation_queue = queue.Queue()
+        # Results of previous runs, shared between sessions.
+        self.simulation_cache = DiskSimulationCache()
 
         builder.connect_signals(self)
 
-    def run_clicked(self, button):
+    def get_scenario(self):
+        """
+        Return the arguments of simulate() configured in this tab, except
+        the motor (None if the control type is not selected).
+        The controllers and signals are copies: simulate() changes the state
+        of the controllers, and each simulation thread needs its own.
+        """
         tree_iter = self.combo_box_type.get_active_iter()
         if tree_iter is None:
-            return
+            return None
         control_type = self.combo_box_type.get_model()[tree_iter][1]
 
-        simulate_args = (self.motor_widget.motor,
-                         ControlType[control_type],
-                         self.input_signal_widget.signal,
-                         self.spin_duration.get_value(),
-                         self.spin_inertia.get_value(),
-                         self.spin_nu.get_value(),
-                         self.current_pi_widget.controller,
-                         self.velocity_pi_widget.controller,
-                         self.position_pi_widget.controller,
-                         self.spin_frequency.get_value(),
-                         0.0,
-                         self.direct_current_signal_widget.signal,
-                         self.load_signal_widget.signal,
-                         )
+        scenario = (ControlType[control_type],
+                    self.input_signal_widget.signal,
+                    self.spin_duration.get_value(),
+                    self.spin_inertia.get_value(),
+                    self.spin_nu.get_value(),
+                    self.current_pi_widget.controller,
+                    self.velocity_pi_widget.controller,
+                    self.position_pi_widget.controller,
+                    self.spin_frequency.get_value(),
+                    0.0,
+                    self.direct_current_signal_widget.signal,
+                    self.load_signal_widget.signal,
+                    )
+        return copy.deepcopy(scenario)
+
+    def run_clicked(self, button):
+        scenario = self.get_scenario()
+        if scenario is None:
+            return
+        simulate_args = (self.motor_widget.motor,) + scenario
         th = threading.Thread(target=run_simulation_thread,
-                              args=(simulate_args, self.simulation_queue),
+                              args=(simulate_args, self.simulation_cache, self.simulation_queue),
                               daemon=True)
         th.start()
         self.box_toplevel.remove(self.button_run)
@@ -12,6 +12,9 @@ from .abstract_tab import AbstractTab
 from .utils import *
 from ..physics.battery import get_battery_state
 from ..physics.motor import Motor
+from ..physics.tolerance import MotorTolerances, tolerance_analysis
+from ..physics.efficiency_map import EfficiencyMaps
+from ..physics.current_reference import CurrentReferenceTables
 
 from ..ressources import get_ressource_path
 
@@ -33,6 +36,10 @@ DISPLAYED_CTES = [
     ("R", "Ohm", lambda m: f"{m.R:.3f}"),
 ]
 
+# Manufacturing tolerances used for the tolerance analysis (relative standard deviation)
+TOLERANCES = {"R": 0.05, "L": 0.05, "ke": 0.03, "U": 0.02}
+TOLERANCE_SAMPLES = 2000
+
 
 class SingleMotorPerfTab(AbstractTab):
     """
@@ -56,6 +63,10 @@ class SingleMotorPerfTab(AbstractTab):
             Motor(1, 0.01, 0.0001, 1.0, 1.0, 1.0, 1.0, 1.0) for _ in range(2)
         ]
 
+        # Current reference tables of the displayed motor, with the constants
+        # they were computed for: they are only rebuilt when these change.
+        self._current_tables = (None, None)
+
         self.label_specs = []
         for p in ["nominal_", "thermal_"]:
             self.label_specs.append(builder.get_object(f"{p}spec"))
@@ -94,6 +105,8 @@ class SingleMotorPerfTab(AbstractTab):
         Rvar = self.spin_R_var.get_value() / 100.0
         Tr = self.spin_rotor.get_value()
         Ts = self.spin_stator.get_value()
+        # Same magnetic model (saliency, saturation), possibly none.
+        self.motors[1].magnetics = self.motors[0].magnetics
         self.motors[1].update_constants(
             n=2 * self.motors[0].np,
             R=self.motors[0].R * (1 + Rvar * (Ts - To)),
@@ -109,6 +122,17 @@ class SingleMotorPerfTab(AbstractTab):
             text = "\n".join([d[2](self.motors[i]) for d in DISPLAYED_CTES])
             self.label_specs[i].set_text(text)
 
+        # Tolerance analysis: temperatures spread between nominal and the
+        # thermal variant.
+        self.tolerances = MotorTolerances(
+            stator_temperature=(min(To, Ts), max(To, Ts)),
+            rotor_temperature=(min(To, Tr), max(To, Tr)),
+            nominal_temperature=To,
+            R_coefficient=Rvar,
+            flux_coefficient=fvar,
+            **TOLERANCES,
+        )
+
         self.plot_need_update()
 
     def update_plot(self):
@@ -126,28 +150,42 @@ class SingleMotorPerfTab(AbstractTab):
         tau = np.linspace(0, mot.tau_max, 200)
         w_grid, tau_grid = np.meshgrid(w, tau)
 
-        plot_surface = np.full(w_grid.shape, -np.inf)
-
-        # Select plot content
-        if self.plot_type[0] == "meca":
-            plot_func = lambda t, w: t * w
-        elif self.plot_type[0] == "thermal":
-            plot_func = lambda t, w: mot.compute_thermal_power(t, w)
-        elif self.plot_type[0] == "power":
-            plot_func = lambda t, w: t * w + mot.compute_thermal_power(t, w)
-        elif self.plot_type[0] == "efficiency":
-            plot_func = (
-                lambda t, w: t * w / (t * w + mot.compute_thermal_power(t, w)) * 100
+        # Select plot content: plot_func gives the value shown when hovering,
+        # from the same data as the surface.
+        if self.plot_type[0] == "tolerance":
+            result = tolerance_analysis(
+                self.motors[0], self.tolerances, TOLERANCE_SAMPLES, tau, seed=0
             )
-        elif self.plot_type[0] == "battery":
-            plot_func = lambda t, w: get_battery_state(
-                mot.U, self.battery_resistance, t * w + mot.compute_thermal_power(t, w)
-            )[0]
-
-        for i in range(len(w_grid)):
-            mask = w_grid[i] <= mot.compute_max_speed_deflux(tau_grid[i])
-            plot_surface[i][mask] = plot_func(tau_grid[i][mask], w_grid[i][mask])
+            plot_func = lambda t, w: 100 * np.mean(
+                (w <= result.motors.compute_max_speed_deflux(t))
+                & (t <= result.motors.tau_max)
+            )
+            # All samples are evaluated at once, on the whole grid.
+            plot_surface = 100 * result.feasibility(w)
+            plot_surface[plot_surface == 0] = -np.inf
+        else:
+            maps = EfficiencyMaps.FromMotor(mot, tau=tau, w=w)
+            if self.plot_type[0] == "battery":
+                surface = maps.battery_voltage("motor", self.battery_resistance)
+                plot_func = lambda t, w: get_battery_state(
+                    mot.U, self.battery_resistance, maps.interpolate("motor", t, w, "electrical_power")
+                )[0]
+            elif self.plot_type[0] == "direct":
+                tables = self.current_reference_tables(mot)
+                surface = tables(tau_grid, w_grid)[0]
+                plot_func = lambda t, w: tables(t, w)[0]
+            else:
+                quantity = {"meca": "mechanical_power", "thermal": "thermal_power", "power": "electrical_power",
+                            "efficiency": "efficiency"}[self.plot_type[0]]
+                surface = maps.get("motor", quantity)
+                plot_func = lambda t, w: maps.interpolate("motor", t, w, quantity)
+            # Outside of the envelope: nan in the maps.
+            plot_surface = np.where(np.isnan(maps.get("motor", "thermal_power")), -np.inf, surface)
         ax = self.mpl_fig.gca()
+        if self.plot_type[0] == "tolerance":
+            # Torque-speed curves reached by 95%, 50% and 5% of the motors.
+            for q, style in zip([5, 50, 95], ["dotted", "dashed", "dotted"]):
+                ax.plot(result.percentile(q), tau, color="C3", linestyle=style)
         cm = mpl.colormaps["RdBu"]
         cm = cm.reversed()
         cm.set_over("w")
@@ -194,6 +232,16 @@ class SingleMotorPerfTab(AbstractTab):
 
         self.mpl_fig.canvas.draw()
 
+    def current_reference_tables(self, motor: Motor):
+        """
+        CurrentReferenceTables of a motor, reused between redraws as long as
+        its constants do not change.
+        """
+        constants = repr(motor.to_dict())
+        if self._current_tables[0] != constants:
+            self._current_tables = (constants, CurrentReferenceTables(motor))
+        return self._current_tables[1]
+
     def change_plot_type(self, combo_box):
         """
         Change the type of plot asked for
@@ -35,7 +35,9 @@ def nemo_main(is_unit_test=False):
     c_tab = CompareMotors()
     main.add_tab(c_tab)
     main.add_tab(SingleMotorPerfTab())
-    main.add_tab(SimulateMotor())
+    s_tab = SimulateMotor()
+    c_tab.set_simulation_tab(s_tab)
+    main.add_tab(s_tab)
     for tab in main.tabs:
         tab.update_library(DEFAULT_LIBRARY)
     c_tab.add_motor()
@@ -1,2 +1,12 @@
 from .motor import Motor
-from .battery import get_battery_state
+from .magnetics import MotorMagnetics, saturation_table
+from .current_reference import mtpa_currents, current_references, torque_limits, CurrentReferenceTables
+from .battery import get_battery_state, evaluate_power_bus, PowerBusResult
+from .lookup_table import LookupTable, MotorLookupTables
+from .transmission import Transmission
+from .inverter import Inverter
+from .sizing import optimize_sizing, pareto_front, SizingResult
+from .identification import MotorIdentifier
+from .tolerance import MotorTolerances, sample_motors, tolerance_analysis, ToleranceResult
+from .efficiency_map import EfficiencyMaps
+from .drive_cycle import evaluate_drive_cycle, DriveCycleResult
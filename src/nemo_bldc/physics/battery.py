@@ -2,6 +2,8 @@
 import typing as tp
 import numpy as np
 
+from .motor import Motor
+
 
 def get_battery_state(U_bat, R_bat, P):
     """
@@ -15,3 +17,62 @@ def get_battery_state(U_bat, R_bat, P):
     """
     I = (U_bat - np.sqrt(U_bat**2 - 4 * R_bat * P)) / 2 / R_bat
     return U_bat - R_bat * I, I
+
+
+class PowerBusResult:
+    """
+    Result of evaluate_power_bus: all arrays have shape (n_samples,) for bus
+    quantities, (n_motors, n_samples) for motor quantities.
+     - U, I: bus voltage and current
+     - motor_power: electrical power drawn by each motor
+     - max_speed: maximum speed of each motor, at the bus voltage
+     - feasible: whether each motor can reach its working point
+    """
+    def __init__(self, U, I, motor_power, max_speed, feasible):
+        self.U = U
+        self.I = I
+        self.motor_power = motor_power
+        self.max_speed = max_speed
+        self.feasible = feasible
+
+
+def evaluate_power_bus(motors: tp.List[Motor], U_bat: float, R_bat: float, tau: np.array, w: np.array, n_iterations: int = 3):
+    """
+    Evaluate several motors sharing the same battery over time.
+    The battery is modeled as in get_battery_state, the driver voltage of each
+    motor being the bus voltage. Since the power drawn by the motors depends on
+    the bus voltage (through defluxing), the bus voltage is computed by fixed
+    point iterations, each iteration processing all timesteps at once.
+     - motors: list of n_motors motors
+     - U_bat: battery voltage
+     - R_bat: battery resistor
+     - tau, w: articular torque and speed of each motor: arrays of shape
+       (n_motors, n_samples)
+     - n_iterations: number of fixed point iterations
+    Return: a PowerBusResult. Time steps where the battery cannot provide the
+    power are marked as nan (U, I) and not feasible.
+    """
+    tau = np.atleast_2d(np.asarray(tau, dtype=float))
+    w = np.atleast_2d(np.asarray(w, dtype=float))
+    U = np.full(tau.shape[1], float(U_bat))
+    motor_power = np.zeros(tau.shape)
+    with np.errstate(invalid="ignore"):
+        for _ in range(n_iterations):
+            for k, m in enumerate(motors):
+                thermal = m.compute_thermal_power(tau[k], w[k], U=U)
+                # Points outside of the envelope will be marked as not
+                # feasible: just ignore the defluxing current there.
+                thermal = np.where(np.isnan(thermal), m.compute_thermal_power(tau[k], w[k], True), thermal)
+                motor_power[k] = w[k] * tau[k] + thermal
+            U_bus, I = get_battery_state(U_bat, R_bat, np.sum(motor_power, axis=0))
+            # Where the battery is overloaded, keep on iterating at the nominal voltage.
+            U = np.where(np.isnan(U_bus), U_bat, U_bus)
+
+        max_speed = np.zeros(tau.shape)
+        for k, m in enumerate(motors):
+            # Use symmetry: (tau, w) is equivalent to (-tau, -w)
+            sign = np.where(w[k] < 0, -1.0, 1.0)
+            max_speed[k] = m.compute_max_speed_deflux(sign * tau[k], U=U)
+        tau_max = np.array([[m.tau_max] for m in motors])
+        feasible = (np.abs(w) <= max_speed) & (np.abs(tau) <= tau_max) & ~np.isnan(U_bus)
+    return PowerBusResult(U_bus, I, motor_power, max_speed, feasible)
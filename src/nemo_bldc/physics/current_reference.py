@@ -0,0 +1,208 @@
+# Optimal current references: maximum torque per ampere, and field weakening
+import typing as tp
+import numpy as np
+
+from .motor import Motor
+from .lookup_table import LookupTable
+
+# Motors without magnetic model (see MotorMagnetics) have the same inductance
+# on both axes: the maximum torque per ampere is then obtained without direct
+# current, and the only direct current is the one needed to deflux, see
+# Motor.compute_defluxing_current.
+
+
+def _inductances(motor: Motor, i_d, i_q):
+    if motor.magnetics is None:
+        return motor.L, motor.L
+    return motor.magnetics.inductances(i_d, i_q)
+
+
+def _torque(motor: Motor, i_d, i_q):
+    """
+    Mean articular torque, in Nm, reluctance torque included.
+    """
+    L_d, L_q = _inductances(motor, i_d, i_q)
+    return motor.kt_q_art * i_q + 3.0 / 2.0 * motor.np * motor.rho * (L_d - L_q) * i_d * i_q
+
+
+def _voltage(motor: Motor, i_d, i_q, w):
+    """
+    Amplitude of the voltage vector, in V, in steady state.
+    """
+    L_d, L_q = _inductances(motor, i_d, i_q)
+    w_el = motor.np * motor.rho * w
+    return np.hypot(motor.R * i_d - w_el * L_q * i_q, motor.R * i_q + w_el * L_d * i_d + motor.ke * motor.rho * w)
+
+
+def mtpa_currents(motor: Motor, tau: np.array, n_iterations: int = 8):
+    """
+    Maximum torque per ampere: direct and quadrature currents, in A, giving
+    the articular torque tau with the smallest current.
+    With saliency, the currents are on the curve
+    psi id + (Ld - Lq) (id^2 - iq^2) = 0 (psi = ke / np being the rotor flux),
+    solved by fixed point iterations (to account for saturation).
+    """
+    tau = np.asarray(tau, dtype=float)
+    i_q = tau / motor.kt_q_art
+    i_d = np.zeros(i_q.shape)
+    if motor.magnetics is None or motor.magnetics.Ld == motor.magnetics.Lq:
+        return i_d, i_q
+    psi = motor.ke / motor.np
+    for _ in range(n_iterations):
+        L_d, L_q = _inductances(motor, i_d, i_q)
+        dL = L_d - L_q
+        # Root of the MTPA curve with the sign of -dL, written to be exact
+        # without saliency.
+        i_d = 2 * dL * i_q**2 / (psi + np.sqrt(psi**2 + 4 * dL**2 * i_q**2))
+        i_q = tau / (motor.kt_q_art + 3.0 / 2.0 * motor.np * motor.rho * dL * i_d)
+    return i_d, i_q
+
+
+def field_weakening_currents(motor: Motor, tau: np.array, w: np.array, U: tp.Optional[float] = None):
+    """
+    Same as current_references, for a positive speed w, without checking
+    the current limit (like Motor.compute_thermal_power).
+    """
+    U = motor.U if U is None else np.asarray(U)
+    with np.errstate(invalid="ignore"):
+        i_d, i_q = mtpa_currents(motor, tau)
+        weakening = _voltage(motor, i_d, i_q, w) > U / np.sqrt(3)
+        i_d = np.where(weakening, motor.compute_defluxing_current(tau, w, U), i_d)
+        if motor.magnetics is not None:
+            i_q = motor.magnetics.quadrature_current(motor, tau, i_d)
+    return i_d, i_q
+
+
+def current_references(motor: Motor, tau: np.array, w: np.array, U: tp.Optional[float] = None):
+    """
+    Direct and quadrature current references, in A, to produce the articular
+    torque tau at the articular speed w: maximum torque per ampere, as long
+    as the voltage allows it, then field weakening (the smallest direct
+    current reaching the voltage limit, along the constant torque curve).
+    Points which cannot be reached (current or voltage limit) are nan.
+     - U: driver voltage, if different from the motor's (can be an array)
+    """
+    tau = np.asarray(tau, dtype=float)
+    w = np.asarray(w, dtype=float)
+    # Negative speeds, by symmetry: (tau, w) -> (-tau, -w) and iq -> -iq.
+    sign = np.where(w < 0, -1.0, 1.0)
+    i_d, i_q = field_weakening_currents(motor, sign * tau, sign * w, U)
+    with np.errstate(invalid="ignore"):
+        feasible = i_d**2 + i_q**2 <= motor.iq_max**2 * (1 + 1e-9)
+    return np.where(feasible, i_d, np.nan), np.where(feasible, sign * i_q, np.nan)
+
+
+def _limit_currents(motor: Motor, i_d, w, U, sign: float):
+    """
+    Largest (sign = 1) or smallest (sign = -1) quadrature current allowed by
+    the current and voltage limits, for the direct current i_d, and its torque.
+    """
+    w_el = motor.np * motor.rho * w
+    e = motor.ke * motor.rho * w
+    i_circle = np.sqrt(np.maximum(0.0, motor.iq_max**2 - i_d**2))
+    # Voltage limit: quadratic in i_q, at fixed inductances (updated once,
+    # for saturation).
+    i_q = sign * i_circle
+    for _ in range(2):
+        L_d, L_q = _inductances(motor, i_d, i_q)
+        a = motor.R**2 + (w_el * L_q) ** 2
+        b = 2 * motor.R * (w_el * L_d * i_d + e - w_el * L_q * i_d)
+        c = (motor.R * i_d) ** 2 + (w_el * L_d * i_d + e) ** 2 - U**2 / 3
+        root = (-b + sign * np.sqrt(b**2 - 4 * a * c)) / 2 / a
+        i_q = sign * np.fmin(i_circle, sign * root)
+    # Points where the voltage limit cannot be met at all are nan.
+    return i_q, np.where(np.isnan(root), np.nan, _torque(motor, i_d, i_q))
+
+
+def torque_limits(motor: Motor, w: np.array, U: tp.Optional[float] = None, n_points: int = 129):
+    """
+    Minimum and maximum articular torque, in Nm, at the articular speed w,
+    under the current and voltage limits.
+    The direct current is sampled over [-iq_max, iq_max] (n_points), then
+    around the best sample, the quadrature current being the largest allowed
+    by both limits: this covers the maximum torque per ampere, field
+    weakening, and maximum torque per volt regions.
+    Return: min_torque, max_torque, and the corresponding currents
+    (i_d, i_q) at each limit, arrays of the shape of w.
+    """
+    w = np.asarray(w, dtype=float)[..., None]
+    U = motor.U if U is None else np.asarray(U)
+    step = 2 * motor.iq_max / (n_points - 1)
+
+    limits = []
+    with np.errstate(invalid="ignore"):
+        for sign in [-1.0, 1.0]:
+            i_d = np.linspace(-motor.iq_max, motor.iq_max, n_points) + np.zeros(w.shape)
+            for _ in range(2):
+                i_q, torque = _limit_currents(motor, i_d, w, U, sign)
+                valid = ~np.isnan(torque)
+                best = np.argmax(np.where(valid, sign * torque, -np.inf), axis=-1)[..., None]
+                best_i_d = np.take_along_axis(i_d, best, axis=-1)
+                i_d = np.clip(best_i_d + np.linspace(-step, step, n_points), -motor.iq_max, motor.iq_max)
+            limit = np.where(np.any(valid, axis=-1), np.take_along_axis(torque, best, axis=-1)[..., 0], np.nan)
+            limits.append((limit, best_i_d[..., 0], np.take_along_axis(i_q, best, axis=-1)[..., 0]))
+    (min_torque, *min_currents), (max_torque, *max_currents) = limits
+    return min_torque, max_torque, tuple(min_currents), tuple(max_currents)
+
+
+class CurrentReferenceTables:
+    """
+    Tables of the current references of a motor (see current_references),
+    over the torque-speed plane, for fast evaluation (e.g. as a feed-forward
+    of the current controller, in simulate):
+     - direct_current, quadrature_current: (articular torque, speed) -> current
+     - min_torque, max_torque: articular speed -> torque limits
+
+    The tables cover the torque range [-tau_max, tau_max], and speeds from 0
+    to the maximum speed (capped to twice the no-load speed without
+    defluxing): by symmetry, negative speeds are evaluated at (-tau, -w).
+    Torques beyond the limits are saturated: the references are then the
+    currents giving the maximum (or minimum) torque at this speed.
+    """
+
+    def __init__(self, motor: Motor, n_tau: int = 129, n_w: int = 129, U: tp.Optional[float] = None):
+        """
+        Build the tables of a motor.
+         - motor: the motor
+         - n_tau, n_w: number of points of the torque and speed axes
+         - U: driver voltage, if different from the motor's
+        """
+        with np.errstate(invalid="ignore", divide="ignore"):
+            w_max = np.nanmax(motor.compute_max_speed_deflux(np.linspace(-motor.tau_max, motor.tau_max, 1001), U))
+        tau = np.linspace(-motor.tau_max, motor.tau_max, n_tau)
+        w = np.linspace(0, float(np.nanmin([2 * motor.w_max_no_load, w_max])), n_w)
+        min_torque, max_torque, min_currents, max_currents = torque_limits(motor, w, U)
+        self.min_torque = LookupTable([w], np.nan_to_num(min_torque))
+        self.max_torque = LookupTable([w], np.nan_to_num(max_torque))
+
+        t, s = np.meshgrid(tau, w, indexing="ij")
+        i_d, i_q = current_references(motor, t, s, U)
+        # Saturated torque, or not reachable because of the sampling of the
+        # limits: use the currents at the limit.
+        for limit, currents, outside in [(min_torque, min_currents, t < 0), (max_torque, max_currents, t >= 0)]:
+            replace = outside & (np.isnan(i_d) | (np.abs(t) > np.abs(limit)))
+            i_d = np.where(replace, np.nan_to_num(currents[0]), i_d)
+            i_q = np.where(replace, np.nan_to_num(currents[1]), i_q)
+        self.direct_current = LookupTable([tau, w], i_d)
+        self.quadrature_current = LookupTable([tau, w], i_q)
+        self.R = motor.R
+
+    def __call__(self, tau, w):
+        """
+        Direct and quadrature current references, in A.
+        """
+        if isinstance(w, float) or np.ndim(w) == 0:
+            if w < 0:
+                return self.direct_current(-tau, -w), -self.quadrature_current(-tau, -w)
+            return self.direct_current(tau, w), self.quadrature_current(tau, w)
+        sign = np.where(np.asarray(w) < 0, -1.0, 1.0)
+        tau = sign * np.asarray(tau)
+        w = sign * np.asarray(w)
+        return self.direct_current(tau, w), sign * self.quadrature_current(tau, w)
+
+    def compute_thermal_power(self, tau, w):
+        """
+        Thermal power, in W, with the current references.
+        """
+        i_d, i_q = self(tau, w)
+        return 3.0 / 2.0 * self.R * (i_d**2 + i_q**2)
@@ -0,0 +1,148 @@
+# Quasi-static energy consumption of a library of motors over a drive cycle
+import typing as tp
+import numpy as np
+
+from .motor import Motor
+from .battery import get_battery_state
+from .efficiency_map import EfficiencyMaps
+
+
+class DriveCycleResult:
+    """
+    Result of evaluate_drive_cycle: all arrays have shape (n_motors,).
+    Energies are in J, powers in W, times in s.
+     - names: names of the motors
+     - mechanical_energy, thermal_energy, inverter_energy, electrical_energy:
+       energy produced, dissipated in the windings and in the inverter (see
+       EfficiencyMaps.inverter_power), and provided to the motor and its
+       inverter (negative if the motor recovers energy)
+     - battery_energy: energy drawn from the battery (open circuit voltage x
+       current), including the losses in the battery resistor
+     - peak_electrical_power, rms_thermal_power
+     - min_battery_voltage, max_battery_voltage: voltage at the battery terminals
+     - violations: number of samples outside of the torque-speed envelope of
+       the motor (or for which the battery cannot provide the power): they
+       are not included in the energies
+     - violation_duration: total duration of these samples
+     - first_violation: time of the first violation (nan if none)
+    """
+    def __init__(self, names: tp.List[str], duration: float):
+        n = len(names)
+        self.names = names
+        self.duration = duration
+        self.mechanical_energy = np.zeros(n)
+        self.thermal_energy = np.zeros(n)
+        self.inverter_energy = np.zeros(n)
+        self.electrical_energy = np.zeros(n)
+        self.battery_energy = np.zeros(n)
+        self.peak_electrical_power = np.full(n, -np.inf)
+        self.rms_thermal_power = np.zeros(n)
+        self.min_battery_voltage = np.full(n, np.inf)
+        self.max_battery_voltage = np.full(n, -np.inf)
+        self.violations = np.zeros(n, dtype=int)
+        self.violation_duration = np.zeros(n)
+        self.first_violation = np.full(n, np.nan)
+
+    @property
+    def feasible(self):
+        """
+        Whether each motor can follow the whole cycle.
+        """
+        return self.violations == 0
+
+    @property
+    def average_efficiency(self):
+        """
+        Mechanical / electrical energy, in %, over the cycle.
+        """
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return 100 * self.mechanical_energy / self.electrical_energy
+
+    def __getitem__(self, name: str):
+        """
+        Summary of a motor, as a dictionary.
+        """
+        k = self.names.index(name)
+        return {key: value[k] for key, value in vars(self).items() if isinstance(value, np.ndarray)}
+
+
+def evaluate_drive_cycle(maps: tp.Union[EfficiencyMaps, tp.Dict[str, Motor]],
+                         time: np.array,
+                         tau: np.array,
+                         w: np.array,
+                         battery_resistance: float = 0.0,
+                         battery_voltage: tp.Optional[np.array] = None,
+                         chunk_size: int = 2**16):
+    """
+    Energy consumption of several motors following the same drive cycle.
+
+    The evaluation is quasi-static: at each sample, the thermal power is
+    interpolated in the precomputed efficiency maps (the mechanical power being
+    tau x w), and each motor is powered by its own battery (see
+    get_battery_state). The power of sample i is applied from sample i - 1 to
+    sample i, like in simulate(). The cycle is processed by chunks, all the
+    motors at once, so that long cycles (millions of samples) only need a few
+    arrays of shape (n_motors, chunk_size).
+    Note that the envelope is resolved at the resolution of the maps: a point
+    in a cell crossing the envelope is reported as a violation.
+    Parameters:
+     - maps: EfficiencyMaps of the motors, or a library of motors (name:
+       Motor), whose maps are then computed with EfficiencyMaps.FromLibrary
+     - time: time of each sample, in s, increasing
+     - tau, w: articular torque and speed, in Nm and rad/s, same shape as time
+     - battery_resistance: internal resistance of the batteries, in Ohm
+     - battery_voltage: open circuit voltage of the batteries, for each motor
+       (default: the driver voltage of the motor). Note that the maps are
+       computed at the driver voltage, whatever the battery voltage.
+     - chunk_size: number of samples processed at once
+    Return: a DriveCycleResult
+    """
+    if not isinstance(maps, EfficiencyMaps):
+        maps = EfficiencyMaps.FromLibrary(maps)
+    time = np.asarray(time, dtype=float)
+    tau = np.broadcast_to(np.asarray(tau, dtype=float), time.shape)
+    w = np.broadcast_to(np.asarray(w, dtype=float), time.shape)
+    U_bat = (maps.U if battery_voltage is None else np.broadcast_to(np.asarray(battery_voltage, dtype=float), maps.U.shape))[:, None]
+
+    result = DriveCycleResult(maps.names, time[-1] - time[0])
+    squared_thermal_power = np.zeros(len(maps))
+    has_inverter = np.any(maps.inverter_power > 0)
+    for a in range(0, len(time), chunk_size):
+        window = slice(a, min(a + chunk_size, len(time)))
+        dt = np.diff(time[window], prepend=time[a - 1] if a > 0 else time[0])
+        mechanical = tau[window] * w[window]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            thermal = maps.interpolate_all(tau[window], w[window], "thermal_power")
+            inverter = maps.interpolate_all(tau[window], w[window], "inverter_power") if has_inverter else 0.0 * thermal
+            electrical = mechanical + thermal + inverter
+            if battery_resistance > 0:
+                U, I = get_battery_state(U_bat, battery_resistance, electrical)
+            else:
+                U, I = np.where(np.isnan(electrical), np.nan, U_bat), electrical / U_bat
+        violation = np.isnan(I)
+        # Violations are excluded from the energies (and peaks).
+        thermal[violation] = 0.0
+        inverter[violation] = 0.0
+        I[violation] = 0.0
+        valid_dt = np.where(violation, 0.0, dt)
+
+        result.mechanical_energy += valid_dt @ mechanical
+        result.thermal_energy += thermal @ dt
+        result.inverter_energy += inverter @ dt
+        result.battery_energy += U_bat[:, 0] * (I @ dt)
+        squared_thermal_power += (thermal * thermal) @ dt
+        electrical = np.where(violation, -np.inf, mechanical + thermal + inverter)
+        result.peak_electrical_power = np.maximum(result.peak_electrical_power, np.max(electrical, axis=1))
+        result.min_battery_voltage = np.fmin(result.min_battery_voltage, np.fmin.reduce(U, axis=1))
+        result.max_battery_voltage = np.fmax(result.max_battery_voltage, np.fmax.reduce(U, axis=1))
+
+        result.violations += np.count_nonzero(violation, axis=1)
+        result.violation_duration += violation @ dt
+        first = np.argmax(violation, axis=1)
+        new = np.isnan(result.first_violation) & violation[np.arange(len(maps)), first]
+        result.first_violation[new] = time[window][first[new]]
+
+    result.electrical_energy = result.mechanical_energy + result.thermal_energy + result.inverter_energy
+    with np.errstate(invalid="ignore", divide="ignore"):
+        result.rms_thermal_power = np.sqrt(squared_thermal_power / (result.duration - result.violation_duration))
+    return result
@@ -0,0 +1,249 @@
+# Efficiency maps of a library of motors, for use by other tools
+import typing as tp
+import numpy as np
+
+from .motor import Motor
+from .battery import get_battery_state
+from .lookup_table import LookupTable
+from .inverter import Inverter
+
+QUANTITIES = ["mechanical_power", "thermal_power", "inverter_power", "electrical_power", "efficiency"]
+
+
+class EfficiencyMaps:
+    """
+    Mechanical and thermal power of several motors (and losses of their
+    inverter), sampled on a torque-speed grid.
+
+    The grid is shared by all the motors, in relative units: the torque axis
+    of motor k is tau_scale[k] * tau, and its speed axis w_scale[k] * w (by
+    default, the axes go from -1 to 1 and 0 to 1, scaled by the maximum
+    torque and speed of each motor, so that all motors have the same
+    resolution).
+    Maps are stored as float32 arrays of shape (n_motors, len(tau), len(w)),
+    and are nan outside of the torque-speed envelope of each motor (with
+    defluxing). They can be saved to a compressed file, and queried by
+    bilinear interpolation (see interpolate), so that a drive-cycle tool does
+    not need to evaluate the motor model.
+    The speed axis starts at 0: negative speeds are evaluated by symmetry,
+    at (-tau, -w).
+    """
+
+    @staticmethod
+    def FromLibrary(library: tp.Dict[str, Motor],
+                    tau: tp.Optional[np.array] = None,
+                    w: tp.Optional[np.array] = None,
+                    n_tau: int = 201,
+                    n_w: int = 201,
+                    inverter: tp.Optional[Inverter] = None,
+                    commutation_frequency: float = 10000):
+        """
+        Compute the maps of all the motors of a library, at once.
+         - library: dictionary of motors (name: Motor)
+         - tau, w: articular torque and speed axes, regularly spaced, in Nm
+           and rad/s, used for all the motors. By default, n_tau points from
+           -max to max torque and n_w points from 0 to max speed (capped to
+           twice the no-load speed without defluxing), for each motor.
+         - inverter: if set, the losses of this inverter (the same for all
+           the motors), at the commutation frequency in Hz, are included in
+           the electrical power
+        """
+        names = list(library.keys())
+        motors = [library[n] for n in names]
+
+        # A single motor, with parameter arrays of shape (n_motors, 1, 1).
+        def parameter(f):
+            return np.array([f(x) for x in motors], dtype=float)[:, None, None]
+        m = Motor(parameter(lambda x: 2 * x.np), parameter(lambda x: x.R), parameter(lambda x: x.L),
+                  parameter(lambda x: x.ke), parameter(lambda x: x.iq_max), parameter(lambda x: x.iq_nominal),
+                  parameter(lambda x: x.U), parameter(lambda x: x.rho))
+        with np.errstate(invalid="ignore", divide="ignore"):
+            if tau is None:
+                tau = np.linspace(-1, 1, n_tau)
+                tau_scale = m.tau_max[:, 0, 0]
+            else:
+                tau_scale = np.ones(len(motors))
+            if w is None:
+                w = np.linspace(0, 1, n_w)
+                w_scale = np.fmin(m.compute_max_speed_deflux(0.0), 2 * m.w_max_no_load)[:, 0, 0]
+            else:
+                w_scale = np.ones(len(motors))
+            t = np.asarray(tau, dtype=float)[:, None] * tau_scale[:, None, None]
+            s = np.asarray(w, dtype=float)[None, :] * w_scale[:, None, None]
+            # At zero torque, the maximum speed is nan (0 / 0) when the motor
+            # can fully deflux: the speed is then unlimited.
+            max_speed = np.nan_to_num(m.compute_max_speed_deflux(t), nan=np.inf)
+            thermal = m.compute_thermal_power(t, s)
+            # The parameter arrays do not carry the magnetic models (saliency,
+            # saturation): these motors are evaluated one at a time.
+            for k, motor in enumerate(motors):
+                if motor.magnetics is not None:
+                    max_speed[k] = np.nan_to_num(motor.compute_max_speed_deflux(t[k]), nan=np.inf)
+                    thermal[k] = motor.compute_thermal_power(t[k], s[k])
+            feasible = (np.abs(t) <= m.tau_max) & (s <= max_speed)
+            mechanical = np.where(feasible, t * s, np.nan)
+            thermal = np.where(feasible, thermal, np.nan)
+            inverter_power = None
+            if inverter is not None:
+                # Amplitude of the current vector, from the thermal power.
+                current = np.sqrt(thermal / (3.0 / 2.0 * m.R))
+                inverter_power = inverter.compute_mean_losses(current, m.U, commutation_frequency)
+        return EfficiencyMaps(names, tau, w, tau_scale, w_scale, mechanical, thermal, [x.U for x in motors], inverter_power)
+
+    @staticmethod
+    def FromMotor(motor: Motor, name: str = "motor", **kwargs):
+        """
+        Compute the maps of a single motor (same options as FromLibrary).
+        """
+        return EfficiencyMaps.FromLibrary({name: motor}, **kwargs)
+
+    @staticmethod
+    def FromFile(filename: str):
+        """
+        Load maps saved with save.
+        """
+        with np.load(filename) as data:
+            # Files saved before the inverter model have no inverter losses.
+            inverter_power = data["inverter_power"] if "inverter_power" in data.files else None
+            return EfficiencyMaps(list(data["names"]), data["tau"], data["w"], data["tau_scale"], data["w_scale"],
+                                  data["mechanical_power"], data["thermal_power"], data["U"], inverter_power)
+
+    def __init__(self, names: tp.List[str], tau: np.array, w: np.array, tau_scale: np.array, w_scale: np.array,
+                 mechanical_power: np.array, thermal_power: np.array, U: np.array,
+                 inverter_power: tp.Optional[np.array] = None):
+        """
+         - names: names of the motors
+         - tau, w: shared torque and speed axes
+         - tau_scale, w_scale: scale of the axes, for each motor
+         - mechanical_power, thermal_power: maps, shape (len(names), len(tau), len(w))
+         - U: driver voltage of each motor
+         - inverter_power: losses of the inverter, same shape as the maps
+           (default: ideal inverter)
+        """
+        self.names = [str(n) for n in names]
+        self.tau = np.asarray(tau, dtype=np.float32)
+        self.w = np.asarray(w, dtype=np.float32)
+        self.tau_scale = np.asarray(tau_scale, dtype=float)
+        self.w_scale = np.asarray(w_scale, dtype=float)
+        self.mechanical_power = np.asarray(mechanical_power, dtype=np.float32)
+        self.thermal_power = np.asarray(thermal_power, dtype=np.float32)
+        self.U = np.asarray(U, dtype=float)
+        if inverter_power is None:
+            inverter_power = np.where(np.isnan(self.thermal_power), np.nan, 0.0)
+        self.inverter_power = np.asarray(inverter_power, dtype=np.float32)
+        self._tables = {}
+
+    def __len__(self):
+        return len(self.names)
+
+    def save(self, filename: str):
+        """
+        Save the maps to a compressed .npz file.
+        """
+        np.savez_compressed(filename, names=np.array(self.names), tau=self.tau, w=self.w,
+                            tau_scale=self.tau_scale, w_scale=self.w_scale, U=self.U,
+                            mechanical_power=self.mechanical_power, thermal_power=self.thermal_power,
+                            inverter_power=self.inverter_power)
+
+    def axes(self, name: str):
+        """
+        Torque and speed axes of a motor, in Nm and rad/s.
+        """
+        k = self.names.index(name)
+        return self.tau_scale[k] * self.tau.astype(float), self.w_scale[k] * self.w.astype(float)
+
+    @property
+    def electrical_power(self):
+        """
+        Power drawn by the motor and its inverter (mechanical + thermal +
+        inverter losses), in W.
+        """
+        return self.mechanical_power + self.thermal_power + self.inverter_power
+
+    @property
+    def efficiency(self):
+        """
+        Efficiency, in %: mechanical / electrical power when the motor
+        provides power, electrical / mechanical power when it brakes.
+        """
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.where(self.mechanical_power >= 0,
+                            100 * self.mechanical_power / self.electrical_power,
+                            100 * self.electrical_power / self.mechanical_power).astype(np.float32)
+
+    def get(self, name: str, quantity: str = "thermal_power"):
+        """
+        Return the map of a motor, shape (len(tau), len(w)).
+         - quantity: one of QUANTITIES
+        """
+        if quantity not in QUANTITIES:
+            raise ValueError(f"Unknown quantity {quantity}, expected one of {QUANTITIES}")
+        return getattr(self, quantity)[self.names.index(name)]
+
+    def battery_voltage(self, name: str, battery_resistance: float):
+        """
+        Map of the battery voltage, for a battery of the driver voltage and
+        of internal resistance battery_resistance (see get_battery_state).
+        """
+        k = self.names.index(name)
+        return get_battery_state(self.U[k], battery_resistance, self.electrical_power[k].astype(float))[0]
+
+    def interpolate(self, name: str, tau: np.array, w: np.array, quantity: str = "thermal_power"):
+        """
+        Evaluate a map at arbitrary points (articular torque and speed), by
+        bilinear interpolation. Points outside of the envelope (or in a cell
+        crossing it) are nan.
+        """
+        key = (name, quantity)
+        if key not in self._tables:
+            self._tables[key] = LookupTable(self.axes(name), self.get(name, quantity))
+        tau_axis, w_axis = self._tables[key].axes
+        tau = np.asarray(tau, dtype=float)
+        w = np.asarray(w, dtype=float)
+        sign = np.where(w < 0, -1.0, 1.0)
+        tau = sign * tau
+        w = sign * w
+        outside = (tau < tau_axis[0]) | (tau > tau_axis[-1]) | (w > w_axis[-1])
+        return np.where(outside, np.nan, self._tables[key](tau, w))
+
+    def interpolate_all(self, tau: np.array, w: np.array, quantity: str = "thermal_power"):
+        """
+        Same as interpolate, for all the motors at once, using the shared
+        grid: return an array of shape (n_motors,) + shape of tau and w.
+        """
+        if quantity not in QUANTITIES:
+            raise ValueError(f"Unknown quantity {quantity}, expected one of {QUANTITIES}")
+        values = getattr(self, quantity).reshape(-1)
+        tau = np.asarray(tau, dtype=float)
+        w = np.asarray(w, dtype=float)
+        expand = (slice(None),) + (None,) * max(np.ndim(tau), np.ndim(w))
+        sign = np.where(w < 0, -1.0, 1.0)
+        n_tau, n_w = len(self.tau), len(self.w)
+
+        # Position on the grid of each motor, in number of cells (in float32,
+        # like the maps): the cells are located by flat indexing, to avoid
+        # broadcasting index arrays.
+        def locate(axis, scale, x):
+            step = float(axis[-1] - axis[0]) / (len(axis) - 1)
+            u = x.astype(np.float32) * (1 / (scale * step)).astype(np.float32)[expand]
+            u -= np.float32(axis[0] / step)
+            outside = ~((u >= 0) & (u <= len(axis) - 1))
+            np.clip(u, 0, len(axis) - 1, out=u)
+            i = np.minimum(u.astype(np.intp), len(axis) - 2)
+            u -= i
+            return i, u, outside
+
+        i, a, outside = locate(self.tau, self.tau_scale, sign * tau)
+        j, b, outside_w = locate(self.w, self.w_scale, np.abs(w))
+        outside |= outside_w
+        index = i * n_w + j
+        index += (n_tau * n_w * np.arange(len(self))).reshape((-1,) + (1,) * (index.ndim - 1))
+        low = values.take(index)
+        low += b * (values.take(index + 1) - low)
+        index += n_w
+        high = values.take(index)
+        high += b * (values.take(index + 1) - high)
+        result = low
+        result += a * (high - low)
+        result[outside] = np.nan
+        return result
@@ -0,0 +1,150 @@
+# Identification of the motor parameters from measured data
+import typing as tp
+import numpy as np
+
+from .motor import Motor
+
+
+class MotorIdentifier:
+    """
+    Estimate the parameters R, L, ke and the number of poles of a motor from
+    logs of its phase currents and voltages, position and speed.
+
+    The phase electrical equation (see simulate.MotorSimulator) is linear in
+    the parameters:
+        V = R i + L di/dt - ke rho w bemf(np rho theta)
+    Only the back-EMF regressor depends on the number of poles: the normal
+    equations of the least squares problem are accumulated for all candidate
+    pole counts at once, the best count being the one of smallest residual.
+
+    Since only the normal equations are stored, the logs can be processed by
+    chunks of any size (see add_samples): the memory usage does not depend on
+    the amount of data.
+    """
+
+    def __init__(self, reduction_ratio: float, pole_candidates: tp.Iterable[int] = range(2, 62, 2),
+                 torque_weight: float = 1.0, block_size: int = 65536):
+        """
+         - reduction_ratio: reduction ratio of the actuator (known)
+         - pole_candidates: numbers of poles to consider
+         - torque_weight: weight of the torque equation tau = 3/2 rho ke iq,
+           when the torque is measured, relative to the voltage equations
+         - block_size: number of samples processed at once, to limit memory usage
+        """
+        self.rho = reduction_ratio
+        self.pole_candidates = np.asarray(list(pole_candidates))
+        self.torque_weight = torque_weight
+        self.block_size = block_size
+        n = len(self.pole_candidates)
+        # Normal equations for each candidate: X^T X, X^T y and y^T y.
+        self.XTX = np.zeros((n, 3, 3))
+        self.XTy = np.zeros((n, 3))
+        self.yTy = 0.0
+        self.n_samples = 0
+
+    def add_samples(self, dt: float, theta: np.array, w: np.array, iphase: np.array, Vphase: np.array,
+                    tau: tp.Optional[np.array] = None):
+        """
+        Add a chunk of consecutive samples to the estimation.
+         - dt: sampling period, in s
+         - theta, w: articular position and speed, shape (n,)
+         - iphase: phase currents, shape (3, n)
+         - Vphase: phase voltages, shape (3, n) or (3, n - 1): Vphase[:, k] is
+           the voltage applied between samples k and k + 1
+         - tau: articular torque, shape (n,), if measured
+        The current derivative is computed by finite difference between
+        successive samples: each chunk provides n - 1 equations per phase.
+        Chunks do not need to be contiguous.
+        """
+        theta = np.asarray(theta, dtype=float)
+        w = np.asarray(w, dtype=float)
+        iphase = np.asarray(iphase, dtype=float)
+        Vphase = np.asarray(Vphase, dtype=float)
+        n = len(theta) - 1
+        if n < 1:
+            return
+        di = np.diff(iphase, axis=1) / dt
+        i = iphase[:, :n]
+        V = Vphase[:, :n]
+
+        # Terms common to all candidates.
+        self.XTX[:, 0, 0] += np.sum(i * i)
+        self.XTX[:, 0, 1] += np.sum(i * di)
+        self.XTX[:, 1, 1] += np.sum(di * di)
+        self.XTy[:, 0] += np.sum(i * V)
+        self.XTy[:, 1] += np.sum(di * V)
+        self.yTy += np.sum(V * V)
+        if tau is not None:
+            self.yTy += self.torque_weight**2 * np.sum(np.asarray(tau, dtype=float)[:n]**2)
+
+        # Back-EMF regressor, for all candidates: with the phase shifts s_k,
+        # e_k = - rho w sin(theta_el + s_k) = - rho w (sin(theta_el) cos(s_k) + cos(theta_el) sin(s_k)),
+        # thus the sums over the phases reduce to products with sin(theta_el)
+        # and cos(theta_el), the only terms depending on the candidate.
+        shift = np.array([0, -2 * np.pi / 3, 2 * np.pi / 3])
+        cos_shift = np.cos(shift)[:, None]
+        sin_shift = np.sin(shift)[:, None]
+        rho_w = self.rho * w[:n]
+        sums = {}
+        for name, x in [("i", i), ("di", di), ("V", V)]:
+            sums[name] = (- rho_w * np.sum(cos_shift * x, axis=0), - rho_w * np.sum(sin_shift * x, axis=0))
+        # sum_k e_k^2 = 3/2 (rho w)^2, whatever the angle.
+        self.XTX[:, 2, 2] += 3.0 / 2.0 * np.sum(rho_w**2)
+        if tau is not None:
+            # Clarke transform of the current, to compute the quadrature current.
+            tau = np.asarray(tau, dtype=float)[:n]
+            alpha = 2.0 / 3.0 * (i[0] - i[1] / 2 - i[2] / 2)
+            beta = 1.0 / np.sqrt(3) * (i[1] - i[2])
+            x = self.torque_weight * 3.0 / 2.0 * self.rho
+        pole_pairs = self.pole_candidates[:, None] / 2
+        for start in range(0, n, self.block_size):
+            b = slice(start, min(start + self.block_size, n))
+            theta_el = pole_pairs * self.rho * theta[None, b]
+            sin = np.sin(theta_el)
+            cos = np.cos(theta_el)
+            for (row, col), name in [((0, 2), "i"), ((1, 2), "di")]:
+                self.XTX[:, row, col] += sin @ sums[name][0][b] + cos @ sums[name][1][b]
+            self.XTy[:, 2] += sin @ sums["V"][0][b] + cos @ sums["V"][1][b]
+            if tau is not None:
+                # tau = ke x iq, with iq = - sin(theta_el) alpha + cos(theta_el) beta
+                iq = - sin * alpha[b] + cos * beta[b]
+                self.XTX[:, 2, 2] += x**2 * np.sum(iq * iq, axis=1)
+                self.XTy[:, 2] += self.torque_weight * x * (iq @ tau[b])
+        self.n_samples += n
+
+    def _solve(self):
+        XTX = np.copy(self.XTX)
+        XTX[:, 1, 0] = XTX[:, 0, 1]
+        XTX[:, 2, 0] = XTX[:, 0, 2]
+        XTX[:, 2, 1] = XTX[:, 1, 2]
+        parameters = np.linalg.solve(XTX, self.XTy[:, :, None])[:, :, 0]
+        # Residual sum of squares: y^T y - 2 p^T X^T y + p^T X^T X p = y^T y - p^T X^T y
+        residuals = self.yTy - np.sum(parameters * self.XTy, axis=1)
+        return parameters, residuals
+
+    def get_parameters(self):
+        """
+        Return the estimated parameters, for the best number of poles, as a
+        dictionary: n (number of poles), R, L, ke, and rms_error (rms voltage
+        error of the fit, per phase).
+        The rms error of each candidate is also given, in rms_error_candidates.
+        """
+        parameters, residuals = self._solve()
+        rms = np.sqrt(np.maximum(residuals, 0) / (3 * max(self.n_samples, 1)))
+        best = int(np.argmin(rms))
+        return {
+            "n": int(self.pole_candidates[best]),
+            "R": float(parameters[best, 0]),
+            "L": float(parameters[best, 1]),
+            "ke": float(parameters[best, 2]),
+            "rms_error": float(rms[best]),
+            "rms_error_candidates": rms,
+        }
+
+    def get_motor(self, iq_max: float, iq_nominal: float, U: float):
+        """
+        Return a motor with the estimated parameters. The current limits and
+        the voltage, which cannot be identified, must be given.
+        """
+        p = self.get_parameters()
+        return Motor(p["n"], p["R"], p["L"], p["ke"], iq_max, iq_nominal, U, self.rho)
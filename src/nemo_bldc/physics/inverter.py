@@ -0,0 +1,82 @@
+# Losses of the three-phase inverter driving the motor
+import numpy as np
+
+from .motor import Motor
+
+
+class Inverter:
+    """
+    Losses of a three-phase inverter: three legs of two MOSFETs, with
+    synchronous rectification, switching at the commutation (PWM) frequency f.
+
+    For a leg carrying the phase current i, supplied with the voltage U:
+     - conduction: R_on i^2, one of the two switches conducting at any time
+       (whatever the duty cycle)
+     - switching: 1/2 U |i| t_sw f, each transition (rise and fall, of total
+       duration t_sw) being hard switched with linear voltage and current
+     - dead time: 2 V_f |i| t_dead f, the body diode (forward voltage V_f)
+       conducting during the two dead times of each period
+    The losses thus depend only on the phase currents: they can be evaluated
+    at each step of a simulation (compute_losses), and, for sinusoidal
+    currents of amplitude I (mean of |i| over a period: 2 I / pi), in steady
+    state (compute_mean_losses):
+        3/2 R_on I^2 + 6 / pi (1/2 U t_sw + 2 V_f t_dead) f I
+    The effect of the dead time on the phase voltages is not modeled.
+
+    All parameters can be arrays, to evaluate several inverters in a single
+    call through numpy broadcasting.
+    """
+
+    def __init__(self,
+                 on_resistance: float = 0.0,
+                 switching_time: float = 0.0,
+                 dead_time: float = 0.0,
+                 diode_voltage: float = 0.7):
+        """
+        Build an inverter
+         - on_resistance: drain-source resistance of a MOSFET when on, in Ohm
+         - switching_time: rise time + fall time of a MOSFET, in s
+         - dead_time: dead time between the two switches of a leg, in s
+         - diode_voltage: forward voltage of the body diodes, in V
+        """
+        self.on_resistance = on_resistance
+        self.switching_time = switching_time
+        self.dead_time = dead_time
+        self.diode_voltage = diode_voltage
+
+    def linear_coefficient(self, U, frequency):
+        """
+        Switching and dead-time losses of a leg, per ampere of phase current,
+        in W/A, for the supply voltage U and the commutation frequency.
+        """
+        return (0.5 * U * self.switching_time + 2 * self.diode_voltage * self.dead_time) * frequency
+
+    def compute_losses(self, iphase: np.array, U, frequency):
+        """
+        Instantaneous losses, in W, for the phase currents iphase (array of
+        shape (3, ...), e.g. SimulationResult.iphase).
+        """
+        iphase = np.asarray(iphase)
+        return self.on_resistance * np.sum(iphase**2, axis=0) \
+            + self.linear_coefficient(U, frequency) * np.sum(np.abs(iphase), axis=0)
+
+    def compute_mean_losses(self, current, U, frequency):
+        """
+        Mean losses, in W, for sinusoidal phase currents of amplitude current
+        (the amplitude of the dq current vector).
+        """
+        current = np.asarray(current)
+        return 3.0 / 2.0 * self.on_resistance * current**2 \
+            + 6 / np.pi * self.linear_coefficient(U, frequency) * current
+
+    def compute_motor_losses(self, motor: Motor, tau, w, frequency, U=None):
+        """
+        Mean losses, in W, when the motor produces the articular torque tau at
+        the articular speed w (with defluxing if needed, see
+        Motor.compute_thermal_power), supplied with U (default: motor.U).
+        """
+        U = motor.U if U is None else U
+        # The thermal power gives the amplitude of the current vector,
+        # direct current included.
+        current = np.sqrt(motor.compute_thermal_power(tau, w, U=U) / (3.0 / 2.0 * motor.R))
+        return self.compute_mean_losses(current, U, frequency)
@@ -0,0 +1,200 @@
+# Lookup tables, to evaluate the motor model in real-time applications
+import typing as tp
+import numpy as np
+
+from .motor import Motor
+
+
+class LookupTable:
+    """
+    A function sampled on a regular 1D or 2D grid, evaluated by linear
+    (resp. bilinear) interpolation.
+    Inputs outside of the grid are clamped to the grid ; nan inputs, and
+    points of a cell with a nan node, give nan.
+    """
+
+    @staticmethod
+    def FromFunction(function: tp.Callable,
+                     ranges: tp.List[tp.Tuple[float, float]],
+                     tolerance: float,
+                     n_initial: int = 17,
+                     n_max: int = 1025):
+        """
+        Build a table from a vectorized function, refining the grid until the
+        interpolation error is below tolerance.
+        The interpolation error is estimated on a grid 4 (in 1D) or 2 (in 2D)
+        times finer than the table. Points where the function is not defined
+        (nan) are ignored.
+        At the boundary of the domain where the function is defined, the cells
+        with a nan node give nan, even where the function is defined: these
+        points are not covered by the error attribute, but counted by the
+        missing_fraction attribute (fraction of the points where the function
+        is defined, for which the table gives nan).
+         - function: function of 1 or 2 arrays, returning an array
+         - ranges: [(min, max)] for each input
+         - tolerance: maximum absolute interpolation error
+         - n_initial: initial number of points per axis
+         - n_max: maximum number of points per axis (the tolerance may not be
+           reached then: see the error attribute)
+        """
+        n = n_initial
+        while True:
+            axes = [np.linspace(a, b, n) for a, b in ranges]
+            table = LookupTable(axes, function(*np.meshgrid(*axes, indexing="ij")))
+            # Evaluate on a finer grid, inside each cell.
+            k = 4 if len(ranges) == 1 else 2
+            check_axes = [np.linspace(a, b, k * (n - 1) + 1) for a, b in ranges]
+            grid = np.meshgrid(*check_axes, indexing="ij")
+            with np.errstate(invalid="ignore"):
+                expected = function(*grid)
+                error = np.abs(table(*grid) - expected)
+            table.error = np.nanmax(error) if np.any(np.isfinite(error)) else 0.0
+            defined = ~np.isnan(expected)
+            table.missing_fraction = float(np.mean(np.isnan(error[defined]))) if np.any(defined) else 0.0
+            if table.error <= tolerance or 2 * n - 1 > n_max:
+                return table
+            n = 2 * n - 1
+
+    @staticmethod
+    def FromFile(filename: str):
+        """
+        Load a table saved with save.
+        """
+        data = np.load(filename)
+        axes = [data[f"axis_{i}"] for i in range(data["values"].ndim)]
+        table = LookupTable(axes, data["values"])
+        table.error = float(data["error"])
+        # Files saved before missing_fraction was introduced.
+        table.missing_fraction = float(data["missing_fraction"]) if "missing_fraction" in data else np.nan
+        return table
+
+    def __init__(self, axes: tp.List[np.array], values: np.array):
+        """
+        Build a table from sampled values.
+         - axes: list of 1 or 2 regularly spaced arrays, in increasing order
+         - values: array of shape (len(axes[0]), len(axes[1]))
+        """
+        self.axes = [np.asarray(x, dtype=float) for x in axes]
+        self.values = np.asarray(values, dtype=float)
+        self.error = np.nan
+        self.missing_fraction = np.nan
+        self._origin = [float(x[0]) for x in self.axes]
+        self._step = [float(x[-1] - x[0]) / (len(x) - 1) for x in self.axes]
+        self._n = [len(x) for x in self.axes]
+        self._values_list = None
+
+    def save(self, filename: str):
+        """
+        Save the table to a (.npz) file.
+        """
+        axes = {f"axis_{i}": x for i, x in enumerate(self.axes)}
+        np.savez(filename, values=self.values, error=self.error, missing_fraction=self.missing_fraction, **axes)
+
+    def _locate(self, k, x):
+        """
+        Return cell index and position inside the cell along axis k (nan
+        position, in the first cell, for nan inputs).
+        """
+        u = np.clip((np.asarray(x, dtype=float) - self._origin[k]) / self._step[k], 0, self._n[k] - 1)
+        i = np.minimum(np.where(np.isnan(u), 0.0, u).astype(int), self._n[k] - 2)
+        return i, u - i
+
+    def __call__(self, *x):
+        """
+        Evaluate the table, for scalar or array inputs.
+        """
+        if all(isinstance(y, float) or np.ndim(y) == 0 for y in x):
+            return self._evaluate_scalar(*x)
+        if len(self.axes) == 1:
+            i, a = self._locate(0, x[0])
+            return (1 - a) * self.values[i] + a * self.values[i + 1]
+        i, a = self._locate(0, x[0])
+        j, b = self._locate(1, x[1])
+        v = self.values
+        return (1 - a) * ((1 - b) * v[i, j] + b * v[i, j + 1]) + a * ((1 - b) * v[i + 1, j] + b * v[i + 1, j + 1])
+
+    def _evaluate_scalar(self, *x):
+        # Same as __call__ using python floats and lists, avoiding the overhead
+        # of numpy for a single point.
+        if self._values_list is None:
+            self._values_list = self.values.tolist()
+        v = self._values_list
+        u = (x[0] - self._origin[0]) / self._step[0]
+        # nan input (u != u is the fastest test on a python float).
+        if u != u:
+            return np.nan
+        u = min(max(u, 0.0), self._n[0] - 1)
+        i = min(int(u), self._n[0] - 2)
+        a = u - i
+        if len(x) == 1:
+            return (1 - a) * v[i] + a * v[i + 1]
+        u = (x[1] - self._origin[1]) / self._step[1]
+        if u != u:
+            return np.nan
+        u = min(max(u, 0.0), self._n[1] - 1)
+        j = min(int(u), self._n[1] - 2)
+        b = u - j
+        return (1 - a) * ((1 - b) * v[i][j] + b * v[i][j + 1]) + a * ((1 - b) * v[i + 1][j] + b * v[i + 1][j + 1])
+
+
+class MotorLookupTables:
+    """
+    Tables of the operating limits and losses of a motor, for fast
+    evaluation:
+     - max_speed: articular torque -> maximum articular speed, with defluxing
+     - max_speed_no_deflux: articular torque -> maximum articular speed, without defluxing
+     - defluxing_current: (articular torque, speed) -> direct current
+     - thermal_power: (articular torque, speed) -> thermal power
+
+    The tables cover the torque range [-tau_max, tau_max], and speeds from 0 to the
+    maximum speed with defluxing (capped to twice the no-load speed without
+    defluxing): by symmetry, negative speeds are evaluated at (-tau, -w).
+    Values are nan outside of the feasible region.
+    """
+
+    def __init__(self, motor: Motor, relative_tolerance: float = 1e-3, n_max: int = 1025):
+        """
+        Build the tables of a motor.
+         - motor: the motor
+         - relative_tolerance: maximum interpolation error, relative to the
+           maximum value of each table
+         - n_max: maximum number of points per axis
+        """
+        tau_range = (-motor.tau_max, motor.tau_max)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            # The maximum speed may be infinite with defluxing.
+            w_max = np.nanmax(motor.compute_max_speed_deflux(np.linspace(*tau_range, 1001)))
+            w_range = (0, float(np.nanmin([2 * motor.w_max_no_load, w_max])))
+
+            def build(function, ranges, scale):
+                return LookupTable.FromFunction(function, ranges, relative_tolerance * scale, n_max=n_max)
+
+            def max_speed(tau):
+                return np.fmin(motor.compute_max_speed_deflux(tau), w_range[1])
+
+            self.max_speed = build(max_speed, [tau_range], w_range[1])
+            self.max_speed_no_deflux = build(motor.compute_max_speed_no_deflux, [tau_range], motor.w_max_no_load)
+            self.defluxing_current = build(motor.compute_defluxing_current, [tau_range, w_range], motor.iq_max)
+            self.thermal_power = build(
+                lambda tau, w: np.where(w <= max_speed(tau), motor.compute_thermal_power(tau, w), np.nan),
+                [tau_range, w_range],
+                float(motor.compute_thermal_power(motor.tau_max, 0.0)))
+
+    @staticmethod
+    def _symmetry(tau, w):
+        if isinstance(w, float) or np.ndim(w) == 0:
+            return (-tau, -w) if w < 0 else (tau, w)
+        sign = np.where(np.asarray(w) < 0, -1.0, 1.0)
+        return sign * tau, sign * w
+
+    def compute_max_speed_deflux(self, tau):
+        return self.max_speed(tau)
+
+    def compute_max_speed_no_deflux(self, tau):
+        return self.max_speed_no_deflux(tau)
+
+    def compute_defluxing_current(self, tau, w):
+        return self.defluxing_current(*self._symmetry(tau, w))
+
+    def compute_thermal_power(self, tau, w):
+        return self.thermal_power(*self._symmetry(tau, w))
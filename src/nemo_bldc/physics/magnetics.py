@@ -0,0 +1,279 @@
+# Non-ideal magnetic model of a motor: saliency, saturation, harmonics and cogging
+import typing as tp
+import numpy as np
+
+from .lookup_table import LookupTable
+from .current_reference import field_weakening_currents
+
+
+def saturation_table(saturation_current: float, max_current: float, n_points: int = 65):
+    """
+    Simple saturation curve, as a table for MotorMagnetics: the inductance
+    is divided by 1 + (i / saturation_current)^2, i being the amplitude of the
+    current vector.
+     - saturation_current: current at which the inductance is halved, in A
+     - max_current: end of the table (the table is constant above), in A
+    """
+    i = np.linspace(0, max_current, n_points)
+    return LookupTable([i], 1 / (1 + (i / saturation_current)**2))
+
+
+def _park(theta, a, b, c):
+    """
+    Clarke-Park direct transform, see space_transforms.clarke_park, for arrays.
+    """
+    alpha = 2.0 / 3.0 * (a - b / 2.0 - c / 2.0)
+    beta = (b - c) / np.sqrt(3.0)
+    cos = np.cos(theta)
+    sin = np.sin(theta)
+    return cos * alpha + sin * beta, - sin * alpha + cos * beta
+
+
+def _park_inv(theta, d, q):
+    """
+    Clarke-Park inverse transform, see space_transforms.clarke_park_inv.
+    """
+    alpha = np.cos(theta) * d - np.sin(theta) * q
+    beta = np.sin(theta) * d + np.cos(theta) * q
+    return np.array([alpha, -alpha / 2 + np.sqrt(3) / 2 * beta, -alpha / 2 - np.sqrt(3) / 2 * beta])
+
+
+class MotorMagnetics:
+    """
+    Magnetic model of a motor, beyond the ideal motor of Motor (sinusoidal
+    back-EMF, same inductance on both axes, no saturation):
+     - saliency: different direct and quadrature inductances, adding a
+       reluctance torque 3/2 rho np (Ld - Lq) id iq
+     - saturation: both inductances are multiplied by a factor, function of
+       the amplitude of the current vector (a 1D LookupTable, evaluated by
+       interpolation). The apparent inductance is used in the dynamics: the
+       variation of the inductance with the current is neglected.
+     - back-EMF harmonics, which produce a torque ripple
+     - cogging torque, sinusoidal in the rotor position
+
+    A motor uses this model when its magnetics attribute is set: the
+    envelope functions of Motor (maximum speed, defluxing current, thermal
+    power) then take saliency and saturation into account (harmonics and
+    cogging only add a zero-mean ripple, see torque_ripple), and so does the
+    simulation (with the python backend only: the compiled kernel is kept for
+    ideal motors).
+    With saliency, the torque depends on the direct current: the envelope
+    functions solve for the currents by a few fixed point iterations,
+    vectorized like the other functions of Motor.
+    """
+
+    @staticmethod
+    def FromDict(data):
+        saturation = None
+        if "saturation_current" in data:
+            saturation = LookupTable([data["saturation_current"]], data["saturation_factor"])
+        return MotorMagnetics(data["Ld"] / 1000.0, data["Lq"] / 1000.0, saturation,
+                              [tuple(h) for h in data.get("bemf_harmonics", [])],
+                              data.get("cogging_torque", 0.0), data.get("cogging_periods", 0))
+
+    def __init__(self,
+                 Ld: float,
+                 Lq: float,
+                 saturation: tp.Optional[LookupTable] = None,
+                 bemf_harmonics: tp.List[tp.Tuple[int, float, float]] = (),
+                 cogging_torque: float = 0.0,
+                 cogging_periods: int = 0,
+                 n_iterations: int = 8):
+        """
+         - Ld, Lq: direct and quadrature inductance (without saturation), in H
+         - saturation: current amplitude (A) -> inductance factor, see
+           saturation_table ; None for no saturation
+         - bemf_harmonics: list of (order, amplitude, phase) of the back-EMF
+           harmonics, the amplitude being relative to the fundamental
+         - cogging_torque: amplitude of the cogging torque, articular, in Nm
+         - cogging_periods: number of periods of the cogging torque per turn
+           of the rotor (typically, the least common multiple of the number of
+           slots and poles)
+         - n_iterations: number of fixed point iterations of the envelope
+           functions
+        """
+        self.Ld = Ld
+        self.Lq = Lq
+        self.saturation = saturation
+        self.bemf_harmonics = [(int(h), float(a), float(phi)) for h, a, phi in bemf_harmonics]
+        self.cogging_torque = cogging_torque
+        self.cogging_periods = cogging_periods
+        self.n_iterations = n_iterations
+
+    def to_dict(self):
+        """
+        Store the model in a dictionary, see Motor.to_dict.
+        """
+        data = {
+            "Ld": 1000.0 * self.Ld,
+            "Lq": 1000.0 * self.Lq,
+            "bemf_harmonics": [list(h) for h in self.bemf_harmonics],
+            "cogging_torque": self.cogging_torque,
+            "cogging_periods": self.cogging_periods,
+        }
+        if self.saturation is not None:
+            data["saturation_current"] = self.saturation.axes[0].tolist()
+            data["saturation_factor"] = self.saturation.values.tolist()
+        return data
+
+    def inductances(self, i_d, i_q):
+        """
+        Direct and quadrature inductances, in H, for the given currents.
+        """
+        if self.saturation is None:
+            return self.Ld, self.Lq
+        i = np.sqrt(np.asarray(i_d)**2 + np.asarray(i_q)**2)
+        # Not feasible points (nan currents) stay nan.
+        if np.ndim(i) == 0:
+            factor = self.saturation(float(i)) if np.isfinite(i) else np.nan
+        else:
+            factor = np.where(np.isfinite(i), self.saturation(np.nan_to_num(i, nan=0.0, posinf=0.0)), np.nan)
+        return self.Ld * factor, self.Lq * factor
+
+    def bemf_shape(self, theta_el):
+        """
+        Back-EMF of the three phases, per unit of ke * rho * dtheta: the
+        fundamental is simulate.bemf.
+        """
+        phases = np.array([0.0, -2 * np.pi / 3, 2 * np.pi / 3]).reshape((3,) + (1,) * np.ndim(theta_el))
+        angle = theta_el + phases
+        shape = np.sin(angle)
+        for order, amplitude, phase in self.bemf_harmonics:
+            shape = shape + amplitude * np.sin(order * angle + phase)
+        return shape
+
+    def torque(self, motor, theta, idq):
+        """
+        Articular torque, in Nm, at position theta (articular, in rad) and
+        currents idq = [id, iq].
+        """
+        i_d, i_q = idq
+        theta_el = motor.np * motor.rho * theta
+        # The back-EMF is (0, -ke rho dtheta) in the rotating frame, without
+        # harmonics: the torque is the power it receives, divided by dtheta.
+        shape_d, shape_q = _park(theta_el, *self.bemf_shape(theta_el))
+        L_d, L_q = self.inductances(i_d, i_q)
+        return - motor.kt_q_art * (shape_d * i_d + shape_q * i_q) \
+            + 3.0 / 2.0 * motor.np * motor.rho * (L_d - L_q) * i_d * i_q \
+            + self.cogging_torque * np.sin(self.cogging_periods * motor.rho * theta)
+
+    def current_derivative(self, motor, theta, dtheta, iphase, Vphase):
+        """
+        Derivative of the phase currents, in A/s: the electrical equations are
+        written in the rotating frame, where the inductances are constant.
+        """
+        theta_el = motor.np * motor.rho * theta
+        w_el = motor.np * motor.rho * dtheta
+        i_d, i_q = _park(theta_el, *iphase)
+        V_d, V_q = _park(theta_el, *Vphase)
+        # The back-EMF, ke rho dtheta bemf_shape, is added to the phase voltage.
+        e_d, e_q = _park(theta_el, *(motor.ke * motor.rho * dtheta * self.bemf_shape(theta_el)))
+        L_d, L_q = self.inductances(i_d, i_q)
+        di_d = (V_d - motor.R * i_d + w_el * L_q * i_q + e_d) / L_d
+        di_q = (V_q - motor.R * i_q - w_el * L_d * i_d + e_q) / L_q
+        return _park_inv(theta_el, di_d - w_el * i_q, di_q + w_el * i_d)
+
+    def quadrature_current(self, motor, tau, i_d):
+        """
+        Quadrature current, in A, giving the articular torque tau (in Nm) with
+        the direct current i_d, the reluctance torque included.
+        """
+        i_q = tau / motor.kt_q_art
+        if self.Ld == self.Lq:
+            return i_q
+        for _ in range(self.n_iterations):
+            L_d, L_q = self.inductances(i_d, i_q)
+            i_q = tau / (motor.kt_q_art + 3.0 / 2.0 * motor.np * motor.rho * (L_d - L_q) * i_d)
+        return i_q
+
+    def compute_max_speed_no_deflux(self, motor, tau, U=None):
+        """
+        See Motor.compute_max_speed_no_deflux.
+        """
+        U = motor.U if U is None else np.asarray(U)
+        i_q = np.asarray(tau) / motor.kt_q_art
+        _, L_q = self.inductances(0.0, i_q)
+
+        a = motor.rho**2 * ((motor.np * L_q * i_q) ** 2 + motor.ke**2)
+        b = 2 * motor.rho * motor.R * motor.ke * i_q
+        c = (motor.R * i_q) ** 2 - U**2 / 3
+        return (-b + np.sqrt(b**2 - 4 * a * c)) / 2 / a
+
+    def compute_defluxing_current(self, motor, tau, w, U=None):
+        """
+        See Motor.compute_defluxing_current.
+        """
+        tau = np.asarray(tau)
+        w = np.asarray(w)
+        U = motor.U if U is None else np.asarray(U)
+        w_el = motor.np * motor.rho * w
+        e = motor.ke * motor.rho * w
+
+        # Voltage amplitude equal to U / sqrt(3), solved for i_d at fixed
+        # inductances and i_q, then updated.
+        i_d = np.zeros(np.broadcast(tau, w).shape)
+        for _ in range(self.n_iterations):
+            i_q = self.quadrature_current(motor, tau, i_d)
+            L_d, L_q = self.inductances(i_d, i_q)
+            a = motor.R**2 + (w_el * L_d) ** 2
+            b = 2 * w_el * (L_d * (motor.R * i_q + e) - motor.R * L_q * i_q)
+            c = (w_el * L_q * i_q) ** 2 + (motor.R * i_q + e) ** 2 - U**2 / 3
+            i_d = np.minimum(0.0, (-b + np.sqrt(b**2 - 4 * a * c)) / 2 / a)
+        return i_d
+
+    def compute_max_speed_deflux(self, motor, tau, U=None):
+        """
+        See Motor.compute_max_speed_deflux.
+        """
+        tau = np.asarray(tau)
+        U = motor.U if U is None else np.asarray(U)
+
+        # Maximum defluxing: all the remaining current, or the current
+        # cancelling the rotor flux.
+        i_q = tau / motor.kt_q_art
+        i_d = 0.0
+        for _ in range(self.n_iterations):
+            L_d, L_q = self.inductances(i_d, i_q)
+            i_d = np.maximum(-np.sqrt(np.maximum(0, 2 * motor.i_rms_max**2 - i_q**2)), -motor.ke / motor.np / L_d)
+            i_q = self.quadrature_current(motor, tau, i_d)
+        L_d, L_q = self.inductances(i_d, i_q)
+
+        flux = motor.np * L_d * i_d + motor.ke
+        a = motor.rho**2 * ((motor.np * L_q * i_q) ** 2 + flux**2)
+        b = 2 * motor.rho * motor.R * (i_q * flux - i_d * motor.np * L_q * i_q)
+        c = motor.R**2 * (i_d**2 + i_q**2) - U**2 / 3
+        return np.maximum(
+            (-b + np.sqrt(b**2 - 4 * a * c)) / 2 / a,
+            self.compute_max_speed_no_deflux(motor, tau, U),
+        )
+
+    def compute_thermal_power(self, motor, tau, w, force_no_defluxing=False, U=None):
+        """
+        See Motor.compute_thermal_power.
+        The currents follow the maximum torque per ampere, then field
+        weakening (see current_reference.field_weakening_currents).
+        """
+        tau = np.asarray(tau)
+        w = np.asarray(w)
+        if force_no_defluxing:
+            i_d = np.zeros(np.broadcast(tau, w).shape)
+            i_q = self.quadrature_current(motor, tau, i_d)
+        else:
+            i_d, i_q = field_weakening_currents(motor, tau, w, U)
+        return 3 / 2 * motor.R * (i_d**2 + i_q**2)
+
+    def torque_ripple(self, motor, tau, n_points: tp.Optional[int] = None):
+        """
+        Peak to peak articular torque ripple, in Nm, over a turn of the rotor,
+        for a constant quadrature current giving the (mean) torque tau.
+         - n_points: number of rotor positions (default: 32 per period of the
+           fastest harmonic)
+        """
+        tau = np.asarray(tau, dtype=float)
+        if n_points is None:
+            orders = [1] + [h for h, _, _ in self.bemf_harmonics]
+            n_points = 32 * int(max(motor.np * max(orders) * 2, self.cogging_periods, 1))
+        theta = np.linspace(0, 2 * np.pi / motor.rho, n_points, endpoint=False)
+        i_q = tau[..., None] / motor.kt_q_art
+        torque = self.torque(motor, theta, (np.zeros(i_q.shape), i_q))
+        return np.max(torque, axis=-1) - np.min(torque, axis=-1)
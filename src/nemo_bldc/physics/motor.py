@@ -10,6 +10,9 @@ class Motor:
     @staticmethod
     def FromDict(data):
         m = Motor(1, 1, 1, 1, 1, 1, 48, 1)
+        if "magnetics" in data:
+            from .magnetics import MotorMagnetics
+            m.magnetics = MotorMagnetics.FromDict(data["magnetics"])
         m.update_constants(
             n=data["np"],
             R=data["R"],
@@ -32,6 +35,7 @@ class Motor:
         iq_nominal: float,
         U: float,
         reduction_ratio: float,
+        magnetics: tp.Optional["MotorMagnetics"] = None,
     ):
         """
         Build a PMSM motor from the fundamental parameters.
@@ -42,17 +46,20 @@ class Motor:
             - iq_max: maximum quadrature current (assuming no defluxing) in the motor
             - U: driver voltage
             - reduction_ratio: reduction ratio
+            - magnetics: optional MotorMagnetics (saliency, saturation,
+              back-EMF harmonics, cogging)
         Note:
-            - magnetic saturations not modelled
-            - salliancy ratio is set to 1
+            - without magnetics, magnetic saturations are not modelled, and
+              the salliancy ratio is set to 1
         """
+        self.magnetics = magnetics
         self.update_constants(n, R, L, ke, iq_max, iq_nominal, U, reduction_ratio)
 
     def to_dict(self):
         """
         Store motore in dictionnary to save to json file.
         """
-        return {
+        data = {
             "np": 2 * self.np,
             "R": self.R,
             "L": self.L,
@@ -63,11 +70,15 @@ class Motor:
             "U": self.U,
             "reduction_ratio": self.rho,
         }
+        if self.magnetics is not None:
+            data["magnetics"] = self.magnetics.to_dict()
+        return data
 
     def copy(self, other_motor: "Motor"):
         """
         Copy the constants of other_motor onto self.
         """
+        self.magnetics = other_motor.magnetics
         self.update_constants(
             n=2 * other_motor.np,
             R=other_motor.R,
@@ -89,6 +100,7 @@ class Motor:
         iq_nominal: float = None,
         U: float = None,
         reduction_ratio: float = None,
+        magnetics: tp.Optional["MotorMagnetics"] = None,
     ):
         """
         Update the motor's constants (none to keep previous value).
@@ -112,6 +124,8 @@ class Motor:
             self.U = U
         if reduction_ratio is not None:
             self.rho = reduction_ratio
+        if magnetics is not None:
+            self.magnetics = magnetics
 
         self._compute_derived_constants()
 
@@ -141,27 +155,35 @@ class Motor:
     def __str__(self):
         return f"R: {self.R}Ohm, L: {self.L * 1000.0}mH, Phi: {self.ke}Wb, Iq_max: {self.iq_max}A, Np {self.np}, U {self.U}, reduction {self.rho}"
 
-    def compute_max_speed_no_deflux(self, tau):
+    def compute_max_speed_no_deflux(self, tau, U=None):
         """
         Return the maximum articular speed, given articular torque, when not defluxing.
          - tau: input articular torque, Nm
+         - U: driver voltage, if different from the motor's (can be an array)
         """
+        if self.magnetics is not None:
+            return self.magnetics.compute_max_speed_no_deflux(self, tau, U)
         tau = np.asarray(tau)
+        U = self.U if U is None else np.asarray(U)
 
         iq = tau / self.kt_q_art
 
         a = self.rho**2 * ((self.np * self.L * iq) ** 2 + self.ke**2)
         b = 2 * self.rho * self.R * self.ke * iq
-        c = (self.R * iq) ** 2 - self.U**2 / 3
+        c = (self.R * iq) ** 2 - U**2 / 3
 
         return (-b + np.sqrt(b**2 - 4 * a * c)) / 2 / a
 
-    def compute_defluxing_current(self, tau, w):
+    def compute_defluxing_current(self, tau, w, U=None):
         """
         Get defluxing current, in A, given articular torque and velocity.
+        Optionally, the driver voltage U can be specified (possibly as an array).
         """
+        if self.magnetics is not None:
+            return self.magnetics.compute_defluxing_current(self, tau, w, U)
         tau = np.asarray(tau)
         w = np.asarray(w)
+        U = self.U if U is None else np.asarray(U)
 
         i_q = tau / self.kt_q_art
 
@@ -174,17 +196,21 @@ class Motor:
             + 2 * self.R * i_q * self.ke * self.rho * w
             + self.R**2 * i_q**2
             + (self.ke * self.rho * w) ** 2
-            - self.U**2 / 3
+            - U**2 / 3
         )
 
         return np.minimum(0.0, (-b + np.sqrt(b**2 - 4 * a * c)) / 2 / a)
 
-    def compute_max_speed_deflux(self, tau):
+    def compute_max_speed_deflux(self, tau, U=None):
         """
         Returns the maximum articular speed, given articular torque, with defluxing.
          - tau: input articular torque, Nm
+         - U: driver voltage, if different from the motor's (can be an array)
         """
+        if self.magnetics is not None:
+            return self.magnetics.compute_max_speed_deflux(self, tau, U)
         tau = np.asarray(tau)
+        U = self.U if U is None else np.asarray(U)
 
         i_q = tau / self.kt_q_art
         i_d = np.maximum(
@@ -196,19 +222,22 @@ class Motor:
             self.np * self.L * i_d + self.ke
         ) ** 2
         b = 2 * self.rho * self.R * i_q * self.ke
-        c = self.R**2 * (i_d**2 + i_q**2) - self.U**2 / 3
+        c = self.R**2 * (i_d**2 + i_q**2) - U**2 / 3
         return np.maximum(
             (-b + np.sqrt(b**2 - 4 * a * c)) / 2 / a,
-            self.compute_max_speed_no_deflux(tau),
+            self.compute_max_speed_no_deflux(tau, U),
         )
 
-    def compute_thermal_power(self, tau, w, force_no_defluxing=False):
+    def compute_thermal_power(self, tau, w, force_no_defluxing=False, U=None):
         """
         Compute the thermal power to reach a specific working point.
-        The motor will deflux if needed, unless specified.
+        The motor will deflux if needed, unless specified ; optionally, the
+        driver voltage U can be specified.
         Note: this function does not check that the point is feasible for
         the motor: if you ask for infinite torque, you get infinite power !
         """
+        if self.magnetics is not None:
+            return self.magnetics.compute_thermal_power(self, tau, w, force_no_defluxing, U)
         tau = np.asarray(tau)
         w = np.asarray(w)
 
@@ -216,10 +245,26 @@ class Motor:
         if force_no_defluxing:
             i_d = np.zeros(w.shape)
         else:
-            i_d = self.compute_defluxing_current(tau, w)
+            i_d = self.compute_defluxing_current(tau, w, U)
         power = 3 / 2 * self.R * (i_d**2 + i_q**2)
         return power
 
+    def compute_margin(self, tau, w):
+        """
+        Margin of a mission (set of articular torque and speed points, along
+        the last axis) to the limits of the motor, with defluxing: smallest
+        relative distance of a point to the torque or speed limit (negative if
+        a point is not reachable).
+        Negative speeds are evaluated by symmetry, at (-tau, -w).
+        """
+        tau = np.asarray(tau)
+        w = np.asarray(w)
+        tau = np.where(w < 0, -tau, tau)
+        w = np.abs(w)
+        torque_margin = 1 - np.abs(tau) / self.tau_max
+        speed_margin = 1 - w / self.compute_max_speed_deflux(tau)
+        return np.min(np.minimum(torque_margin, speed_margin), axis=-1)
+
     def get_power(self, w, tau):
         """
         Return the total power (mecanical + thermal) required by the motor,
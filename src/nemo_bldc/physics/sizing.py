@@ -0,0 +1,160 @@
+# Choice of a motor, reduction ratio and voltage for a given task
+import typing as tp
+import numpy as np
+
+from .motor import Motor
+
+
+def pareto_front(costs: np.array):
+    """
+    Return the indices of the Pareto-optimal points (all costs being minimized).
+     - costs: array of shape (n_points, n_costs)
+    """
+    costs = np.asarray(costs)
+    # Points with a low first cost dominate many others: process them first,
+    # to remove the dominated points early.
+    indices = np.argsort(costs[:, 0], kind="stable")
+    costs = costs[indices]
+    i = 0
+    while i < len(costs):
+        # Keep only the points that are not dominated by point i: better on at
+        # least one cost, or equal on all of them.
+        keep = np.any(costs < costs[i], axis=1) | np.all(costs == costs[i], axis=1)
+        indices = indices[keep]
+        costs = costs[keep]
+        i = np.sum(keep[:i]) + 1
+    return np.sort(indices)
+
+
+class SizingResult:
+    """
+    Result of optimize_sizing: the Pareto-optimal candidates, sorted by
+    increasing thermal power. All arrays have shape (n_candidates,).
+     - motor_names: name of the motor
+     - ratio, U: reduction ratio and driver voltage
+     - thermal_power: average thermal power over the mission, in W
+     - mass_proxy: motor constant K_m of the motor (without reduction), which
+       grows with the size of the motor
+     - margin: smallest margin of the mission to the torque and speed limits,
+       relative to the limit (0: a point of the mission is on the limit)
+    """
+    def __init__(self, motor_names, ratio, U, thermal_power, mass_proxy, margin, library):
+        self.motor_names = motor_names
+        self.ratio = ratio
+        self.U = U
+        self.thermal_power = thermal_power
+        self.mass_proxy = mass_proxy
+        self.margin = margin
+        self._library = library
+
+    def __len__(self):
+        return len(self.ratio)
+
+    def get_motor(self, k: int):
+        """
+        Return the motor of candidate k, with its reduction ratio and voltage.
+        """
+        m = Motor(1, 1, 1, 1, 1, 1, 48, 1)
+        m.copy(self._library[self.motor_names[k]])
+        m.update_constants(U=float(self.U[k]), reduction_ratio=float(self.ratio[k]))
+        return m
+
+
+def optimize_sizing(library: tp.Dict[str, Motor],
+                    tau: np.array,
+                    w: np.array,
+                    ratios: np.array,
+                    voltages: np.array,
+                    chunk_size: int = 2**16):
+    """
+    Find the best combinations of motor, reduction ratio and driver voltage to
+    perform a mission, given as a list of articular torque and speed points.
+
+    All combinations are evaluated with the formulas of Motor, on arrays of
+    motor parameters. A candidate is feasible if all the points of the mission
+    are within the torque-speed envelope (with defluxing), and if the average
+    thermal power does not exceed the one at the nominal current.
+    Three criteria are then considered: thermal power, mass proxy (both
+    minimized) and margin (maximized).
+
+    Note: rewinding a motor (ke and iq_max scaled by k and 1/k, R and L by k^2)
+    is equivalent to changing its voltage by 1/k: sweeping the voltage thus
+    also covers the choice of the winding.
+
+    Parameters:
+     - library: dictionary of motors (name: Motor)
+     - tau, w: articular torque and speed of the mission, sampled at a
+       constant rate
+     - ratios: reduction ratios to consider
+     - voltages: driver voltages to consider
+     - chunk_size: maximum number of (candidate, mission point) pairs
+       evaluated at once, to limit memory usage
+    Return: a SizingResult, with the Pareto-optimal candidates.
+    """
+    names = list(library.keys())
+    motors = [library[n] for n in names]
+    tau = np.asarray(tau, dtype=float).ravel()
+    w = np.asarray(w, dtype=float).ravel()
+    ratios = np.asarray(ratios, dtype=float).ravel()
+    voltages = np.asarray(voltages, dtype=float).ravel()
+    # Negative speeds are evaluated by symmetry.
+    tau = np.where(w < 0, -tau, tau)
+    w = np.abs(w)
+
+    # Grid of all candidates, as flat arrays.
+    motor_index, ratio, U = [x.ravel() for x in np.meshgrid(np.arange(len(motors)), ratios, voltages, indexing="ij")]
+    parameters = {
+        "n": np.array([2 * m.np for m in motors]),
+        "R": np.array([m.R for m in motors]),
+        "L": np.array([m.L for m in motors]),
+        "ke": np.array([m.ke for m in motors]),
+        "iq_max": np.array([m.iq_max for m in motors]),
+        "iq_nominal": np.array([m.iq_nominal for m in motors]),
+    }
+
+    nominal_power = 3 / 2 * parameters["R"] * parameters["iq_nominal"]**2
+    mass_proxy = np.sqrt(2.0 / 3.0) * 3.0 / 2.0 * parameters["ke"] / np.sqrt(parameters["R"])
+
+    # Discard first the candidates that cannot provide the mission torque, or
+    # overheat even without defluxing: this only requires scalar computations.
+    kt_q_art = 3.0 / 2.0 * ratio * parameters["ke"][motor_index]
+    tau_max = kt_q_art * parameters["iq_max"][motor_index]
+    min_power = 3 / 2 * parameters["R"][motor_index] * np.mean(tau**2) / kt_q_art**2
+    candidates = np.nonzero((tau_max >= np.max(np.abs(tau))) & (min_power <= nominal_power[motor_index]))[0]
+
+    power = np.full(len(motor_index), np.nan)
+    margin = np.full(len(motor_index), -np.inf)
+    step = max(1, chunk_size // len(tau))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        for start in range(0, len(candidates), step):
+            c = candidates[start:start + step]
+            k = motor_index[c]
+            m = Motor(*[parameters[p][k][:, None] for p in ["n", "R", "L", "ke", "iq_max", "iq_nominal"]],
+                      U=U[c][:, None], reduction_ratio=ratio[c][:, None])
+            margin[c] = m.compute_margin(tau, w)
+            power[c] = np.mean(m.compute_thermal_power(tau, w), axis=1)
+
+    feasible = np.nonzero((margin >= 0) & (power <= nominal_power[motor_index]))[0]
+
+    # The mass proxy is the same for all the candidates of a motor: first keep,
+    # for each motor, the candidates that are optimal in (power, margin).
+    # Sorting by motor then power, a candidate is kept if its margin is not
+    # below the margins of all the previous candidates of the same motor (margin
+    # is in [0, 1]: adding twice the motor index makes the cumulative maximum
+    # restart for each motor). Ties are kept, so that identical candidates are
+    # all kept, like by pareto_front, which removes the dominated ones.
+    feasible = feasible[np.lexsort((-margin[feasible], power[feasible], motor_index[feasible]))]
+    shifted_margin = margin[feasible] + 2 * motor_index[feasible]
+    previous_best = np.concatenate([[-np.inf], np.maximum.accumulate(shifted_margin)[:-1]])
+    feasible = feasible[shifted_margin >= previous_best]
+
+    costs = np.stack([power[feasible], mass_proxy[motor_index[feasible]], -margin[feasible]], axis=1)
+    optimal = feasible[pareto_front(costs)]
+    optimal = optimal[np.argsort(power[optimal], kind="stable")]
+    return SizingResult([names[i] for i in motor_index[optimal]],
+                        ratio[optimal],
+                        U[optimal],
+                        power[optimal],
+                        mass_proxy[motor_index[optimal]],
+                        margin[optimal],
+                        library)
@@ -0,0 +1,136 @@
+# Monte-Carlo analysis of the effect of manufacturing tolerances and temperature
+import typing as tp
+import numpy as np
+
+from .motor import Motor
+
+
+class MotorTolerances:
+    def __init__(self,
+                 R: float = 0.0,
+                 L: float = 0.0,
+                 ke: float = 0.0,
+                 U: float = 0.0,
+                 stator_temperature: tp.Tuple[float, float] = (25.0, 25.0),
+                 rotor_temperature: tp.Tuple[float, float] = (25.0, 25.0),
+                 nominal_temperature: float = 25.0,
+                 R_coefficient: float = 0.0040,
+                 flux_coefficient: float = 0.0012):
+        """
+        Manufacturing tolerances and operating conditions of a motor.
+         - R, L, ke, U: relative standard deviation of each parameter (the
+           parameters follow a normal distribution)
+         - stator_temperature, rotor_temperature: range of temperature, in
+           degC (the temperature follows a uniform distribution)
+         - nominal_temperature: temperature at which the motor parameters are given
+         - R_coefficient: relative variation of the resistance, per degC
+         - flux_coefficient: relative decrease of the rotor flux, per degC
+        """
+        self.R = R
+        self.L = L
+        self.ke = ke
+        self.U = U
+        self.stator_temperature = stator_temperature
+        self.rotor_temperature = rotor_temperature
+        self.nominal_temperature = nominal_temperature
+        self.R_coefficient = R_coefficient
+        self.flux_coefficient = flux_coefficient
+
+
+def sample_motors(motor: Motor, tolerances: MotorTolerances, n_samples: int, seed: tp.Optional[int] = None):
+    """
+    Draw n_samples random variations of a motor.
+    Return: a single Motor, whose parameters are arrays of shape (n_samples, 1):
+    evaluating it on an array of n points gives arrays of shape (n_samples, n).
+    The magnetic model of the motor, if any, is kept: its inductances Ld and
+    Lq are not sampled (the L tolerance then has no effect).
+    """
+    rng = np.random.default_rng(seed)
+    shape = (n_samples, 1)
+
+    def sample(value, relative_std):
+        return value * (1 + relative_std * rng.standard_normal(shape))
+
+    Ts = rng.uniform(*tolerances.stator_temperature, shape)
+    Tr = rng.uniform(*tolerances.rotor_temperature, shape)
+    T0 = tolerances.nominal_temperature
+    return Motor(2 * motor.np,
+                 sample(motor.R, tolerances.R) * (1 + tolerances.R_coefficient * (Ts - T0)),
+                 sample(motor.L, tolerances.L),
+                 sample(motor.ke, tolerances.ke) * (1 - tolerances.flux_coefficient * (Tr - T0)),
+                 motor.iq_max,
+                 motor.iq_nominal,
+                 sample(motor.U, tolerances.U),
+                 motor.rho,
+                 magnetics=motor.magnetics)
+
+
+class ToleranceResult:
+    """
+    Result of tolerance_analysis.
+     - motors: the sampled motors (see sample_motors)
+     - tau: torque grid, shape (n_tau,)
+     - max_speed, max_speed_no_deflux: maximum speed of each sample, with and
+       without defluxing, shape (n_samples, n_tau) ; zero above the maximum
+       torque of the sample.
+    """
+    def __init__(self, motors: Motor, tau: np.array):
+        self.motors = motors
+        self.tau = tau
+        with np.errstate(invalid="ignore"):
+            reachable = tau <= motors.tau_max
+            self.max_speed = np.where(reachable, np.nan_to_num(motors.compute_max_speed_deflux(tau)), 0.0)
+            self.max_speed_no_deflux = np.where(reachable, np.nan_to_num(motors.compute_max_speed_no_deflux(tau)), 0.0)
+        self._sorted_max_speed = None
+
+    @property
+    def n_samples(self):
+        return len(self.max_speed)
+
+    def percentile(self, q, defluxing: bool = True):
+        """
+        Torque-speed curve reached by (100 - q)% of the motors: q-th percentile
+        of the maximum speed, for each torque of the grid. q can be an array.
+        """
+        return np.percentile(self.max_speed if defluxing else self.max_speed_no_deflux, q, axis=0)
+
+    def feasibility(self, w: np.array):
+        """
+        Fraction of the motors reaching each point of the grid tau x w (with
+        defluxing), shape (n_tau, len(w)).
+        """
+        if self._sorted_max_speed is None:
+            self._sorted_max_speed = np.sort(self.max_speed, axis=0)
+        w = np.asarray(w)
+        count = np.array([np.searchsorted(self._sorted_max_speed[:, i], w, side="left") for i in range(len(self.tau))])
+        return 1 - count / self.n_samples
+
+    def compute_margin(self, tau, w):
+        """
+        Margin of each sampled motor for a mission (see Motor.compute_margin),
+        shape (n_samples,).
+        """
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return self.motors.compute_margin(tau, w)
+
+
+def tolerance_analysis(motor: Motor,
+                       tolerances: MotorTolerances,
+                       n_samples: int = 1000,
+                       tau: tp.Optional[np.array] = None,
+                       seed: tp.Optional[int] = None):
+    """
+    Evaluate the torque-speed envelope of many random variations of a motor,
+    all at once.
+     - motor: nominal motor
+     - tolerances: tolerances and operating conditions (MotorTolerances)
+     - n_samples: number of motors to draw
+     - tau: articular torque grid (default: 200 points from 0 to tau_max)
+     - seed: seed of the random generator
+    Return: ToleranceResult
+    """
+    if tau is None:
+        tau = np.linspace(0, motor.tau_max, 200)
+    with np.errstate(invalid="ignore"):
+        motors = sample_motors(motor, tolerances, n_samples, seed)
+    return ToleranceResult(motors, np.asarray(tau, dtype=float))
@@ -0,0 +1,174 @@
+# Modeling of a gearbox between the motor and the load
+import typing as tp
+import numpy as np
+
+from .motor import Motor
+
+
+class Transmission:
+    """
+    A reduction stage between the motor and the load, with losses.
+
+    The losses are modeled, at the output of the reduction, as:
+     - a Coulomb friction tau_c sign(w) and a viscous friction nu w
+     - a meshing efficiency eta: when the motor drives the load, only eta of
+       the torque is transmitted ; when the load drives the motor, the motor
+       sees only eta of the load torque.
+    Since friction does not depend on the load, the overall efficiency of the
+    transmission increases with torque (see efficiency_at).
+
+    The backlash and the stiffness of the transmission are only used in
+    simulation (see MotorSimulator): for the quasi-static computations, the
+    transmission is rigid.
+
+    All parameters can be arrays (typically the ratio), to evaluate several
+    transmissions in a single call through numpy broadcasting.
+    """
+
+    def __init__(self,
+                 ratio: float,
+                 efficiency: float = 1.0,
+                 coulomb_friction: float = 0.0,
+                 viscous_friction: float = 0.0,
+                 rotor_inertia: float = 0.0,
+                 backlash: float = 0.0,
+                 stiffness: tp.Optional[float] = None,
+                 damping: float = 0.0,
+                 velocity_threshold: float = 1e-2):
+        """
+        Build a transmission
+         - ratio: reduction ratio (motor speed / output speed)
+         - efficiency: meshing efficiency eta, in ]0, 1]
+         - coulomb_friction: Coulomb friction at the output, in Nm
+         - viscous_friction: viscous friction at the output, in Nm/(rad/s)
+         - rotor_inertia: inertia of the motor rotor and of the input of the
+           transmission, in kg.m^2 (motor side)
+         - backlash: total backlash angle at the output, in rad
+         - stiffness: torsional stiffness at the output, in Nm/rad, used in
+           simulation when backlash is not zero (None for a rigid transmission)
+         - damping: damping of the contact, in Nm/(rad/s), used with stiffness
+         - velocity_threshold: in simulation, the Coulomb friction is
+           regularized (linear) below this output speed, in rad/s
+        """
+        if np.any(np.asarray(backlash) > 0) and stiffness is None:
+            raise ValueError("The stiffness of the transmission is needed to simulate backlash.")
+        self.ratio = ratio
+        self.efficiency = efficiency
+        self.coulomb_friction = coulomb_friction
+        self.viscous_friction = viscous_friction
+        self.rotor_inertia = rotor_inertia
+        self.backlash = backlash
+        self.stiffness = stiffness
+        self.damping = damping
+        self.velocity_threshold = velocity_threshold
+
+    @property
+    def reflected_inertia(self):
+        """
+        Inertia of the rotor, as seen from the output.
+        """
+        return np.asarray(self.rotor_inertia) * np.asarray(self.ratio)**2
+
+    def apply(self, motor: Motor):
+        """
+        Return a copy of motor, its reduction ratio being replaced by the
+        ratio of this transmission (possibly an array): this is the motor
+        with an ideal transmission.
+        """
+        m = Motor(1, 1, 1, 1, 1, 1, 48, 1)
+        m.copy(motor)
+        m.update_constants(reduction_ratio=np.asarray(self.ratio, dtype=float))
+        return m
+
+    def friction_torque(self, w, regularized: bool = False):
+        """
+        Friction torque of the transmission, at output speed w.
+        If regularized, the Coulomb friction is linear below velocity_threshold
+        (used for integration).
+        """
+        w = np.asarray(w)
+        if regularized:
+            sign = np.clip(w / self.velocity_threshold, -1.0, 1.0)
+        else:
+            sign = np.sign(w)
+        return self.coulomb_friction * sign + self.viscous_friction * w
+
+    def motor_torque(self, tau, w, regularized: bool = False):
+        """
+        Torque that the motor must provide (expressed at the output, as for
+        an ideal transmission) to produce the torque tau at output speed w.
+        At zero speed, the motor is assumed to drive the load.
+        """
+        tau = np.asarray(tau)
+        w = np.asarray(w)
+        tau_mesh = tau + self.friction_torque(w, regularized)
+        driving = tau_mesh * np.where(w == 0, 1.0, w) >= 0
+        return np.where(driving, tau_mesh / self.efficiency, tau_mesh * self.efficiency)
+
+    def load_torque(self, tau_motor, w, regularized: bool = False):
+        """
+        Torque applied on the load at output speed w, when the motor provides
+        the torque tau_motor (expressed at the output): inverse of motor_torque.
+        """
+        tau_motor = np.asarray(tau_motor)
+        w = np.asarray(w)
+        driving = tau_motor * np.where(w == 0, 1.0, w) >= 0
+        tau_mesh = np.where(driving, tau_motor * self.efficiency, tau_motor / self.efficiency)
+        return tau_mesh - self.friction_torque(w, regularized)
+
+    def contact_torque(self, delta, ddelta):
+        """
+        Torque transmitted through the backlash, in simulation.
+         - delta: angle between the input (divided by the ratio) and the output
+         - ddelta: derivative of delta
+        """
+        half_gap = self.backlash / 2
+        deflection = np.where(delta > half_gap, delta - half_gap, np.where(delta < -half_gap, delta + half_gap, 0.0))
+        return np.where(deflection != 0, self.stiffness * deflection + self.damping * ddelta, 0.0)
+
+    def efficiency_at(self, tau, w):
+        """
+        Overall efficiency of the transmission (output power / input power),
+        when driving the load with torque tau at speed w.
+        """
+        return np.asarray(tau) / self.motor_torque(tau, w)
+
+    def compute_max_speed_no_deflux(self, motor: Motor, tau, U=None):
+        """
+        Maximum output speed, given output torque, when not defluxing.
+        """
+        motor = self.apply(motor)
+        return self._solve_max_speed(lambda tau_m: motor.compute_max_speed_no_deflux(tau_m, U), tau)
+
+    def compute_max_speed_deflux(self, motor: Motor, tau, U=None):
+        """
+        Maximum output speed, given output torque, with defluxing.
+        """
+        motor = self.apply(motor)
+        return self._solve_max_speed(lambda tau_m: motor.compute_max_speed_deflux(tau_m, U), tau)
+
+    def compute_thermal_power(self, motor: Motor, tau, w, force_no_defluxing=False, U=None):
+        """
+        Thermal power of the motor, for output torque tau and speed w.
+        """
+        motor = self.apply(motor)
+        return motor.compute_thermal_power(self.motor_torque(tau, w), w, force_no_defluxing, U)
+
+    def _solve_max_speed(self, max_speed, tau, n_iterations: int = 40):
+        # The maximum speed w is the solution of w = max_speed(motor_torque(tau, w)).
+        # The motor torque increases with speed (friction), thus max_speed decreases:
+        # the solution lies between 0 and max_speed(motor_torque(tau, 0)), and
+        # is found by bisection, for all points at once.
+        tau = np.asarray(tau, dtype=float)
+        with np.errstate(invalid="ignore"):
+            bound = max_speed(self.motor_torque(tau, np.full(tau.shape, 1e-12)))
+            # Not defined (nan) or infinite: nothing to solve.
+            solve = np.isfinite(bound)
+            high = np.where(solve, bound, 0.0)
+            low = np.zeros(high.shape)
+            for _ in range(n_iterations):
+                w = (low + high) / 2
+                above = max_speed(self.motor_torque(tau, w)) < w
+                high = np.where(above, w, high)
+                low = np.where(above, low, w)
+        return np.where(solve, (low + high) / 2, bound)
@@ -1,3 +1,10 @@
 from .simulate import simulate, ControlType
-from .pi_controller import PIController
-from .signal import SignalConstant, SignalSinus
\ No newline at end of file
+from .pi_controller import PIController, PIControllerBank
+from .signal import SignalConstant, SignalSinus, SignalSum, SignalPiecewise, SignalTable, SignalRecording, SignalChirp, SignalMultisine
+from .controller import AbstractController, PIDController, FieldWeakeningController
+from .sensors import SensorModel
+from .multi_axis import simulate_multi_axis, MultiAxisSimulationResult
+from .batch import simulate_batch, scenario_key, SimulationCache
+from .cache import DiskSimulationCache, cached_simulate
+from .frequency_analysis import LinearizedCascade, FrequencyResponse, estimate_frequency_response, measure_frequency_response
+from .metrics import SimulationMetrics, StepResponse, compute_metrics, electrical_power, mechanical_power, joule_losses, magnetic_energy, cumulative_energy, voltage_saturated
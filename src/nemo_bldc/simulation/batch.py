@@ -0,0 +1,196 @@
+# Simulation of the same scenario for several motors, with caching of the results
+import typing as tp
+import numpy as np
+import inspect
+import hashlib
+import collections
+import concurrent.futures
+from enum import Enum
+
+from .simulate import simulate, SimulationResult
+from .pi_controller import PIController
+from .multi_axis import simulate_multi_axis
+from .kernel import HAS_NUMBA
+from .controller import AbstractController
+from ..physics.motor import Motor
+
+# Parameters of simulate() that do not change the result.
+IGNORED_PARAMETERS = ["gui_queue", "backend"]
+
+
+def _describe(x):
+    """
+    Convert an object to a tuple of python values, describing its content.
+    """
+    if x is None or isinstance(x, (bool, int, str)):
+        return x
+    if isinstance(x, (float, np.floating, np.integer)):
+        return float(x)
+    if isinstance(x, Enum):
+        return str(x)
+    if isinstance(x, np.ndarray):
+        data = np.ascontiguousarray(x)
+        return ("array", data.shape, str(data.dtype), hashlib.sha256(data.tobytes()).hexdigest())
+    if isinstance(x, (list, tuple)):
+        return tuple(_describe(v) for v in x)
+    if isinstance(x, dict):
+        return tuple((k, _describe(v)) for k, v in sorted(x.items()))
+    if isinstance(x, Motor):
+        # Only the constants of the motor: not the name or color of a DisplayMotor.
+        return ("Motor", _describe(x.to_dict()))
+    ignored = x.state_attributes if isinstance(x, AbstractController) else ()
+    attributes = {k: v for k, v in vars(x).items() if not k.startswith("_") and k not in ignored}
+    return (type(x).__name__, _describe(attributes))
+
+
+def scenario_key(*args, **kwargs):
+    """
+    Return a key identifying a simulation: the arguments of simulate(), with
+    their content (motor constants, signal and controller parameters...).
+    Two calls with the same key give the same result.
+    """
+    arguments = inspect.signature(simulate).bind(*args, **kwargs)
+    arguments.apply_defaults()
+    return _describe({k: v for k, v in arguments.arguments.items() if k not in IGNORED_PARAMETERS})
+
+
+def scenario_hash(*args, **kwargs):
+    """
+    sha256 hash (hexadecimal string) of scenario_key, stable across sessions.
+    """
+    return hashlib.sha256(repr(scenario_key(*args, **kwargs)).encode()).hexdigest()
+
+
+class SimulationCache:
+    def __init__(self, max_size: int = 32):
+        """
+        In-memory cache of simulation results, keyed by scenario_key. When
+        full, the least recently used result is discarded.
+         - max_size: maximum number of results
+        """
+        self.max_size = max_size
+        self._results = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._results)
+
+    def __contains__(self, key):
+        return key in self._results
+
+    def get(self, key):
+        """
+        Return the result for a key, or None if not in cache.
+        """
+        if key not in self._results:
+            return None
+        self._results.move_to_end(key)
+        return self._results[key]
+
+    def put(self, key, result: SimulationResult):
+        self._results[key] = result
+        self._results.move_to_end(key)
+        while len(self._results) > self.max_size:
+            self._results.popitem(last=False)
+
+
+def _plain_motor(motor: Motor):
+    """
+    Copy of the constants of a motor (e.g. a DisplayMotor of the GUI) as a
+    plain Motor, to send it to a process pool worker: the values are copied
+    exactly, unlike a round-trip through to_dict.
+    """
+    plain = Motor(1, 1, 1, 1, 1, 1, 48, 1)
+    plain.copy(motor)
+    return plain
+
+
+def _simulate_plain_motor(motor, kwargs):
+    # Process pool worker.
+    return simulate(motor, **kwargs)
+
+
+def simulate_batch(motors: tp.List[Motor],
+                   *args,
+                   cache: tp.Optional[SimulationCache] = None,
+                   engine: str = "auto",
+                   n_processes: tp.Optional[int] = None,
+                   **kwargs):
+    """
+    Simulate the same scenario for several motors.
+    Parameters:
+     - motors: list of motors
+     - args, kwargs: the other arguments of simulate() (after the motor)
+     - cache: if set, results are taken from / stored in this cache: motors
+       that did not change are not simulated again
+     - engine: how to run the simulations that are not in cache:
+        - "sequential": one after the other, with simulate()
+        - "batched": all at once, with simulate_multi_axis (PIController only,
+          without the additional options of simulate(), ideal motors only)
+        - "process": in parallel, in a pool of processes
+        - "auto": "sequential" if the compiled kernel is available (each
+          simulation is then very fast), "batched" otherwise when possible.
+     - n_processes: number of processes for the "process" engine
+       (default: number of CPUs)
+    Return: list of SimulationResult, in the order of motors.
+    """
+    arguments = inspect.signature(simulate).bind(motors[0] if motors else None, *args, **kwargs)
+    arguments.apply_defaults()
+    p = arguments.arguments
+    gui_queue = p["gui_queue"]
+
+    keys = [scenario_key(m, *args, **kwargs) for m in motors]
+    results = [None if cache is None else cache.get(k) for k in keys]
+    todo = [i for i, r in enumerate(results) if r is None]
+
+    batch_supported = all(type(p[c]) is PIController for c in ["current_controller", "velocity_controller", "position_controller"]) \
+        and p["field_weakening"] is None and not p["current_feedforward"] and not p["inertia_feedforward"] \
+        and p["transmission"] is None and p["current_reference"] is None and p["inverter"] is None and not p["switching"] \
+        and p["sensors"] is None and all(m.magnetics is None for m in motors)
+    if engine == "auto":
+        engine = "batched" if batch_supported and not HAS_NUMBA else "sequential"
+    if engine == "batched" and not batch_supported:
+        raise ValueError("The batched engine only supports PIController, without the options of simulate().")
+
+    if len(todo) > 0:
+        if engine == "batched":
+            n = len(todo)
+            batch = simulate_multi_axis([motors[i] for i in todo],
+                                        p["control_type"],
+                                        [p["target_signal"]] * n,
+                                        p["duration"],
+                                        p["system_inertia"],
+                                        p["system_friction"],
+                                        p["current_controller"],
+                                        p["velocity_controller"],
+                                        p["position_controller"],
+                                        p["control_loop_frequency"],
+                                        [p["current_direct_target"]] * n,
+                                        [p["load_torque_signal"]] * n,
+                                        integration_substeps=p["integration_substeps"],
+                                        gui_queue=gui_queue)
+            for k, i in enumerate(todo):
+                results[i] = batch.axis(k)
+        elif engine in ["process", "sequential"]:
+            # Progress is reported as simulations complete (the gui queue
+            # cannot be shared with other processes anyway).
+            simulate_kwargs = {k: v for k, v in p.items() if k not in ["motor", "gui_queue"]}
+            if engine == "process":
+                with concurrent.futures.ProcessPoolExecutor(n_processes) as executor:
+                    futures = [executor.submit(_simulate_plain_motor, _plain_motor(motors[i]), simulate_kwargs) for i in todo]
+                    for k, i in enumerate(todo):
+                        results[i] = futures[k].result()
+                        results[i].motor = motors[i]
+                        if gui_queue:
+                            gui_queue.put(float((k + 1) / len(todo)))
+            else:
+                for k, i in enumerate(todo):
+                    results[i] = simulate(motors[i], **simulate_kwargs)
+                    if gui_queue:
+                        gui_queue.put(float((k + 1) / len(todo)))
+        else:
+            raise ValueError(f"Unknown engine {engine}")
+
+    if cache is not None:
+        for i in todo:
+            cache.put(keys[i], results[i])
+    return results
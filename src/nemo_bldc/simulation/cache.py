@@ -0,0 +1,174 @@
+# Persistent, content-addressed cache of simulation results
+import typing as tp
+import numpy as np
+import os
+import json
+import time
+import hashlib
+import tempfile
+import functools
+
+from .simulate import simulate, SimulationResult, ControlType
+from .batch import scenario_key
+from ..physics.motor import Motor
+
+# Changing the format of the files must change this version, to invalidate
+# previous results. Changes of the simulation itself are detected by
+# sources_hash.
+CACHE_VERSION = 1
+
+
+@functools.lru_cache(maxsize=None)
+def sources_hash():
+    """
+    sha256 hash (hexadecimal string) of the python sources of the physics and
+    simulation packages, on which the simulation results depend: results of
+    a previous version of nemo_bldc (e.g. before an upgrade) are not reused.
+    """
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    sha = hashlib.sha256()
+    for package in ["physics", "simulation"]:
+        directory = os.path.join(root, package)
+        for name in sorted(os.listdir(directory)):
+            if name.endswith(".py"):
+                sha.update(f"{package}/{name}".encode())
+                with open(os.path.join(directory, name), "rb") as f:
+                    sha.update(f.read())
+    return sha.hexdigest()
+
+
+def default_cache_directory():
+    """
+    Default location of the cache: $XDG_CACHE_HOME/nemo_bldc/simulations, or
+    ~/.cache/nemo_bldc/simulations.
+    """
+    root = os.environ.get("XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache"))
+    return os.path.join(root, "nemo_bldc", "simulations")
+
+
+class DiskSimulationCache:
+    def __init__(self, directory: tp.Optional[str] = None, max_size: int = 500 * 2**20):
+        """
+        On-disk cache of simulation results, with the same interface as
+        batch.SimulationCache: it can be shared by several sessions (and CI
+        runs).
+        Each result is stored in a .npz file, named by a sha256 hash of its
+        key (see batch.scenario_key): the motor constants, signals,
+        controller gains, control type..., and of the version of the
+        simulation code (see sources_hash). When the total size of the files
+        exceeds max_size, the least recently used results are removed.
+         - directory: location of the cache (default: default_cache_directory())
+         - max_size: maximum size of the cache, in bytes
+        """
+        self.directory = directory if directory is not None else default_cache_directory()
+        self.max_size = max_size
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, key):
+        digest = hashlib.sha256(repr((CACHE_VERSION, sources_hash(), key)).encode()).hexdigest()
+        return os.path.join(self.directory, digest + ".npz")
+
+    def _files(self):
+        return [os.path.join(self.directory, f) for f in os.listdir(self.directory) if f.endswith(".npz")]
+
+    def __len__(self):
+        return len(self._files())
+
+    def __contains__(self, key):
+        return os.path.exists(self._path(key))
+
+    def get(self, key):
+        """
+        Return the result for a key, or None if not in cache.
+        """
+        path = self._path(key)
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                metadata = json.loads(str(data["metadata"]))
+                result = SimulationResult(data["time"], Motor.FromDict(metadata["motor"]),
+                                          ControlType[metadata["control_type"]])
+                for name in data.files:
+                    if name not in ["metadata", "time"]:
+                        setattr(result, name, data[name])
+                if "theta_load" not in data.files:
+                    result.theta_load = result.theta
+                    result.dtheta_load = result.dtheta
+        except (OSError, KeyError, ValueError):
+            # Missing, or corrupted (e.g. concurrent write): simulate again.
+            return None
+        self._touch(path)
+        return result
+
+    def _touch(self, path):
+        # Mark as recently used. The time is set explicitly: file system
+        # timestamps can be too coarse to order successive accesses.
+        now = time.time_ns()
+        try:
+            os.utime(path, ns=(now, now))
+        except FileNotFoundError:
+            # Evicted or replaced by another process in the meantime.
+            pass
+
+    def put(self, key, result: SimulationResult):
+        arrays = {k: v for k, v in vars(result).items() if isinstance(v, np.ndarray)}
+        if result.theta_load is result.theta:
+            del arrays["theta_load"], arrays["dtheta_load"]
+        metadata = {"motor": result.motor.to_dict(), "control_type": result.control_type.name}
+        # Write to a temporary file first, so that other processes never read
+        # a partial file.
+        fd, temporary_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.savez(f, metadata=np.array(json.dumps(metadata)), **arrays)
+            os.replace(temporary_path, self._path(key))
+        finally:
+            if os.path.exists(temporary_path):
+                os.remove(temporary_path)
+        self._touch(self._path(key))
+        self.evict()
+
+    def evict(self):
+        """
+        Remove the least recently used results, until the cache fits in max_size.
+        """
+        files = []
+        for path in self._files():
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+        total_size = sum(f[1] for f in files)
+        for _, size, path in sorted(files):
+            if total_size <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total_size -= size
+
+    def clear(self):
+        """
+        Remove all the results.
+        """
+        for path in self._files():
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+def cached_simulate(cache, *args, **kwargs):
+    """
+    Call simulate(*args, **kwargs), unless the same simulation is in cache
+    (a SimulationCache or DiskSimulationCache).
+    """
+    key = scenario_key(*args, **kwargs)
+    result = cache.get(key)
+    if result is None:
+        result = simulate(*args, **kwargs)
+        cache.put(key, result)
+    elif kwargs.get("gui_queue") is not None:
+        kwargs["gui_queue"].put(1.0)
+    return result
@@ -0,0 +1,124 @@
+import typing as tp
+import numpy as np
+
+from ..physics.motor import Motor
+
+
+class AbstractController:
+    """
+    Abstract class representing a discrete-time feedback controller, as used
+    in the cascade of simulate().
+    The controller is called once per control period with the current error
+    e = x - x_target, and returns the control output.
+    Attributes listed in state_attributes are the internal state of the
+    controller, not its parameters (they are ignored to identify a scenario,
+    see batch.scenario_key).
+    """
+    state_attributes: tp.Tuple[str, ...] = ()
+
+    def reset_integral(self, value: float = 0):
+        """
+        Reset the internal state of the controller (integral, filters...)
+        """
+        pass
+
+    def compute(self, e: float, dt: float):
+        """
+        Compute next controller output
+        Parameters:
+         - e: current error (x - x_target)
+         - dt: time (in s) since last call
+        Returns: controller output
+        """
+        return 0.0 * e
+
+
+class PIDController(AbstractController):
+    state_attributes = ("integral", "derivative", "last_error")
+
+    def __init__(self, Kp: float, Ki: float, Kd: float, integral_max: float, derivative_cutoff: float = 100.0):
+        """
+        A PID controller, with anti-windup and filtered derivative
+        The output of the controller is given by:
+        u = - Kp * ((e) + sat(Ki * int(e)) + Kd * filt(de/dt))
+        where e = x - x_target is the error ; int is a time integral, sat a
+        saturation at integral_max, and filt a first-order low-pass filter.
+        Parameters:
+         - Kp: proportional gain
+         - Ki: integral gain
+         - Kd: derivative gain
+         - integral_max: anti-windup: maximum value of Ki * integral
+         - derivative_cutoff: cutoff frequency of the derivative filter, in Hz
+        """
+        self.Kp = Kp
+        self.Ki = Ki
+        self.Kd = Kd
+        self.integral_max = integral_max
+        self.derivative_cutoff = derivative_cutoff
+        self.reset_integral()
+
+    def reset_integral(self, value: float = 0):
+        """
+        Reset the integral to a specific value, and the derivative filter.
+        """
+        self.integral = value
+        self.derivative = 0
+        self.last_error = None
+
+    def compute(self, e: float, dt: float):
+        """
+        Compute next PID output
+        Parameters:
+         - e: current error (x - x_target)
+         - dt: time (in s) since last call
+        Returns: PID output
+        """
+        # Anti-windup
+        if self.Ki > 1e-10:
+            self.integral = np.maximum(-self.integral_max / self.Ki, np.minimum(self.integral_max / self.Ki, self.integral + dt * e))
+
+        # Filtered derivative: exact discretization of the first-order filter.
+        if self.last_error is not None:
+            alpha = np.exp(-2 * np.pi * self.derivative_cutoff * dt)
+            self.derivative = alpha * self.derivative + (1 - alpha) * (e - self.last_error) / dt
+        self.last_error = e
+
+        return - self.Kp * (e + self.Ki * self.integral + self.Kd * self.derivative)
+
+
+class FieldWeakeningController:
+    def __init__(self, motor: Motor, voltage_margin: float = 0.95):
+        """
+        Field weakening (defluxing): compute the direct current target needed
+        to reach the current operating point, using the motor model
+        (Motor.compute_defluxing_current).
+        Parameters:
+         - motor: motor model used by the controller
+         - voltage_margin: fraction of the driver voltage available to the
+           controller, to keep some voltage for the transients of the current loop
+        """
+        self.motor = Motor(1, 1, 1, 1, 1, 1, 48, 1)
+        self.motor.copy(motor)
+        self.motor.update_constants(U=voltage_margin * motor.U)
+
+    def compute(self, iq_target: float, velocity: float, n_candidates: int = 32):
+        """
+        Compute the direct current target
+        Parameters:
+         - iq_target: quadrature current target
+         - velocity: current articular velocity
+         - n_candidates: resolution of the search of the reachable point
+        Returns: direct current target (zero or negative)
+        Note: at high speed, the requested quadrature current may not be
+        reachable within the current limit: the direct current is then computed
+        for the largest reachable quadrature current, tested over a grid of
+        candidate values in a single vectorized call.
+        """
+        iq_max = self.motor.iq_max
+        i_q = np.clip(iq_target, -iq_max, iq_max) * np.linspace(1.0, 0.0, n_candidates)
+        i_d = self.motor.compute_defluxing_current(self.motor.kt_q_art * i_q, velocity)
+        feasible = i_d**2 + i_q**2 <= iq_max**2
+        if not np.any(feasible):
+            # Point not reachable: deflux as much as possible.
+            return -iq_max
+        return float(i_d[np.argmax(feasible)])
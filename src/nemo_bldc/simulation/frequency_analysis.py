@@ -0,0 +1,333 @@
+# Analysis of the control loops, on a linearized model of the motor
+import typing as tp
+import numpy as np
+
+from .simulate import ControlType, SimulationResult
+from .pi_controller import PIController
+from .signal import SignalSinus
+from .multi_axis import simulate_multi_axis
+from .metrics import StepResponse, target_and_output
+from ..physics.motor import Motor
+
+# Index of the controlled variable in the state, for each control type.
+OUTPUT_INDEX = {ControlType.POSITION: 0, ControlType.VELOCITY: 1, ControlType.CURRENT: 2}
+
+
+class FrequencyResponse:
+    """
+    Frequency response of a control loop, see LinearizedCascade.frequency_response.
+     - frequency: frequencies, in Hz
+     - closed_loop: complex closed-loop response, from target to output
+     - open_loop: complex open-loop response (loop gain), the loop being
+       opened at the measurement of the output. Only available for the
+       linearized model: for measured responses, it is None, and the margins
+       are nan.
+     - coherence: for responses estimated from a broadband excitation, the
+       coherence between the target and the output, in [0, 1]: values far
+       from 1 indicate an unreliable estimate (noise, nonlinearity...)
+    """
+    def __init__(self, frequency: np.array, closed_loop: np.array, open_loop: tp.Optional[np.array] = None,
+                 coherence: tp.Optional[np.array] = None):
+        self.frequency = frequency
+        self.closed_loop = closed_loop
+        self.open_loop = open_loop
+        self.coherence = coherence
+
+    @property
+    def magnitude(self):
+        """
+        Closed-loop gain, in dB.
+        """
+        return 20 * np.log10(np.abs(self.closed_loop))
+
+    @property
+    def phase(self):
+        """
+        Closed-loop phase, in deg, unwrapped.
+        """
+        return np.rad2deg(np.unwrap(np.angle(self.closed_loop)))
+
+    @property
+    def bandwidth(self):
+        """
+        First frequency at which the closed-loop gain drops below -3dB (nan if
+        it does not happen in the frequency range).
+        """
+        return _first_crossing(self.frequency, np.abs(self.closed_loop) - 1 / np.sqrt(2), falling=True)
+
+    @property
+    def crossover_frequency(self):
+        """
+        Frequency at which the open-loop gain crosses 1 (nan if not in the frequency range).
+        """
+        if self.open_loop is None:
+            return np.nan
+        return _first_crossing(self.frequency, np.abs(self.open_loop) - 1, falling=True)
+
+    @property
+    def phase_margin(self):
+        """
+        Phase margin, in deg, at the crossover frequency (nan if not in the frequency range).
+        """
+        f = self.crossover_frequency
+        if np.isnan(f):
+            return np.nan
+        phase = np.interp(f, self.frequency, np.unwrap(np.angle(self.open_loop)))
+        # Distance to -180deg, modulo 360.
+        return (np.rad2deg(phase) + 180) % 360
+
+    @property
+    def gain_margin(self):
+        """
+        Gain margin, in dB, at the first frequency where the open-loop phase
+        crosses -180deg (inf if it does not happen in the frequency range).
+        """
+        if self.open_loop is None:
+            return np.nan
+        phase = np.rad2deg(np.unwrap(np.angle(self.open_loop)))
+        f = _first_crossing(self.frequency, phase + 180, falling=True)
+        if np.isnan(f):
+            return np.inf
+        return -20 * np.log10(np.interp(f, self.frequency, np.abs(self.open_loop)))
+
+
+def _first_crossing(x: np.array, y: np.array, falling: bool):
+    """
+    First x at which y crosses zero (linear interpolation), nan if none.
+    """
+    sign = y > 0 if falling else y < 0
+    idx = np.nonzero(sign[:-1] & ~sign[1:])[0]
+    if len(idx) == 0:
+        return np.nan
+    i = idx[0]
+    return x[i] - y[i] * (x[i + 1] - x[i]) / (y[i + 1] - y[i])
+
+
+class LinearizedCascade:
+    def __init__(self,
+                 motor: Motor,
+                 control_type: ControlType,
+                 system_inertia: float,
+                 system_friction: float,
+                 current_controller: PIController,
+                 velocity_controller: PIController = PIController(0, 0, 0),
+                 position_controller: PIController = PIController(0, 0, 0),
+                 control_loop_frequency: float = 1000,
+                 current_feedforward: bool = False,
+                 integration_substeps: int = 1):
+        """
+        Linear model of the control cascade of simulate(), for frequency and
+        step response analysis without time simulation.
+
+        The motor is linearized around zero speed and zero direct current:
+        only the quadrature axis remains, with the back-EMF coupling to the
+        velocity. The controllers are discrete, as in simulate() (same
+        integration of the error, same one sample delay), and the motor is
+        discretized like in simulate(): the model gives the small-signal
+        response of simulate(), ignoring the current and voltage saturations,
+        and the anti-windup.
+
+        Parameters: same as simulate().
+        """
+        self.control_type = control_type
+        self.dt = 1 / control_loop_frequency
+        self.output_index = OUTPUT_INDEX[control_type]
+
+        # Continuous model, state: theta, dtheta, iq.
+        A = np.array([[0.0, 1.0, 0.0],
+                      [0.0, -system_friction / system_inertia, motor.kt_q_art / system_inertia],
+                      [0.0, -motor.ke * motor.rho / motor.L, -motor.R / motor.L]])
+        B = np.array([0.0, 0.0, 1.0 / motor.L])
+        E = np.array([0.0, -1.0 / system_inertia, 0.0])
+        # Explicit Euler over the substeps, like MotorSimulator.step.
+        h = self.dt / integration_substeps
+        step = np.eye(3) + h * A
+        self.Ad = np.linalg.matrix_power(step, integration_substeps)
+        power_sum = sum(np.linalg.matrix_power(step, k) for k in range(integration_substeps))
+        self.Bd = h * power_sum @ B
+        self.Ed = h * power_sum @ E
+
+        self.controllers = [position_controller, velocity_controller, current_controller]
+        self.current_feedforward = current_feedforward
+        self.motor = motor
+
+        # Linear maps of one control step, built by evaluating it on each
+        # state and input. Closed-loop state: theta, dtheta, iq, then the
+        # integrals of the position, velocity and current controllers.
+        basis = np.eye(6)
+        self.M = np.stack([self._step(x, 0, 0, 0, x[self.output_index]) for x in basis], axis=1)
+        self.N = self._step(np.zeros(6), 1, 0, 0, 0)
+        self.P = self._step(np.zeros(6), 0, 1, 0, 0)
+        # Open loop: the controller sees a measurement independent of the state.
+        self.M_open = np.stack([self._step(x, 0, 0, 0, 0) for x in basis], axis=1)
+        self.B_open = self._step(np.zeros(6), 0, 0, 0, 1)
+
+    def _step(self, X: np.array, target: float, target_derivative: float, load: float, measure: float):
+        """
+        One step of the control loop, from state X: return the next state.
+        measure is the measurement of the controlled variable, used by the
+        outermost controller.
+        """
+        dt = self.dt
+        x = X[:3]
+        integrals = X[3:]
+        new_integrals = np.zeros(3)
+
+        def pi(k, e):
+            c = self.controllers[k]
+            if c.Ki <= 1e-10:
+                return - c.Kp * e
+            new_integrals[k] = integrals[k] + dt * e
+            return - c.Kp * (e + c.Ki * new_integrals[k])
+
+        if self.control_type == ControlType.POSITION:
+            vel_input = pi(0, measure - target)
+            iq_target = pi(1, x[1] - vel_input - target_derivative)
+        elif self.control_type == ControlType.VELOCITY:
+            iq_target = pi(1, measure - target)
+        else:
+            iq_target = target
+        current = measure if self.control_type == ControlType.CURRENT else x[2]
+        Vq = pi(2, current - iq_target)
+        if self.current_feedforward:
+            Vq = Vq + self.motor.ke * self.motor.rho * x[1]
+        return np.concatenate([self.Ad @ x + self.Bd * Vq + self.Ed * load, new_integrals])
+
+    def frequency_response(self, frequency: np.array):
+        """
+        Compute the closed-loop and open-loop responses of the controlled
+        variable, for all the frequencies at once.
+         - frequency: frequencies, in Hz (below the Nyquist frequency)
+        Return: FrequencyResponse
+        """
+        frequency = np.asarray(frequency, dtype=float)
+        s = 2j * np.pi * frequency
+        z = np.exp(s * self.dt)[:, None, None]
+        identity = np.eye(6)[None]
+        # The target of step k is the value of the target signal at the end
+        # of the step: it is advanced by one sample.
+        target = (self.N[None, :] + s[:, None] * self.P[None, :]) * z[:, :, 0]
+        closed_loop = np.linalg.solve(z * identity - self.M[None], target[:, :, None])[:, self.output_index, 0]
+        # Negative feedback: the loop gain is minus the response to the measurement.
+        open_loop = - np.linalg.solve(z * identity - self.M_open[None],
+                                      np.broadcast_to(self.B_open[None, :, None], (len(frequency), 6, 1)))[:, self.output_index, 0]
+        return FrequencyResponse(frequency, closed_loop, open_loop)
+
+    def step_response(self, duration: float):
+        """
+        Response of the controlled variable to a unit step of the target, at t = 0.
+        Return: StepResponse
+        """
+        time = np.arange(0, duration + self.dt, self.dt)
+        X = np.zeros(6)
+        output = np.zeros(len(time))
+        for i in range(1, len(time)):
+            X = self.M @ X + self.N
+            output[i] = X[self.output_index]
+        return StepResponse(time, output)
+
+    @property
+    def is_stable(self):
+        """
+        True if all the closed-loop poles are inside the unit circle. In
+        current and velocity control, the position (a pure integrator, which
+        does not act on the loop) is ignored.
+        """
+        states = slice(0, 6) if self.control_type == ControlType.POSITION else slice(1, 6)
+        return bool(np.all(np.abs(np.linalg.eigvals(self.M[states, states])) < 1))
+
+
+def estimate_frequency_response(result: SimulationResult, segment_length: int = 4096,
+                                start_time: float = 0.0, overlap: float = 0.5):
+    """
+    Estimate the closed-loop frequency response of a simulation, excited by
+    a broadband target (SignalChirp, SignalMultisine...), with Welch's
+    method: the target and output are cut in overlapping segments,
+    windowed (Hann window), and the response is the ratio of the averaged
+    cross-spectrum to the averaged spectrum of the target (H1 estimator).
+    Parameters:
+     - result: simulation result
+     - segment_length: number of samples per segment: sets the frequency
+       resolution, 1 / (segment_length dt)
+     - start_time: data before this time (initial transient) is ignored
+     - overlap: overlap of successive segments, as a fraction of their length
+    Return: FrequencyResponse (with coherence), up to the Nyquist frequency.
+    """
+    target, output = target_and_output(result)
+    dt = result.time[1] - result.time[0]
+    keep = result.time >= start_time
+    u = target[keep]
+    y = output[keep]
+    segment_length = min(segment_length, len(u))
+    step = max(1, int(segment_length * (1 - overlap)))
+    starts = np.arange(0, len(u) - segment_length + 1, step)
+    # All segments at once: shape (n_segments, segment_length).
+    index = starts[:, None] + np.arange(segment_length)
+    window = np.hanning(segment_length)
+
+    def spectrum(x):
+        x = x[index]
+        return np.fft.rfft(window * (x - np.mean(x, axis=1, keepdims=True)), axis=1)
+
+    U = spectrum(u)
+    Y = spectrum(y)
+    Suu = np.mean(np.abs(U)**2, axis=0)
+    Syy = np.mean(np.abs(Y)**2, axis=0)
+    Suy = np.mean(np.conj(U) * Y, axis=0)
+    frequency = np.fft.rfftfreq(segment_length, dt)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        response = Suy / Suu
+        coherence = np.abs(Suy)**2 / (Suu * Syy)
+    # The mean is removed from each segment: the DC component is meaningless.
+    return FrequencyResponse(frequency[1:], response[1:], coherence=coherence[1:])
+
+
+def measure_frequency_response(motor: Motor,
+                               control_type: ControlType,
+                               frequency: np.array,
+                               amplitude: float,
+                               system_inertia: float,
+                               system_friction: float,
+                               current_controller: PIController,
+                               velocity_controller: PIController = PIController(0, 0, 0),
+                               position_controller: PIController = PIController(0, 0, 0),
+                               control_loop_frequency: float = 1000,
+                               n_periods: int = 5,
+                               settling_time: float = 0.1,
+                               integration_substeps: int = 1):
+    """
+    Measure the closed-loop frequency response of simulate(), with one sine
+    target per frequency. All the frequencies are simulated at once, as
+    independent axes of simulate_multi_axis.
+    For each frequency, the response is the ratio of the Fourier
+    coefficients of the output and of the target, at this frequency, over
+    the largest whole number of periods after settling_time.
+    Unlike LinearizedCascade, this includes all the nonlinearities of the
+    simulation (saturation, rotation of the dq frame...): the amplitude sets
+    the operating point.
+    Parameters:
+     - frequency: frequencies of the sines, in Hz
+     - amplitude: amplitude of the sines (unit of the target)
+     - n_periods: minimum number of periods used at each frequency
+     - settling_time: transient ignored at the beginning of the simulation, in s
+     - other parameters: see simulate()
+    Return: FrequencyResponse
+    """
+    frequency = np.asarray(frequency, dtype=float)
+    n = len(frequency)
+    duration = settling_time + n_periods / np.min(frequency)
+    signals = [SignalSinus(f, 0.0, amplitude, 0.0) for f in frequency]
+    result = simulate_multi_axis([motor] * n, control_type, signals, duration,
+                                 system_inertia, system_friction,
+                                 current_controller, velocity_controller, position_controller,
+                                 control_loop_frequency, integration_substeps=integration_substeps)
+    target, output = target_and_output(result)
+    time = result.time
+    response = np.zeros(n, dtype=complex)
+    for k, f in enumerate(frequency):
+        # Whole number of periods, ending at the end of the simulation.
+        periods = np.floor((time[-1] - settling_time) * f)
+        window = time >= time[-1] - periods / f
+        e = np.exp(-2j * np.pi * f * time[window])
+        response[k] = np.sum(output[k, window] * e) / np.sum(target[k, window] * e)
+    return FrequencyResponse(frequency, response)
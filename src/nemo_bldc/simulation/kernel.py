@@ -0,0 +1,170 @@
+# Compiled version of the simulation loop of simulate().
+# The whole control and integration step is written with scalar operations
+# only, so that it can be compiled by numba, if available. Without numba, the
+# same code runs as plain python.
+import math
+import numpy as np
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+HAS_NUMBA = numba is not None
+
+
+def _jit(function):
+    if numba is None:
+        return function
+    return numba.njit(cache=True)(function)
+
+
+@_jit
+def _pi_compute(integral, k, e, dt, Kp, Ki, integral_max):
+    """
+    PIController.compute, for the controller k of the arrays.
+    """
+    if Ki[k] > 1e-10:
+        integral[k] = max(-integral_max[k] / Ki[k], min(integral_max[k] / Ki[k], integral[k] + dt * e))
+    return - Kp[k] * (e + Ki[k] * integral[k])
+
+
+@_jit
+def _clarke_park(theta, a, b, c):
+    """
+    Clarke-Park direct transform, see space_transforms.clarke_park
+    """
+    alpha = 2.0 / 3.0 * (a - b / 2.0 - c / 2.0)
+    beta = 2.0 / 3.0 * (math.sqrt(3.0) / 2.0 * b - math.sqrt(3.0) / 2.0 * c)
+    cos = math.cos(theta)
+    sin = math.sin(theta)
+    return cos * alpha + sin * beta, - sin * alpha + cos * beta
+
+
+@_jit
+def _svpwm(theta_el, Vd, Vq, Vdc, Vphase):
+    """
+    Space-vector PWM, see space_transforms.svpwm ; output is written in Vphase.
+    """
+    Uout = math.sqrt(Vd**2 + Vq**2) / Vdc * math.sqrt(3.0)
+    Uout = min(Uout, 1.0)
+
+    angle = (theta_el + math.atan2(Vq, Vd)) % (2 * math.pi)
+    sector = math.floor(angle / (math.pi / 3.0)) + 1
+
+    T1 = math.sqrt(3.0) * math.sin(sector * math.pi / 3 - angle) * Uout
+    T2 = math.sqrt(3.0) * math.sin(angle - (sector - 1) * math.pi / 3) * Uout
+    T0 = 1 - T1 - T2
+
+    if sector == 1:
+        Ta = T1 + T2 + T0/2
+        Tb = T2 + T0/2
+        Tc = T0/2
+    elif sector == 2:
+        Ta = T1 + T0/2
+        Tb = T1 + T2 + T0/2
+        Tc = T0/2
+    elif sector == 3:
+        Ta = T0/2
+        Tb = T1 + T2 + T0/2
+        Tc = T2 + T0/2
+    elif sector == 4:
+        Ta = T0/2
+        Tb = T1 + T0/2
+        Tc = T1 + T2 + T0/2
+    elif sector == 5:
+        Ta = T2 + T0/2
+        Tb = T0/2
+        Tc = T1 + T2 + T0/2
+    else:
+        Ta = T1 + T2 + T0/2
+        Tb = T0/2
+        Tc = T1 + T0/2
+
+    average = (Ta + Tb + Tc) / 3.0
+    Vphase[0] = (Ta - average) * Vdc / math.sqrt(3.0)
+    Vphase[1] = (Tb - average) * Vdc / math.sqrt(3.0)
+    Vphase[2] = (Tc - average) * Vdc / math.sqrt(3.0)
+
+
+@_jit
+def simulation_kernel(start, end, control_type, current_feedforward, dt, substeps,
+                      motor_constants, I, nu,
+                      Kp, Ki, integral_max, integral, state,
+                      target_value, target_derivative, direct_target, load_torque, iq_feedforward,
+                      theta, dtheta, idq, iphase, Vdq, Vphase, idq_target, Vdq_target):
+    """
+    Run the simulation loop of simulate() from step start to step end (excluded).
+    Parameters:
+     - control_type: ControlType value
+     - motor_constants: np, R, L, ke, iq_max, U, rho, kt_q_art of the motor
+     - Kp, Ki, integral_max, integral: parameters and integrals of the
+       position, velocity, direct and quadrature current controllers
+     - state: simulator state: theta, dtheta, iphase
+     - target_value...iq_feedforward: inputs, sampled over the time grid
+     - theta...Vdq_target: outputs, as in SimulationResult
+    Returns: index of the first unstable step, or -1 if the simulation is stable
+    """
+    n_p, R, L, ke, iq_max, U, rho, kt_q_art = motor_constants
+    V = np.zeros(3)
+    h = dt / substeps
+    for i in range(start, end):
+        # Position and velocity loops, if enabled.
+        id_target = direct_target[i]
+        if control_type == 1:
+            vel_input = _pi_compute(integral, 0, theta[i-1] - target_value[i], dt, Kp, Ki, integral_max)
+            iq_target = _pi_compute(integral, 1, dtheta[i-1] - vel_input - target_derivative[i], dt, Kp, Ki, integral_max) + iq_feedforward[i]
+        elif control_type == 2:
+            iq_target = _pi_compute(integral, 1, dtheta[i-1] - target_value[i], dt, Kp, Ki, integral_max) + iq_feedforward[i]
+        else:
+            iq_target = target_value[i]
+
+        # Saturate current target, giving priority to the quadrature current.
+        iq_target = min(iq_max, max(-iq_max, iq_target))
+        id_max = math.sqrt(iq_max**2 - iq_target**2)
+        id_target = min(id_max, max(-id_max, id_target))
+
+        Vd = _pi_compute(integral, 2, idq[0, i - 1] - id_target, dt, Kp, Ki, integral_max)
+        Vq = _pi_compute(integral, 3, idq[1, i - 1] - iq_target, dt, Kp, Ki, integral_max)
+        if current_feedforward:
+            w_el = n_p * rho * dtheta[i - 1]
+            Vd = Vd + -w_el * L * idq[1, i - 1]
+            Vq = Vq + w_el * L * idq[0, i - 1] + ke * rho * dtheta[i - 1]
+
+        # Integrate
+        _svpwm(n_p * rho * state[0], Vd, Vq, U, V)
+        for _ in range(substeps):
+            theta_el = n_p * rho * state[0]
+            _, iq = _clarke_park(theta_el, state[2], state[3], state[4])
+            tau = kt_q_art * iq - load_torque[i - 1]
+            ddtheta = (- nu * state[1] + tau) / I
+            e = ke * rho * state[1]
+            dia = (-R * state[2] + e * math.sin(theta_el) + V[0]) / L
+            dib = (-R * state[3] + e * math.sin(theta_el - 2 * math.pi / 3) + V[1]) / L
+            dic = (-R * state[4] + e * math.sin(theta_el + 2 * math.pi / 3) + V[2]) / L
+            state[0] += h * state[1]
+            state[1] += h * ddtheta
+            state[2] += h * dia
+            state[3] += h * dib
+            state[4] += h * dic
+
+        # Store results
+        theta[i] = state[0]
+        dtheta[i] = state[1]
+        theta_el = n_p * rho * state[0]
+        idq[0, i], idq[1, i] = _clarke_park(theta_el, state[2], state[3], state[4])
+        iphase[0, i] = state[2]
+        iphase[1, i] = state[3]
+        iphase[2, i] = state[4]
+        Vdq[0, i], Vdq[1, i] = _clarke_park(theta_el, V[0], V[1], V[2])
+        Vphase[0, i] = V[0]
+        Vphase[1, i] = V[1]
+        Vphase[2, i] = V[2]
+        idq_target[0, i] = id_target
+        idq_target[1, i] = iq_target
+        Vdq_target[0, i] = Vd
+        Vdq_target[1, i] = Vq
+
+        if max(abs(state[2]), abs(state[3]), abs(state[4])) > 10 * iq_max:
+            return i
+    return -1
@@ -0,0 +1,205 @@
+# Analysis of simulation results: power, energy, currents, tracking
+import typing as tp
+import numpy as np
+
+from .simulate import SimulationResult, ControlType
+
+# All the functions below take an optional window (a slice of the time
+# samples): long, or memory-mapped, results can thus be processed by chunks
+# (see compute_metrics), without creating full-length temporary arrays.
+
+
+def target_and_output(result: SimulationResult, window: slice = slice(None)):
+    """
+    Target and controlled variable of a simulation, according to its control type.
+    """
+    if result.control_type == ControlType.POSITION:
+        return result.pos_target[..., window], result.theta[..., window]
+    if result.control_type == ControlType.VELOCITY:
+        return result.vel_target[..., window], result.dtheta[..., window]
+    return result.idq_target[..., 1, window], result.idq[..., 1, window]
+
+
+def electrical_power(result: SimulationResult, window: slice = slice(None)):
+    """
+    Electrical power provided to the motor, in W: sum over the phases of
+    current x voltage.
+    """
+    return np.einsum("...kt,...kt->...t", result.iphase[..., window], result.Vphase[..., window])
+
+
+def mechanical_power(result: SimulationResult, window: slice = slice(None)):
+    """
+    Mechanical power produced by the motor (torque x speed), in W. With a
+    magnetic model (see MotorMagnetics), the torque includes the reluctance
+    torque, the back-EMF harmonics and the cogging torque.
+    """
+    motor = result.motor
+    if motor.magnetics is not None:
+        torque = motor.magnetics.torque(motor, result.theta[..., window], result.idq[..., window])
+        return torque * result.dtheta[..., window]
+    return motor.kt_q_art * result.idq[..., 1, window] * result.dtheta[..., window]
+
+
+def joule_losses(result: SimulationResult, window: slice = slice(None)):
+    """
+    Power dissipated in the windings, in W.
+    """
+    idq = result.idq[..., window]
+    return 3.0 / 2.0 * result.motor.R * np.einsum("...kt,...kt->...t", idq, idq)
+
+
+def magnetic_energy(result: SimulationResult, window: slice = slice(None)):
+    """
+    Energy stored in the inductance of the windings, in J.
+    With a magnetic model, the energy of the direct and quadrature fluxes,
+    3/4 (Ld id^2 + Lq iq^2), plus the energy of the cogging torque (which
+    gives back to the rotor what it takes from it). With saturation, the
+    inductances at the current amplitude are used: the energy is then
+    approximate.
+    """
+    motor = result.motor
+    if motor.magnetics is not None:
+        magnetics = motor.magnetics
+        i_d, i_q = result.idq[..., 0, window], result.idq[..., 1, window]
+        L_d, L_q = magnetics.inductances(i_d, i_q)
+        energy = 3.0 / 4.0 * (L_d * i_d**2 + L_q * i_q**2)
+        if magnetics.cogging_periods > 0:
+            k = magnetics.cogging_periods * motor.rho
+            energy = energy + magnetics.cogging_torque / k * np.cos(k * result.theta[..., window])
+        return energy
+    iphase = result.iphase[..., window]
+    return motor.L / 2.0 * np.einsum("...kt,...kt->...t", iphase, iphase)
+
+
+def cumulative_energy(power: np.array, dt: float):
+    """
+    Energy over time, in J, from a power sampled at dt: the power of
+    sample i is applied from sample i - 1 to sample i, like the voltage in
+    simulate().
+    """
+    energy = np.cumsum(power, axis=-1) * dt
+    return energy - energy[..., :1]
+
+
+def voltage_saturated(result: SimulationResult, window: slice = slice(None), threshold: float = 0.99):
+    """
+    True for the samples where the voltage asked by the current controller
+    exceeds threshold x the maximum voltage of the driver, U / sqrt(3).
+    """
+    Vdq = result.Vdq_target[..., window]
+    limit = threshold * result.motor.U / np.sqrt(3)
+    return np.einsum("...kt,...kt->...t", Vdq, Vdq) >= limit**2
+
+
+class StepResponse:
+    """
+    Response to a unit step of the target, see LinearizedCascade.step_response.
+     - time: time, in s
+     - output: controlled variable
+     - rise_time: time to go from 10% to 90% of the final value, in s
+     - overshoot: maximum overshoot, in % of the final value
+     - settling_time: time after which the output stays within 2% of the
+       final value, in s
+    These metrics are relative to the final value: they are nan if it is
+    zero (e.g. regulation around zero).
+    """
+    def __init__(self, time: np.array, output: np.array):
+        self.time = time
+        self.output = output
+        final = output[-1]
+        if final == 0:
+            self.rise_time = self.overshoot = self.settling_time = np.nan
+            return
+        above = np.nonzero(output >= 0.1 * final)[0]
+        above_90 = np.nonzero(output >= 0.9 * final)[0]
+        self.rise_time = time[above_90[0]] - time[above[0]] if len(above_90) > 0 else np.nan
+        self.overshoot = max(0.0, 100 * (np.max(output) - final) / final)
+        outside = np.nonzero(np.abs(output - final) > 0.02 * np.abs(final))[0]
+        self.settling_time = time[outside[-1] + 1] if len(outside) > 0 else 0.0
+
+
+class SimulationMetrics:
+    """
+    Summary of a simulation. Energies are in J, powers in W, currents in A,
+    times in s.
+     - electrical_energy, mechanical_energy, joule_energy: energy provided to
+       the motor, produced, and dissipated in the windings
+     - magnetic_energy_change: variation of the energy stored in the inductance
+     - inverter_energy: energy dissipated in the inverter (see the inverter
+       option of simulate), not included in the electrical energy
+     - energy_balance_error: electrical - mechanical - joule - magnetic
+       energy: should be small compared to the electrical energy
+     - peak_electrical_power
+     - rms_phase_current, peak_phase_current: for each phase
+     - rms_id, peak_id, rms_iq, peak_iq: direct and quadrature currents
+     - rms_tracking_error, max_tracking_error: error between the controlled
+       variable and its target
+     - voltage_saturation: fraction of the time where the voltage is
+       saturated (see voltage_saturated)
+     - step: StepResponse of the controlled variable (rise time, overshoot,
+       settling time), meaningful when the target is a step
+    """
+    def __init__(self, result: SimulationResult, start_time: float = 0.0, chunk_size: int = 2**16):
+        """
+        Parameters:
+         - result: simulation result
+         - start_time: samples before this time are ignored (e.g. to remove
+           an initial transient)
+         - chunk_size: number of samples processed at once: only a few arrays
+           of this size are created, whatever the duration of the simulation.
+        """
+        time = result.time
+        dt = time[1] - time[0]
+        start = int(np.searchsorted(time, start_time))
+        n = len(time) - start
+
+        energy = np.zeros(4)
+        peak_power = -np.inf
+        squares = np.zeros(5)
+        peaks = np.zeros(5)
+        tracking = [0.0, 0.0]
+        saturated = 0
+        for a in range(start, len(time), chunk_size):
+            w = slice(a, min(a + chunk_size, len(time)))
+            # The power of sample i is applied from sample i - 1 to i: the
+            # first sample only gives the initial state.
+            p = slice(max(a, start + 1), w.stop)
+            p_elec = electrical_power(result, p)
+            energy += dt * np.array([np.sum(p_elec), np.sum(mechanical_power(result, p)), np.sum(joule_losses(result, p)),
+                                     np.sum(result.inverter_losses[p])])
+            if len(p_elec) > 0:
+                peak_power = max(peak_power, np.max(p_elec))
+            # Phase currents, then direct and quadrature currents.
+            currents = np.concatenate([result.iphase[:, w], result.idq[:, w]])
+            squares += np.sum(currents**2, axis=1)
+            peaks = np.maximum(peaks, np.max(np.abs(currents), axis=1))
+            target, output = target_and_output(result, w)
+            error = output - target
+            tracking[0] += np.sum(error**2)
+            tracking[1] = max(tracking[1], np.max(np.abs(error)))
+            saturated += np.count_nonzero(voltage_saturated(result, w))
+
+        self.electrical_energy, self.mechanical_energy, self.joule_energy, self.inverter_energy = energy
+        stored = magnetic_energy(result, slice(start, None, max(1, n - 1)))
+        self.magnetic_energy_change = stored[-1] - stored[0]
+        self.energy_balance_error = self.electrical_energy - self.mechanical_energy \
+            - self.joule_energy - self.magnetic_energy_change
+        self.peak_electrical_power = peak_power
+        rms = np.sqrt(squares / n)
+        self.rms_phase_current = rms[:3]
+        self.peak_phase_current = peaks[:3]
+        self.rms_id, self.rms_iq = rms[3:]
+        self.peak_id, self.peak_iq = peaks[3:]
+        self.rms_tracking_error = np.sqrt(tracking[0] / n)
+        self.max_tracking_error = tracking[1]
+        self.voltage_saturation = saturated / n
+        _, output = target_and_output(result, slice(start, None))
+        self.step = StepResponse(time[start:] - time[start], output - output[0])
+
+
+def compute_metrics(result: SimulationResult, start_time: float = 0.0, chunk_size: int = 2**16):
+    """
+    Compute all the metrics of a simulation, see SimulationMetrics.
+    """
+    return SimulationMetrics(result, start_time, chunk_size)
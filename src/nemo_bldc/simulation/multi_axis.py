@@ -0,0 +1,264 @@
+import typing as tp
+import numpy as np
+import time
+
+from .signal import AbstractSignal, SignalConstant
+from .pi_controller import PIController, PIControllerBank
+from .simulate import ControlType, SimulationResult
+from .space_transforms import clarke_park_batch, svpwm_batch
+from ..physics.motor import Motor
+from ..physics.battery import get_battery_state
+
+# Fields of SimulationResult that are stored for each axis.
+AXIS_FIELDS = ["theta", "dtheta", "idq", "iphase", "Vdq", "Vphase", "pos_target",
+               "vel_target", "idq_target", "Vdq_target", "load_torque"]
+
+
+class MultiAxisSimulationResult:
+    def __init__(self, time: np.array, motors: tp.List[Motor], control_type: ControlType):
+        """
+        Result of simulate_multi_axis: the fields of SimulationResult, with an
+        additional first dimension for the axis (e.g. theta has shape (N, len(time))),
+        and the bus voltage and current.
+        """
+        self.time = time
+        self.motors = motors
+        self.control_type = control_type
+        n = len(motors)
+        l = len(time)
+        self.theta = np.zeros((n, l))
+        self.dtheta = np.zeros((n, l))
+        self.idq = np.zeros((n, 2, l))
+        self.iphase = np.zeros((n, 3, l))
+        self.Vdq = np.zeros((n, 2, l))
+        self.Vphase = np.zeros((n, 3, l))
+        self.pos_target = np.zeros((n, l))
+        self.vel_target = np.zeros((n, l))
+        self.idq_target = np.zeros((n, 2, l))
+        self.Vdq_target = np.zeros((n, 2, l))
+        self.load_torque = np.zeros((n, l))
+        self.bus_voltage = np.zeros(l)
+        self.bus_current = np.zeros(l)
+
+    def axis(self, k: int):
+        """
+        Return the result of a single axis, as a SimulationResult (sharing its
+        data with this object).
+        """
+        result = SimulationResult(self.time[:0], self.motors[k], self.control_type)
+        result.time = self.time
+        for name in AXIS_FIELDS:
+            setattr(result, name, getattr(self, name)[k])
+        result.theta_load = result.theta
+        result.dtheta_load = result.dtheta
+        result.inverter_losses = np.zeros(len(self.time))
+        result.current_ripple = np.zeros((3, len(self.time)))
+        return result
+
+
+def _controller_bank(controllers: tp.Union[PIController, tp.List[PIController]], n: int, width: int = 1):
+    """
+    Build a PIControllerBank of shape (n, width) (or (n,) if width is 1), from
+    one controller per axis, or a single controller for all axes.
+    """
+    if not isinstance(controllers, (list, tuple)):
+        controllers = [controllers] * n
+    if any(type(c) is not PIController for c in controllers):
+        raise ValueError("simulate_multi_axis only supports PIController: use simulate() for other controllers.")
+    bank = PIControllerBank.FromControllers(controllers)
+    if width == 1:
+        return bank
+    return PIControllerBank(bank.Kp[:, None] * np.ones(width), bank.Ki[:, None], bank.integral_max[:, None])
+
+
+def _as_matrix(value, n: int):
+    """
+    Convert a scalar, a vector (diagonal) or a matrix to a (n, n) matrix.
+    """
+    value = np.asarray(value, dtype=float)
+    if value.ndim < 2:
+        return np.diag(np.broadcast_to(value, (n,)))
+    return value
+
+
+def simulate_multi_axis(motors: tp.List[Motor],
+                        control_type: ControlType,
+                        target_signals: tp.List[AbstractSignal],
+                        duration: float,
+                        system_inertia: np.array,
+                        system_friction: np.array,
+                        current_controller: tp.Union[PIController, tp.List[PIController]],
+                        velocity_controller: tp.Union[PIController, tp.List[PIController]] = PIController(0, 0, 0),
+                        position_controller: tp.Union[PIController, tp.List[PIController]] = PIController(0, 0, 0),
+                        control_loop_frequency: float = 1000,
+                        current_direct_targets: tp.Optional[tp.List[AbstractSignal]] = None,
+                        load_torque_signals: tp.Optional[tp.List[AbstractSignal]] = None,
+                        coupling_stiffness: tp.Optional[np.array] = None,
+                        battery_voltage: tp.Optional[float] = None,
+                        battery_resistance: float = 0.0,
+                        integration_substeps: int = 1,
+                        gui_queue: tp.Optional["queue"] = None,
+                        ):
+    """
+    Simulate several motors at once, each one tracking its own reference
+    trajectory with the same cascade PI controller as simulate().
+    All axes are stepped together, using arrays of states.
+
+    The mechanical equation is, for the vector of articular positions theta:
+     - I ddtheta = tau - nu dtheta - K theta - load
+    where I, nu and K are matrices coupling the axes.
+
+    If battery_voltage is set, all motors are powered by the same battery
+    (see get_battery_state): the bus voltage, used as driver voltage, is updated
+    at each step from the electrical power drawn by the motors.
+    Otherwise, each motor is driven at its own voltage motor.U.
+
+    Parameters (see simulate for details):
+     - motors: list of the N motors
+     - control_type: type of control, for all axes
+     - target_signals: N target signals
+     - duration: simulation duration, in s
+     - system_inertia: inertia, scalar, (N,) or (N, N) inertia matrix
+     - system_friction: viscous friction, scalar, (N,) or (N, N) matrix
+     - current_controller, velocity_controller, position_controller: a
+       controller for all axes, or a list of N controllers
+     - control_loop_frequency: frequency of the controller, in Hz
+     - current_direct_targets: N direct current targets (default: zero)
+     - load_torque_signals: N additional load torques (default: zero)
+     - coupling_stiffness: (N, N) stiffness matrix K (default: no coupling)
+     - battery_voltage, battery_resistance: battery model of the DC bus
+     - integration_substeps: number of integration steps per control period
+     - gui_queue: if set, simulation progress is sent to this queue
+
+    Note that the motors are ideal: a magnetic model (see MotorMagnetics) is
+    only simulated by simulate().
+
+    Return: MultiAxisSimulationResult
+    """
+    n = len(motors)
+    if any(m.magnetics is not None for m in motors):
+        raise ValueError("simulate_multi_axis only supports ideal motors, without magnetic model.")
+    if current_direct_targets is None:
+        current_direct_targets = [SignalConstant()] * n
+    if load_torque_signals is None:
+        load_torque_signals = [SignalConstant()] * n
+
+    current_bank = _controller_bank(current_controller, n, 2)
+    velocity_bank = _controller_bank(velocity_controller, n)
+    position_bank = _controller_bank(position_controller, n)
+    for bank in [current_bank, velocity_bank, position_bank]:
+        bank.reset_integral(0)
+
+    dt = 1 / control_loop_frequency
+    simu_time = np.arange(0, duration + dt, dt)
+    result = MultiAxisSimulationResult(simu_time, motors, control_type)
+
+    # Sample all input signals.
+    target_value = np.zeros((n, len(simu_time)))
+    target_derivative = np.zeros((n, len(simu_time)))
+    direct_target = np.zeros((n, len(simu_time)))
+    for k in range(n):
+        target_value[k], target_derivative[k] = target_signals[k].sample(simu_time)
+        direct_target[k] = current_direct_targets[k].sample(simu_time)[0]
+        result.load_torque[k] = load_torque_signals[k].sample(simu_time)[0]
+    if control_type == ControlType.POSITION:
+        result.pos_target[:] = target_value
+        result.vel_target[:] = target_derivative
+    elif control_type == ControlType.VELOCITY:
+        result.vel_target[:] = target_value
+    else:
+        result.idq_target[:, 1, 0] = target_value[:, 0]
+    result.idq_target[:, 0, 0] = direct_target[:, 0]
+
+    # Motor constants, as arrays.
+    pole_factor = np.array([m.np * m.rho for m in motors])
+    R = np.array([m.R for m in motors])
+    L = np.array([m.L for m in motors])
+    ke_rho = np.array([m.ke * m.rho for m in motors])
+    kt_q_art = np.array([m.kt_q_art for m in motors])
+    iq_max = np.array([m.iq_max for m in motors])
+    inv_inertia = np.linalg.inv(_as_matrix(system_inertia, n))
+    friction = _as_matrix(system_friction, n)
+    stiffness = np.zeros((n, n)) if coupling_stiffness is None else np.asarray(coupling_stiffness, dtype=float)
+    phase_shift = np.array([0, -2 * np.pi / 3, 2 * np.pi / 3])
+
+    if battery_voltage is None:
+        U = np.array([m.U for m in motors])
+        result.bus_voltage[:] = np.nan
+        result.bus_current[:] = np.nan
+    else:
+        U = np.full(n, float(battery_voltage))
+        result.bus_voltage[0] = battery_voltage
+
+    theta = np.zeros(n)
+    dtheta = np.zeros(n)
+    iphase = np.zeros((n, 3))
+    h = dt / integration_substeps
+
+    last_update_time = time.time()
+    for i in range(1, len(simu_time)):
+        if gui_queue:
+            t = time.time()
+            if t - last_update_time > 0.020:
+                gui_queue.put(float(i / len(simu_time)))
+                last_update_time = t
+
+        # Position and velocity loops, if enabled.
+        idq_target = np.stack([direct_target[:, i], np.zeros(n)], axis=1)
+        if control_type == ControlType.POSITION:
+            vel_input = position_bank.compute(theta - target_value[:, i], dt)
+            idq_target[:, 1] = velocity_bank.compute(dtheta - vel_input - target_derivative[:, i], dt)
+        elif control_type == ControlType.VELOCITY:
+            idq_target[:, 1] = velocity_bank.compute(dtheta - target_value[:, i], dt)
+        else:
+            idq_target[:, 1] = target_value[:, i]
+
+        # Saturate current target, giving priority to the quadrature current.
+        idq_target[:, 1] = np.clip(idq_target[:, 1], -iq_max, iq_max)
+        id_max = np.sqrt(iq_max**2 - idq_target[:, 1]**2)
+        idq_target[:, 0] = np.clip(idq_target[:, 0], -id_max, id_max)
+
+        Vdq_target = current_bank.compute(result.idq[:, :, i - 1] - idq_target, dt)
+
+        # Integrate
+        Vphase = svpwm_batch(pole_factor * theta, Vdq_target, U)
+        load = result.load_torque[:, i - 1]
+        for _ in range(integration_substeps):
+            theta_el = pole_factor * theta
+            idq = clarke_park_batch(theta_el, iphase)
+            tau = kt_q_art * idq[:, 1] - load - stiffness @ theta
+            ddtheta = inv_inertia @ (tau - friction @ dtheta)
+            diphase = (-R[:, None] * iphase + (ke_rho * dtheta)[:, None] * np.sin(theta_el[:, None] + phase_shift) + Vphase) / L[:, None]
+            theta = theta + h * dtheta
+            dtheta = dtheta + h * ddtheta
+            iphase = iphase + h * diphase
+
+        # Store results
+        theta_el = pole_factor * theta
+        result.theta[:, i] = theta
+        result.dtheta[:, i] = dtheta
+        result.idq[:, :, i] = clarke_park_batch(theta_el, iphase)
+        result.iphase[:, :, i] = iphase
+        result.Vdq[:, :, i] = clarke_park_batch(theta_el, Vphase)
+        result.Vphase[:, :, i] = Vphase
+        result.idq_target[:, :, i] = idq_target
+        result.Vdq_target[:, :, i] = Vdq_target
+
+        if battery_voltage is not None:
+            # Update bus voltage for next step. If the battery cannot provide
+            # the power, it stays at the voltage of maximum power transfer.
+            power = np.sum(iphase * Vphase)
+            bus_voltage, bus_current = get_battery_state(battery_voltage, battery_resistance, power) \
+                if battery_resistance > 0 else (battery_voltage, power / battery_voltage)
+            if np.isnan(bus_voltage):
+                bus_voltage = battery_voltage / 2
+                bus_current = battery_voltage / 2 / battery_resistance
+            result.bus_voltage[i] = bus_voltage
+            result.bus_current[i] = bus_current
+            U[:] = bus_voltage
+
+        if np.max(np.abs(iphase) / iq_max[:, None]) > 10:
+            # Simulation is unstable
+            raise ArithmeticError("Excessive current detected, simulation is likely numerically unstable.\n" +\
+                            "Please check controller gains or increase control frequency.")
+    return result
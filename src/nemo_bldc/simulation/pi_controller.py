@@ -1,7 +1,11 @@
 import typing as tp
 import numpy as np
 
-class PIController:
+from .controller import AbstractController
+
+class PIController(AbstractController):
+    state_attributes = ("integral",)
+
     def __init__(self, Kp: float, Ki: float, integral_max: float):
         """
         A PI controller, with anti-windup
@@ -38,3 +42,65 @@ class PIController:
             self.integral = np.maximum(-self.integral_max / self.Ki, np.minimum(self.integral_max / self.Ki, self.integral + dt * e))
 
         return - self.Kp * (e + self.Ki * self.integral)
+
+
+class PIControllerBank:
+    def __init__(self, Kp: np.array, Ki: np.array, integral_max: np.array):
+        """
+        A bank of independent PI controllers, updated in a single vectorized
+        call. Each controller behaves exactly like a PIController (same output
+        and anti-windup), the gains and integrals being stored as arrays.
+        Parameters:
+         - Kp: proportional gains
+         - Ki: integral gains
+         - integral_max: anti-windup: maximum value of Ki * integral
+        All parameters are broadcast together, and define the shape of the
+        bank (e.g. (N,) for N loops, or (N, M) for M simulations of N loops).
+        """
+        Kp, Ki, integral_max = np.broadcast_arrays(np.asarray(Kp, dtype=float),
+                                                   np.asarray(Ki, dtype=float),
+                                                   np.asarray(integral_max, dtype=float))
+        self.Kp = Kp.copy()
+        self.Ki = Ki.copy()
+        self.integral_max = integral_max.copy()
+        self.integral = np.zeros(self.Kp.shape)
+        # Like in PIController, the integral is frozen when there is no integral gain.
+        self._has_integral = self.Ki > 1e-10
+        self._integral_bound = np.where(self._has_integral,
+                                        self.integral_max / np.where(self._has_integral, self.Ki, 1.0),
+                                        np.inf)
+
+    @staticmethod
+    def FromControllers(controllers: tp.List[PIController]):
+        """
+        Build a bank from a list of PIController, one loop per controller.
+        A controller acting on a vector (like the current controller, on the dq
+        pair) should be listed once per component.
+        """
+        return PIControllerBank([c.Kp for c in controllers],
+                                [c.Ki for c in controllers],
+                                [c.integral_max for c in controllers])
+
+    @property
+    def shape(self):
+        return self.Kp.shape
+
+    def reset_integral(self, value: np.array = 0):
+        """
+        Reset the integrals to a specific value (scalar or array)
+        """
+        self.integral = np.broadcast_to(np.asarray(value, dtype=float), self.shape).copy()
+
+    def compute(self, e: np.array, dt: float):
+        """
+        Compute next PI output of all controllers
+        Parameters:
+         - e: current errors (x - x_target), array of the bank's shape
+         - dt: time (in s) since last call
+        Returns: PI outputs
+        """
+        # Anti-windup
+        integral = np.clip(self.integral + dt * e, -self._integral_bound, self._integral_bound)
+        self.integral = np.where(self._has_integral, integral, self.integral)
+
+        return - self.Kp * (e + self.Ki * self.integral)
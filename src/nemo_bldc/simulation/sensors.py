@@ -0,0 +1,122 @@
+import typing as tp
+import math
+import numpy as np
+
+from ..physics.motor import Motor
+
+
+class SensorModel:
+    """
+    Imperfect measurements of the motor state, as read by the controllers of
+    simulate():
+     - position: the rotor angle (reduction ratio x theta) is truncated to
+       the resolution of the encoder. The velocity is then the difference of
+       successive measured positions over a control period.
+     - currents: each phase current is measured with a gaussian noise, then
+       quantized by the ADC. The direct and quadrature currents use the
+       measured position.
+     - delay: the controller uses measurements taken delay control periods
+       earlier (computation delay).
+     - velocity_cutoff: optional first-order low-pass filter on the velocity.
+    The measured position is also used for the modulation (see
+    MotorSimulator.step).
+
+    The measurements are stored in a preallocated ring buffer of delay + 1
+    samples. The noise is drawn from a seeded generator by blocks of
+    block_size samples. The internal state (attributes starting with _) is
+    reset at the start of each simulation, so the same scenario always gives
+    the same result.
+    """
+
+    def __init__(self,
+                 encoder_resolution: tp.Optional[int] = None,
+                 current_noise: float = 0.0,
+                 current_resolution: tp.Optional[float] = None,
+                 delay: int = 0,
+                 velocity_cutoff: tp.Optional[float] = None,
+                 seed: int = 0,
+                 block_size: int = 4096):
+        """
+        Parameters:
+         - encoder_resolution: number of counts per turn of the rotor (None:
+           perfect position and velocity)
+         - current_noise: standard deviation of the noise of the current
+           sensors, in A
+         - current_resolution: quantization step of the currents, in A (None:
+           no quantization)
+         - delay: computation delay, in control periods
+         - velocity_cutoff: cutoff frequency of the velocity filter, in Hz
+           (None: no filter)
+         - seed: seed of the noise generator
+         - block_size: number of noise samples drawn at once
+        """
+        if delay < 0:
+            raise ValueError("The delay must be a non-negative number of control periods.")
+        self.encoder_resolution = encoder_resolution
+        self.current_noise = current_noise
+        self.current_resolution = current_resolution
+        self.delay = int(delay)
+        self.velocity_cutoff = velocity_cutoff
+        self.seed = seed
+        self.block_size = block_size
+        self._motor = None
+
+    def reset(self, motor: Motor, dt: float):
+        """
+        Reset the internal state, at the start of a simulation.
+         - motor: simulated motor
+         - dt: control period, in s
+        """
+        self._motor = motor
+        self._dt = dt
+        # Measured theta, dtheta, id, iq, for the last delay + 1 periods.
+        self._buffer = np.zeros((self.delay + 1, 4))
+        self._index = -1
+        self._rng = np.random.default_rng(self.seed)
+        self._noise = np.zeros((0, 3))
+        self._noise_index = 0
+        self._last_position = None
+        self._velocity = 0.0
+        self._filter = 0.0 if self.velocity_cutoff is None else np.exp(-2 * np.pi * self.velocity_cutoff * dt)
+
+    def _next_noise(self):
+        if self._noise_index >= len(self._noise):
+            self._noise = self._rng.normal(0.0, self.current_noise, (self.block_size, 3))
+            self._noise_index = 0
+        self._noise_index += 1
+        return self._noise[self._noise_index - 1]
+
+    def measure(self, theta: float, dtheta: float, iphase: np.array):
+        """
+        Record the actual state at the current control period, and return
+        the measurement available to the controller: (theta, dtheta, idq).
+        """
+        m = self._motor
+        if self.encoder_resolution is None:
+            position, velocity = theta, dtheta
+        else:
+            count = 2 * np.pi / self.encoder_resolution
+            position = math.floor(m.rho * theta / count) * count / m.rho
+            velocity = dtheta if self._last_position is None else (position - self._last_position) / self._dt
+            self._last_position = position
+        self._velocity = self._filter * self._velocity + (1 - self._filter) * velocity
+
+        if self.current_noise > 0:
+            iphase = iphase + self._next_noise()
+        if self.current_resolution is not None:
+            iphase = np.round(iphase / self.current_resolution) * self.current_resolution
+        # Clarke-Park transform (see space_transforms.clarke_park), on scalars.
+        a, b, c = iphase.tolist()
+        alpha = (2 * a - b - c) / 3
+        beta = (b - c) / math.sqrt(3)
+        cos = math.cos(m.np * m.rho * position)
+        sin = math.sin(m.np * m.rho * position)
+
+        self._index += 1
+        sample = [position, self._velocity, cos * alpha + sin * beta, cos * beta - sin * alpha]
+        if self._index == 0:
+            # Before the first measurement, the sensors read the initial state.
+            self._buffer[:] = sample
+        self._buffer[self._index % len(self._buffer)] = sample
+        theta, dtheta, i_d, i_q = self._buffer[(self._index - self.delay) % len(self._buffer)]
+        return theta, dtheta, np.array([i_d, i_q])
@@ -1,4 +1,6 @@
+import typing as tp
 import numpy as np
+import itertools
 import sys
 
 class AbstractSignal:
@@ -10,18 +12,38 @@ class AbstractSignal:
         self.offset = offset
         self.omega = 2 * np.pi * frequency
         self.phi = phase_shift
+        self._sample_cache = None
 
     def value(self, t: float):
         """
         Return the value of the signal at time t
         """
-        return 0.0
+        return 0.0 * t
 
     def derivative(self, t: float):
         """
         Return the derivative of the signal at time t
         """
-        return 0.0
+        return 0.0 * t
+
+    def sample(self, time: np.array):
+        """
+        Evaluate the signal and its derivative over a full time grid, in a
+        single vectorized call.
+        The result is cached for the last grid used: sampling the same signal
+        on the same grid again is free. Note that signals are not meant to be
+        modified after creation, otherwise the cache would be wrong.
+        Parameters:
+         - time: array of time values
+        Returns: value, derivative: two arrays of the same shape as time
+        """
+        time = np.asarray(time, dtype=float)
+        key = (time.shape, hash(time.tobytes()))
+        if self._sample_cache is None or self._sample_cache[0] != key:
+            value = np.broadcast_to(self.value(time), time.shape).astype(float)
+            derivative = np.broadcast_to(self.derivative(time), time.shape).astype(float)
+            self._sample_cache = (key, value, derivative)
+        return self._sample_cache[1], self._sample_cache[2]
 
 class SignalConstant(AbstractSignal):
     def value(self, t: float):
@@ -71,6 +93,294 @@ class SignalTriangle(AbstractSignal):
         """
         return self.deriv.value(t)
 
+class SignalChirp(AbstractSignal):
+    def __init__(self, start_frequency: float, end_frequency: float, duration: float,
+                 amplitude: float = 1.0, offset: float = 0.0, logarithmic: bool = True):
+        """
+        Swept sine, from start_frequency to end_frequency (in Hz) over duration.
+        After duration, the sine continues at end_frequency.
+        Parameters:
+         - logarithmic: if True, the frequency increases exponentially (the
+           same time is spent on each decade), otherwise linearly.
+        """
+        super().__init__(start_frequency, 0.0, amplitude, offset)
+        self.f0 = start_frequency
+        self.f1 = end_frequency
+        self.duration = duration
+        self.logarithmic = logarithmic
+
+    def frequency(self, t: float):
+        """
+        Instantaneous frequency at time t, in Hz
+        """
+        x = np.clip(t / self.duration, 0.0, 1.0)
+        if self.logarithmic:
+            return self.f0 * (self.f1 / self.f0)**x
+        return self.f0 + (self.f1 - self.f0) * x
+
+    def _phase(self, t: float):
+        tc = np.minimum(t, self.duration)
+        if self.logarithmic:
+            k = np.log(self.f1 / self.f0)
+            phase = self.f0 * self.duration / k * (np.exp(k * tc / self.duration) - 1)
+        else:
+            phase = self.f0 * tc + (self.f1 - self.f0) * tc**2 / (2 * self.duration)
+        return 2 * np.pi * (phase + self.f1 * (t - tc))
+
+    def value(self, t: float):
+        return self.offset + self.A * np.sin(self._phase(t))
+
+    def derivative(self, t: float):
+        return self.A * 2 * np.pi * self.frequency(t) * np.cos(self._phase(t))
+
+class SignalMultisine(AbstractSignal):
+    def __init__(self, frequencies: tp.List[float], amplitude: float = 1.0, offset: float = 0.0,
+                 phases: tp.Optional[tp.List[float]] = None):
+        """
+        Sum of sines at several frequencies (in Hz), each of amplitude
+        amplitude.
+        By default, Schroeder phases are used: they keep the peak value of the
+        sum low (about sqrt(2 n) amplitude instead of n amplitude, for n
+        frequencies).
+        """
+        super().__init__(0.0, 0.0, amplitude, offset)
+        self.frequencies = np.asarray(frequencies, dtype=float)
+        n = len(self.frequencies)
+        if phases is None:
+            k = np.arange(1, n + 1)
+            phases = - np.pi * k * (k - 1) / n
+        self.phases = np.asarray(phases, dtype=float)
+
+    def value(self, t: float):
+        t = np.asarray(t, dtype=float)
+        angle = 2 * np.pi * self.frequencies * t[..., None] + self.phases
+        return self.offset + self.A * np.sum(np.sin(angle), axis=-1)
+
+    def derivative(self, t: float):
+        t = np.asarray(t, dtype=float)
+        angle = 2 * np.pi * self.frequencies * t[..., None] + self.phases
+        return self.A * np.sum(2 * np.pi * self.frequencies * np.cos(angle), axis=-1)
+
+class SignalSum(AbstractSignal):
+    def __init__(self, *signals: AbstractSignal):
+        """
+        Sum of several signals.
+        """
+        super().__init__()
+        self.signals = signals
+
+    def value(self, t: float):
+        return sum(s.value(t) for s in self.signals) + 0.0 * t
+
+    def derivative(self, t: float):
+        return sum(s.derivative(t) for s in self.signals) + 0.0 * t
+
+class SignalPiecewise(AbstractSignal):
+    def __init__(self, breakpoints: tp.List[float], signals: tp.List[AbstractSignal]):
+        """
+        Signal made of several signals, played one after the other.
+        Parameters:
+         - breakpoints: switching times, in increasing order
+         - signals: list of len(breakpoints) + 1 signals: signals[0] is used
+           before breakpoints[0], signals[i] between breakpoints[i - 1] and
+           breakpoints[i], and signals[-1] after breakpoints[-1]
+        Note: each signal is evaluated with the global time t (not the time
+        since the last breakpoint).
+        """
+        super().__init__()
+        if len(signals) != len(breakpoints) + 1:
+            raise ValueError("SignalPiecewise requires exactly one more signal than breakpoints.")
+        self.breakpoints = np.asarray(breakpoints, dtype=float)
+        self.signals = signals
+
+    def _select(self, t, function_name):
+        t = np.asarray(t, dtype=float)
+        index = np.searchsorted(self.breakpoints, t, side="right")
+        result = np.zeros(t.shape)
+        for i, s in enumerate(self.signals):
+            mask = index == i
+            if np.any(mask):
+                result[mask] = getattr(s, function_name)(t[mask])
+        return result if result.ndim > 0 else float(result)
+
+    def value(self, t: float):
+        return self._select(t, "value")
+
+    def derivative(self, t: float):
+        return self._select(t, "derivative")
+
+class SignalTable(AbstractSignal):
+    def __init__(self, time: np.array, values: np.array, derivatives: tp.Optional[np.array] = None):
+        """
+        Signal defined by a table of samples, linearly interpolated.
+        Outside of the time range, the first (resp. last) value is held.
+        Parameters:
+         - time: sample times, in increasing order
+         - values: signal values at each time
+         - derivatives: optional signal derivative at each time (also linearly
+           interpolated). If not given, the slope of the interpolation is used.
+        """
+        super().__init__()
+        self.time = time
+        self.values = values
+        self.derivatives = derivatives
+
+    def _window(self, t):
+        """
+        Return the range of samples needed to interpolate the signal at times t:
+        only this part of the table is read, which matters for large
+        (memory-mapped) tables.
+        """
+        n = len(self.time)
+        start = max(0, int(np.searchsorted(self.time, np.min(t), side="right")) - 2)
+        end = min(n, int(np.searchsorted(self.time, np.max(t), side="left")) + 2)
+        return start, max(end, min(start + 2, n))
+
+    def value(self, t: float):
+        start, end = self._window(t)
+        return np.interp(t, self.time[start:end], self.values[start:end])
+
+    def derivative(self, t: float):
+        start, end = self._window(t)
+        time = np.asarray(self.time[start:end])
+        if self.derivatives is not None:
+            return np.interp(t, time, self.derivatives[start:end])
+        values = np.asarray(self.values[start:end])
+        t = np.asarray(t, dtype=float)
+        i = np.clip(np.searchsorted(time, t, side="right") - 1, 0, len(time) - 2)
+        slope = (values[i + 1] - values[i]) / (time[i + 1] - time[i])
+        # Signal is constant outside of the table.
+        return np.where((t < self.time[0]) | (t > self.time[-1]), 0.0, slope)
+
+class SignalRecording(SignalTable):
+    def __init__(self, time: np.array, values: np.array, derivatives: tp.Optional[np.array] = None):
+        """
+        Replay of a recorded trajectory (measured joint position, load
+        torque...), linearly interpolated.
+        This is meant for large recordings, typically memory-mapped using
+        FromFile: only the samples around the requested time are read.
+        Scalar evaluations use a cursor, so that successive calls with increasing
+        time (like in a simulation loop) cost O(1).
+        Parameters:
+         - time: sample times, in increasing order
+         - values: signal values at each time
+         - derivatives: optional signal derivative at each time. If not given,
+           it is estimated by central finite differences.
+        """
+        super().__init__(time, values, derivatives)
+        self._cursor = 0
+
+    @staticmethod
+    def FromFile(filename: str,
+                 value_column: int = 1,
+                 time_column: int = 0,
+                 derivative_column: tp.Optional[int] = None,
+                 delimiter: str = ","):
+        """
+        Load a recording from a file, with one sample per row.
+         - .npy files (2D array) are memory-mapped, and thus never fully loaded.
+         - other files are read as text (csv) files ; this requires loading
+           the whole file: use csv_to_npy to convert large logs once.
+        """
+        if str(filename).endswith(".npy"):
+            data = np.load(filename, mmap_mode="r")
+        else:
+            data = np.loadtxt(filename, delimiter=delimiter, ndmin=2)
+        derivatives = None if derivative_column is None else data[:, derivative_column]
+        return SignalRecording(data[:, time_column], data[:, value_column], derivatives)
+
+    def _locate(self, t: float):
+        """
+        Return the index i such that time[i] <= t < time[i + 1], updating the
+        cursor.
+        """
+        c = self._cursor
+        time = self.time
+        if t < time[c]:
+            c = max(0, int(np.searchsorted(time, t, side="right")) - 1)
+        else:
+            # Walk forward: this is usually only a few samples.
+            n = 0
+            while c < len(time) - 2 and time[c + 1] <= t:
+                c += 1
+                n += 1
+                if n > 8:
+                    c += max(0, int(np.searchsorted(time[c:], t, side="right")) - 1)
+                    c = min(c, len(time) - 2)
+                    break
+        self._cursor = c
+        return c
+
+    def _sample_derivative(self, i: int):
+        """
+        Derivative at sample i, using central finite differences.
+        """
+        if self.derivatives is not None:
+            return self.derivatives[i]
+        a = max(i - 1, 0)
+        b = min(i + 1, len(self.time) - 1)
+        return (self.values[b] - self.values[a]) / (self.time[b] - self.time[a])
+
+    def value(self, t: float):
+        if np.ndim(t) > 0:
+            return super().value(t)
+        if t <= self.time[0]:
+            return float(self.values[0])
+        if t >= self.time[-1]:
+            return float(self.values[-1])
+        i = self._locate(t)
+        alpha = (t - self.time[i]) / (self.time[i + 1] - self.time[i])
+        return float((1 - alpha) * self.values[i] + alpha * self.values[i + 1])
+
+    def derivative(self, t: float):
+        if np.ndim(t) > 0:
+            start, end = self._window(t)
+            time = np.asarray(self.time[start:end])
+            if self.derivatives is not None:
+                derivatives = self.derivatives[start:end]
+            else:
+                derivatives = np.gradient(np.asarray(self.values[start:end]), time)
+                # Use the same one-sided differences as the scalar path at the
+                # border of the window, unless it is the border of the table.
+                if start > 0:
+                    derivatives[0] = self._sample_derivative(start)
+                if end < len(self.time):
+                    derivatives[-1] = self._sample_derivative(end - 1)
+            result = np.interp(t, time, derivatives)
+            return np.where((t < self.time[0]) | (t > self.time[-1]), 0.0, result)
+        if t < self.time[0] or t > self.time[-1]:
+            return 0.0
+        i = self._locate(t)
+        i = min(i, len(self.time) - 2)
+        alpha = (t - self.time[i]) / (self.time[i + 1] - self.time[i])
+        return float((1 - alpha) * self._sample_derivative(i) + alpha * self._sample_derivative(i + 1))
+
+def csv_to_npy(csv_filename: str, npy_filename: str, delimiter: str = ",", chunk_size: int = 1000000):
+    """
+    Convert a (large) csv log file to a .npy file, that can then be memory-mapped
+    by SignalRecording.FromFile. The file is processed in chunks of rows, so
+    that it is never fully loaded in memory.
+    """
+    # Same rows as the ones read by np.loadtxt: neither blank nor comments.
+    def data_lines(f):
+        return (line for line in f if line.split("#", 1)[0].strip())
+
+    with open(csv_filename, "r") as f:
+        n_rows = sum(1 for _ in data_lines(f))
+    with open(csv_filename, "r") as f:
+        lines = data_lines(f)
+        first = np.loadtxt(itertools.islice(lines, 1), delimiter=delimiter, ndmin=2)
+        out = np.lib.format.open_memmap(npy_filename, mode="w+", dtype=float, shape=(n_rows, first.shape[1]))
+        out[0] = first[0]
+        row = 1
+        while row < n_rows:
+            chunk = np.loadtxt(itertools.islice(lines, chunk_size), delimiter=delimiter, ndmin=2)
+            if len(chunk) == 0:
+                break
+            out[row:row + len(chunk)] = chunk
+            row += len(chunk)
+        out.flush()
+
 def create_signal(signal_class_name: str,
                   frequency: float,
                   phase_shift: float,
@@ -4,9 +4,15 @@ from enum import Enum
 import time
 
 from .signal import AbstractSignal, SignalConstant
+from .controller import AbstractController, FieldWeakeningController
 from .pi_controller import PIController
-from .space_transforms import clarke_park, clarke_park_inv, svpwm
+from .space_transforms import clarke_park, clarke_park_inv, svpwm, pwm_duty_cycles
+from .kernel import HAS_NUMBA, simulation_kernel
+from .sensors import SensorModel
 from ..physics.motor import Motor
+from ..physics.transmission import Transmission
+from ..physics.current_reference import CurrentReferenceTables
+from ..physics.inverter import Inverter
 
 class ControlType(Enum):
     POSITION = 1
@@ -30,6 +36,13 @@ class SimulationResult:
         self.idq_target = np.zeros((2, l))
         self.Vdq_target = np.zeros((2, l))
         self.load_torque = np.zeros(l)
+        # Losses of the inverter, see simulate().
+        self.inverter_losses = np.zeros(l)
+        # Peak-to-peak ripple of the phase currents over each step, with switching.
+        self.current_ripple = np.zeros((3, l))
+        # Position of the load: differs from theta only with a transmission backlash.
+        self.theta_load = self.theta
+        self.dtheta_load = self.dtheta
 
 
 def bemf(theta):
@@ -44,7 +57,10 @@ class MotorSimulator:
                  inertia: float,
                  friction: float,
                  dt: float,
-                 load_torque_signal: AbstractSignal):
+                 load_torque_signal: AbstractSignal,
+                 substeps: int = 1,
+                 transmission: tp.Optional[Transmission] = None,
+                 switching_frequency: tp.Optional[float] = None):
         '''
         A class to simulate the motion of a brushless motor using a discrete controller
 
@@ -53,48 +69,157 @@ class MotorSimulator:
         @param friction Viscuous friction
         @param dt Step size
         @param AbstractSignal Resistive torque applied to the motor
+        @param substeps Number of integration steps per timestep dt: the phase
+                        voltages are held constant over dt, like with a
+                        discrete controller.
+        @param transmission Transmission between the motor and the load ; its
+                            ratio replaces the reduction ratio of the motor.
+                            With backlash, the load has its own position and
+                            velocity, appended to the state.
+        @param switching_frequency If set, the inverter switches at this
+                                   frequency (see step_switched) instead of
+                                   applying the mean phase voltages.
         '''
+        self.transmission = transmission
+        if transmission is not None:
+            motor = transmission.apply(motor)
+            if transmission.backlash > 0 and transmission.rotor_inertia <= 0:
+                raise ValueError("The rotor inertia of the transmission is needed to simulate backlash.")
+        if switching_frequency is not None and motor.magnetics is not None:
+            raise ValueError("The switched inverter is only supported for motors without magnetic model.")
         self.motor = motor
-        self.state = np.zeros(5) # Current state: theta, dtheta, iphase
+        self.switching_frequency = switching_frequency
+        # Peak-to-peak ripple of the phase currents over the last step, with switching.
+        self.current_ripple = np.zeros(3)
+        self.has_backlash = transmission is not None and transmission.backlash > 0
+        # Current state: theta, dtheta, iphase (and theta_load, dtheta_load with backlash)
+        self.state = np.zeros(7 if self.has_backlash else 5)
         self.I = inertia
         self.nu = friction
         self.dt = dt
+        self.substeps = substeps
         self.load = load_torque_signal
         self.t = 0
 
-    def _dynamics(self, t, x, Vphase):
+    def _dynamics(self, x, Vphase, load_torque):
         '''
         System dynamics.
 
         @param x System state
         @param Vphase Phase voltage
+        @param load_torque Resistive torque applied to the motor
         '''
         theta = x[0]
         dtheta = x[1]
-        iphase = x[2:]
+        iphase = x[2:5]
         idq = clarke_park(self.motor.np * self.motor.rho * theta, iphase)
-        tau = self.motor.kt_q_art * idq[1] - self.load.value(t)
-        ddtheta = (- self.nu * dtheta + tau) / self.I
-        dx = np.zeros(5)
+        magnetics = self.motor.magnetics
+        if magnetics is None:
+            tau = self.motor.kt_q_art * idq[1]
+        else:
+            tau = magnetics.torque(self.motor, theta, idq)
+        dx = np.zeros(len(x))
         dx[0] = dtheta
-        dx[1] = ddtheta
-        dx[2:] = (-self.motor.R * iphase + self.motor.ke * self.motor.rho * dtheta * bemf(self.motor.np * self.motor.rho * theta) + Vphase) / self.motor.L
+        if self.transmission is None:
+            dx[1] = (- self.nu * dtheta + tau - load_torque) / self.I
+        elif not self.has_backlash:
+            tau = self.transmission.load_torque(tau, dtheta, regularized=True)
+            dx[1] = (- self.nu * dtheta + tau - load_torque) / (self.I + self.transmission.reflected_inertia)
+        else:
+            # The rotor and the load are linked through the backlash.
+            tau_contact = self.transmission.contact_torque(theta - x[5], dtheta - x[6])
+            tau_rotor = self.transmission.motor_torque(tau_contact, dtheta, regularized=True)
+            dx[1] = (tau - tau_rotor) / self.transmission.reflected_inertia
+            dx[5] = x[6]
+            dx[6] = (- self.nu * x[6] + tau_contact - load_torque) / self.I
+        if magnetics is None:
+            dx[2:5] = (-self.motor.R * iphase + self.motor.ke * self.motor.rho * dtheta * bemf(self.motor.np * self.motor.rho * theta) + Vphase) / self.motor.L
+        else:
+            dx[2:5] = magnetics.current_derivative(self.motor, theta, dtheta, iphase, Vphase)
 
         return dx
 
-    def step(self, Vdq_target: np.array):
+    def step(self, Vdq_target: np.array, load_torque: tp.Optional[float] = None, theta: tp.Optional[float] = None):
         '''
         Integrate system state over a timestep dt, updating the system's internal state.
 
-        @param dt Integration length
         @param Vdq_target Direct and quadrature voltage target
+        @param load_torque Load torque over the timestep ; if None, the load
+                           signal is evaluated at the current time.
+        @param theta Position used to compute the phase voltages (e.g. as
+                     measured by an encoder) ; if None, the actual position.
         '''
-        Vphase = svpwm(self.motor.np * self.motor.rho * self.state[0], Vdq_target, self.motor.U)
+        if load_torque is None:
+            load_torque = self.load.value(self.t)
+        if theta is None:
+            theta = self.state[0]
+        Vphase = svpwm(self.motor.np * self.motor.rho * theta, Vdq_target, self.motor.U)
         self.Vphase = Vphase
+        if self.switching_frequency is not None:
+            self.step_switched(pwm_duty_cycles(Vphase, self.motor.U), load_torque)
+            return
 
-        self.state += self.dt * self._dynamics(self.t, self.state, self.Vphase)
+        h = self.dt / self.substeps
+        for _ in range(self.substeps):
+            self.state += h * self._dynamics(self.state, self.Vphase, load_torque)
         self.t += self.dt
 
+    def step_switched(self, duty_cycles: np.array, load_torque: float):
+        '''
+        Integrate system state over a timestep dt, the inverter switching with
+        center-aligned PWM: leg k is at the driver voltage while the triangular
+        carrier (from 0 to 1 and back, at the switching frequency, in phase
+        with t = 0) is below duty_cycles[k], and at 0 otherwise.
+        Between two switching instants the phase voltages are constant, and the
+        phase currents are integrated exactly (first order circuit driven by
+        the back-EMF, the speed being constant over the interval): no small
+        integration step is needed. The mechanical state uses an Euler step
+        per interval.
+
+        @param duty_cycles Duty cycles of the three legs, see pwm_duty_cycles
+        @param load_torque Load torque over the timestep
+        '''
+        m = self.motor
+        period = 1 / self.switching_frequency
+        t_end = self.t + self.dt
+        # Switching instants: each leg goes low at d T / 2 and high at
+        # (1 - d / 2) T in each period T of the carrier.
+        n = np.arange(np.floor(self.t / period), np.floor(t_end / period) + 1)[:, None]
+        instants = np.concatenate([(n + duty_cycles / 2) * period, (n + 1 - duty_cycles / 2) * period]).ravel()
+        instants = np.sort(np.concatenate([[self.t, t_end], instants[(instants > self.t) & (instants < t_end)]]))
+
+        i_min = self.state[2:5].copy()
+        i_max = self.state[2:5].copy()
+        shift = np.array([0, -2 * np.pi / 3, 2 * np.pi / 3])
+        for start, end in zip(instants[:-1], instants[1:]):
+            h = end - start
+            if h <= 0:
+                continue
+            # Leg voltages, from the carrier in the middle of the interval.
+            phase = ((start + end) / 2 / period) % 1.0
+            carrier = 2 * phase if phase < 0.5 else 2 - 2 * phase
+            V_leg = np.where(carrier < duty_cycles, m.U, 0.0)
+            Vphase = V_leg - np.mean(V_leg)
+
+            dx = self._dynamics(self.state, Vphase, load_torque)
+            # L di/dt = -R i + E sin(theta_el + shift + w_el t) + V: exponential
+            # relaxation towards the sinusoidal steady state.
+            theta_el = m.np * m.rho * self.state[0]
+            w_el = m.np * m.rho * self.state[1]
+            E = m.ke * m.rho * self.state[1]
+            Z = np.hypot(m.R, w_el * m.L)
+            lag = np.arctan2(w_el * m.L, m.R)
+            steady_start = Vphase / m.R + E / Z * np.sin(theta_el + shift - lag)
+            steady_end = Vphase / m.R + E / Z * np.sin(theta_el + shift - lag + w_el * h)
+            iphase = steady_end + (self.state[2:5] - steady_start) * np.exp(-h * m.R / m.L)
+
+            self.state += h * dx
+            self.state[2:5] = iphase
+            np.minimum(i_min, iphase, out=i_min)
+            np.maximum(i_max, iphase, out=i_max)
+        self.current_ripple = i_max - i_min
+        self.t = t_end
+
 
 def simulate(motor: Motor,
              control_type: ControlType,
@@ -102,18 +227,28 @@ def simulate(motor: Motor,
              duration: float,
              system_inertia: float,
              system_friction: float,
-             current_controller: PIController,
-             velocity_controller: PIController = PIController(0, 0, 0),
-             position_controller: PIController = PIController(0, 0, 0),
+             current_controller: AbstractController,
+             velocity_controller: AbstractController = PIController(0, 0, 0),
+             position_controller: AbstractController = PIController(0, 0, 0),
              control_loop_frequency: float = 1000,
              commutation_frequency: float = 10000,
              current_direct_target: AbstractSignal = SignalConstant(),
              load_torque_signal: AbstractSignal = SignalConstant(),
-             gui_queue: tp.Optional["queue"] = None
+             gui_queue: tp.Optional["queue"] = None,
+             field_weakening: tp.Optional[FieldWeakeningController] = None,
+             current_feedforward: bool = False,
+             inertia_feedforward: bool = False,
+             integration_substeps: int = 1,
+             backend: str = "auto",
+             transmission: tp.Optional[Transmission] = None,
+             current_reference: tp.Optional[CurrentReferenceTables] = None,
+             inverter: tp.Optional[Inverter] = None,
+             switching: bool = False,
+             sensors: tp.Optional[SensorModel] = None,
              ):
     """
     Simulate the motor tracking a reference trajectory using a classical
-    cascade PI controller.
+    cascade controller (PI by default, any AbstractController can be used).
 
     The mechanical equation is a simple load + viscuous friction:
      - I ddtheta = tau - nu dtheta
@@ -125,7 +260,61 @@ def simulate(motor: Motor,
 
     Parameters:
      - motor: the motor to simulate
-     - TODO
+     - control_type: type of control (position, velocity, current)
+     - target_signal: position, velocity or quadrature current target
+     - duration: simulation duration, in s
+     - system_inertia, system_friction: mechanical parameters I and nu
+     - current_controller, velocity_controller, position_controller: the
+       controllers of the cascade
+     - control_loop_frequency: frequency of the controller, in Hz
+     - commutation_frequency: PWM frequency of the inverter, in Hz, used for
+       its losses (see inverter), and with switching
+     - current_direct_target: direct current target
+     - load_torque_signal: additional resistive torque
+     - gui_queue: if set, simulation progress is sent to this queue
+     - field_weakening: if set, the direct current target is lowered
+       as needed to deflux the motor
+     - current_feedforward: add a feed-forward of the back-EMF and decoupling
+       of the dq cross-terms to the output of the current controller
+     - inertia_feedforward: add the current needed to follow the target
+       acceleration and velocity (computed from the system inertia and friction)
+       to the output of the velocity controller
+     - integration_substeps: number of integration steps per control period.
+       Increase it to run the controller at a low (firmware-like) frequency
+       while keeping the integration of the motor dynamics stable.
+     - backend: "python" runs the simulation step by step in python ;
+       "compiled" runs the whole loop in a single function, compiled with numba
+       if it is installed (see kernel.py) ; "auto" uses the compiled version
+       if numba is installed, and if the kernel supports the options used
+       (PIController only, no field weakening, no current reference, no
+       transmission, no magnetic model: see MotorMagnetics, no switching,
+       no sensor model).
+     - transmission: if set, transmission between the motor and the load
+       (friction, efficiency, reflected inertia and backlash) ; its ratio
+       replaces the reduction ratio of the motor. theta and dtheta are
+       then the position of the motor (divided by the ratio), the position
+       of the load being in theta_load and dtheta_load.
+     - current_reference: if set, tables of current references of the motor
+       (see CurrentReferenceTables, built for the motor with the ratio of the
+       transmission, if any): the quadrature current target is converted to
+       a torque target, and replaced by the optimal (id, iq) giving this
+       torque at the current speed (maximum torque per ampere, field
+       weakening), the direct current target being added to id. Cannot be
+       combined with field_weakening.
+     - inverter: if set, the losses of this inverter, at the commutation
+       frequency (in Hz), are computed from the phase currents at each step,
+       in result.inverter_losses. The switches are ideal for the dynamics.
+     - switching: if True, the inverter switches at the commutation frequency
+       (center-aligned PWM, see MotorSimulator.step_switched) instead of
+       applying the mean voltages of svpwm, to study the current ripple: the
+       results are still sampled at the control frequency, the peak-to-peak
+       ripple of each phase current over each step being stored in
+       result.current_ripple. integration_substeps is then not used. Only
+       for motors without magnetic model.
+     - sensors: if set, the controllers use imperfect measurements of the
+       position, velocity and currents (encoder resolution, current noise and
+       quantization, computation delay: see SensorModel) instead of the
+       actual state.
 
     Return: simulation result
     """
@@ -133,23 +322,85 @@ def simulate(motor: Motor,
     velocity_controller.reset_integral(0)
     position_controller.reset_integral(0)
 
+    if transmission is not None:
+        motor = transmission.apply(motor)
+
     dt = 1 / control_loop_frequency
     simu_time = np.arange(0, duration + dt, dt)
     result = SimulationResult(simu_time, motor, control_type)
 
-    t = 0
+    # All input signals are evaluated once, over the whole time grid.
+    target_value, target_derivative = target_signal.sample(simu_time)
+    direct_target, _ = current_direct_target.sample(simu_time)
+    load_torque, _ = load_torque_signal.sample(simu_time)
+
     if control_type == ControlType.POSITION:
-        result.pos_target[0] = target_signal.value(t)
-        result.vel_target[0] = target_signal.derivative(t)
+        result.pos_target[:] = target_value
+        result.vel_target[:] = target_derivative
     elif control_type == ControlType.VELOCITY:
-        result.vel_target[0] = target_signal.value(t)
+        result.vel_target[:] = target_value
     else:
-        result.idq_target[0, 1] = target_signal.value(t)
-    result.idq_target[0, 0] = current_direct_target.value(t)
-    result.load_torque[0] = load_torque_signal.value(t)
+        result.idq_target[1, 0] = target_value[0]
+    result.idq_target[0, 0] = direct_target[0]
+    result.load_torque[:] = load_torque
+
+    iq_feedforward = np.zeros(len(simu_time))
+    if inertia_feedforward and control_type != ControlType.CURRENT:
+        if control_type == ControlType.POSITION:
+            acceleration_target = np.gradient(target_derivative, dt)
+        else:
+            acceleration_target = target_derivative
+        iq_feedforward = (system_inertia * acceleration_target + system_friction * result.vel_target) / motor.kt_q_art
+        if transmission is not None:
+            iq_feedforward = (transmission.motor_torque(iq_feedforward * motor.kt_q_art, result.vel_target)
+                              + transmission.reflected_inertia * acceleration_target) / motor.kt_q_art
 
+    if current_reference is not None and field_weakening is not None:
+        raise ValueError("current_reference already includes field weakening: field_weakening must be None.")
+    kernel_supported = all(type(c) is PIController for c in [current_controller, velocity_controller, position_controller]) \
+        and field_weakening is None and current_reference is None and transmission is None and motor.magnetics is None \
+        and not switching and sensors is None
+    if backend == "compiled" and not kernel_supported:
+        raise ValueError("The compiled backend only supports PIController, without field weakening, current "
+                         "reference, transmission, magnetic model, switching or sensor model.")
+    if backend == "compiled" or (backend == "auto" and HAS_NUMBA and kernel_supported):
+        controllers = [position_controller, velocity_controller, current_controller, current_controller]
+        Kp = np.array([c.Kp for c in controllers], dtype=float)
+        Ki = np.array([c.Ki for c in controllers], dtype=float)
+        integral_max = np.array([c.integral_max for c in controllers], dtype=float)
+        integral = np.zeros(4)
+        state = np.zeros(5)
+        motor_constants = np.array([motor.np, motor.R, motor.L, motor.ke, motor.iq_max, motor.U, motor.rho, motor.kt_q_art], dtype=float)
 
-    simulator = MotorSimulator(motor, system_inertia, system_friction, dt, load_torque_signal)
+        # Run by chunks, to be able to report progress.
+        chunk_size = 5000
+        for start in range(1, len(simu_time), chunk_size):
+            if gui_queue:
+                gui_queue.put(float(start / len(simu_time)))
+            unstable_index = simulation_kernel(start, min(start + chunk_size, len(simu_time)), control_type.value,
+                                               current_feedforward, dt, integration_substeps,
+                                               motor_constants, system_inertia, system_friction,
+                                               Kp, Ki, integral_max, integral, state,
+                                               target_value, target_derivative, direct_target, load_torque, iq_feedforward,
+                                               result.theta, result.dtheta, result.idq, result.iphase, result.Vdq,
+                                               result.Vphase, result.idq_target, result.Vdq_target)
+            if unstable_index >= 0:
+                raise ArithmeticError("Excessive current detected, simulation is likely numerically unstable.\n" +\
+                                "Please check controller gains or increase control frequency.")
+        position_controller.integral = integral[0]
+        velocity_controller.integral = integral[1]
+        current_controller.integral = integral[2:].copy()
+        if inverter is not None:
+            result.inverter_losses[:] = inverter.compute_losses(result.iphase, motor.U, commutation_frequency)
+        return result
+
+    simulator = MotorSimulator(motor, system_inertia, system_friction, dt, load_torque_signal, integration_substeps, transmission,
+                               commutation_frequency if switching else None)
+    if simulator.has_backlash:
+        result.theta_load = np.zeros(len(simu_time))
+        result.dtheta_load = np.zeros(len(simu_time))
+    if sensors is not None:
+        sensors.reset(motor, dt)
 
     last_update_time = time.time()
     for i in range(1, len(simu_time)):
@@ -159,48 +410,67 @@ def simulate(motor: Motor,
             if t - last_update_time > 0.020:
                 gui_queue.put(float(i / len(simu_time)))
                 last_update_time = t
-        t = result.time[i]
+        # State seen by the controllers.
+        if sensors is None:
+            theta, dtheta, idq = result.theta[i-1], result.dtheta[i-1], result.idq[:, i-1]
+        else:
+            theta, dtheta, idq = sensors.measure(result.theta[i-1], result.dtheta[i-1], result.iphase[:, i-1])
 
         # Position and velocity loops, if enabled.
-        target_position = 0
-        target_velocity = 0
-        idq_target = np.array([current_direct_target.value(t), 0.0])
+        idq_target = np.array([direct_target[i], 0.0])
         if control_type == ControlType.POSITION:
-            target_position = target_signal.value(t)
-            target_velocity = target_signal.derivative(t)
-            vel_input = position_controller.compute(result.theta[i-1] - target_position, dt)
-            idq_target[1] = velocity_controller.compute(result.dtheta[i-1] - vel_input - target_velocity, dt)
+            vel_input = position_controller.compute(theta - target_value[i], dt)
+            idq_target[1] = velocity_controller.compute(dtheta - vel_input - target_derivative[i], dt) + iq_feedforward[i]
         elif control_type == ControlType.VELOCITY:
-            target_velocity = target_signal.value(t)
-            idq_target[1] = velocity_controller.compute(result.dtheta[i-1] - target_velocity, dt)
+            idq_target[1] = velocity_controller.compute(dtheta - target_value[i], dt) + iq_feedforward[i]
         else:
-            idq_target[1] = target_signal.value(t)
+            idq_target[1] = target_value[i]
+        if current_reference is not None:
+            i_d, i_q = current_reference(motor.kt_q_art * idq_target[1], dtheta)
+            idq_target = np.array([direct_target[i] + i_d, i_q])
 
         # Saturate current target, giving priority to the quadrature current.
         idq_target[1] = min(motor.iq_max, max(-motor.iq_max, idq_target[1]))
-        id_max = np.sqrt(motor.iq_max**2 - idq_target[1]**2)
-        idq_target[0] = min(id_max, max(-id_max, idq_target[0]))
+        if field_weakening is None:
+            id_max = np.sqrt(motor.iq_max**2 - idq_target[1]**2)
+            idq_target[0] = min(id_max, max(-id_max, idq_target[0]))
+        else:
+            # When defluxing, priority goes to the direct current: without it,
+            # the quadrature current cannot be obtained anyway.
+            idq_target[0] = min(idq_target[0], field_weakening.compute(idq_target[1], dtheta))
+            idq_target[0] = min(motor.iq_max, max(-motor.iq_max, idq_target[0]))
+            iq_max = np.sqrt(motor.iq_max**2 - idq_target[0]**2)
+            idq_target[1] = min(iq_max, max(-iq_max, idq_target[1]))
 
-        Vdq_target = current_controller.compute(result.idq[:, i - 1] - idq_target, dt)
+        Vdq_target = current_controller.compute(idq - idq_target, dt)
+        if current_feedforward:
+            # Back-EMF and dq cross-coupling terms of the motor electrical equations.
+            w_el = motor.np * motor.rho * dtheta
+            Vdq_target = Vdq_target + np.array([-w_el * motor.L * idq[1],
+                                                w_el * motor.L * idq[0] + motor.ke * motor.rho * dtheta])
 
         # Integrate
-        simulator.step(Vdq_target)
+        simulator.step(Vdq_target, load_torque[i - 1], None if sensors is None else theta)
 
         # Store results
         result.theta[i] = simulator.state[0]
         result.dtheta[i] = simulator.state[1]
-        result.idq[:, i] = clarke_park(motor.np * motor.rho * result.theta[i], simulator.state[2:])
-        result.iphase[:, i] = simulator.state[2:]
+        result.idq[:, i] = clarke_park(motor.np * motor.rho * result.theta[i], simulator.state[2:5])
+        result.iphase[:, i] = simulator.state[2:5]
         result.Vdq[:, i] = clarke_park(motor.np * motor.rho * result.theta[i], simulator.Vphase)
         result.Vphase[:, i] =  simulator.Vphase
-        result.pos_target[i] = target_position
-        result.vel_target[i] = target_velocity
         result.idq_target[:, i] = idq_target
         result.Vdq_target[:, i] = Vdq_target
-        result.load_torque[i] = simulator.load.value(t)
+        result.current_ripple[:, i] = simulator.current_ripple
+
+        if simulator.has_backlash:
+            result.theta_load[i] = simulator.state[5]
+            result.dtheta_load[i] = simulator.state[6]
 
-        if np.max(np.abs(simulator.state[2:])) > 10 * motor.iq_max:
+        if np.max(np.abs(simulator.state[2:5])) > 10 * motor.iq_max:
             # Simulation is unstable
             raise ArithmeticError("Excessive current detected, simulation is likely numerically unstable.\n" +\
                             "Please check controller gains or increase control frequency.")
+    if inverter is not None:
+        result.inverter_losses[:] = inverter.compute_losses(result.iphase, motor.U, commutation_frequency)
     return result
@@ -77,4 +77,63 @@ def svpwm(theta_el: float, Vdq: np.array, Vdc: float):
     Ua = (Ta - average) * Vdc / np.sqrt(3)
     Ub = (Tb - average) * Vdc / np.sqrt(3)
     Uc = (Tc - average) * Vdc / np.sqrt(3)
-    return np.array([Ua, Ub, Uc])
\ No newline at end of file
+    return np.array([Ua, Ub, Uc])
+
+def pwm_duty_cycles(Vphase: np.array, Vdc: float):
+    """
+    Duty cycles of the three legs of the inverter, between 0 and 1, switching
+    between 0 and Vdc, that give the phase voltages Vphase (e.g. from svpwm)
+    on average over a commutation period. The min-max common mode of
+    space-vector modulation is added, so that the duty cycles stay in [0, 1]
+    up to a phase voltage amplitude of Vdc / sqrt(3) (the limit of svpwm).
+
+    @param Vphase [Va Vb Vc] array, of zero sum
+    @param Vdc Driver voltage
+    @return [da db dc] array
+    """
+    common_mode = (np.max(Vphase) + np.min(Vphase)) / 2
+    return np.clip(0.5 + (Vphase - common_mode) / Vdc, 0.0, 1.0)
+
+def clarke_park_batch(theta: np.array, Vphase: np.array):
+    '''
+    Clarke-Park direct transform of several vectors at once
+
+    @param theta Electrical angles, shape (N,)
+    @param Vphase [Va Vb Vc] arrays, shape (N, 3)
+    @return [Vd Vq] arrays, shape (N, 2)
+    '''
+    alpha = 2 / 3 * (Vphase[:, 0] - Vphase[:, 1] / 2 - Vphase[:, 2] / 2)
+    beta = 2 / 3 * (np.sqrt(3) / 2 * Vphase[:, 1] - np.sqrt(3) / 2 * Vphase[:, 2])
+    c = np.cos(theta)
+    s = np.sin(theta)
+    return np.stack([c * alpha + s * beta, - s * alpha + c * beta], axis=1)
+
+
+# Coefficients of T1 and T2 in the duty cycles of each phase, for each sector
+# of svpwm.
+_SVPWM_T1 = np.array([[1, 0, 0], [1, 1, 0], [0, 1, 0], [0, 1, 1], [0, 0, 1], [1, 0, 1]])
+_SVPWM_T2 = np.array([[1, 1, 0], [0, 1, 0], [0, 1, 1], [0, 0, 1], [1, 0, 1], [1, 0, 0]])
+
+def svpwm_batch(theta_el: np.array, Vdq: np.array, Vdc: np.array):
+    """
+    Space-vector PWM of several vectors at once: see svpwm.
+
+    @param theta_el Electrical angles, shape (N,)
+    @param Vdq [Vd Vq] arrays, shape (N, 2)
+    @param Vdc Driver voltages, shape (N,) or scalar
+    @return [Va Vb Vc] arrays, shape (N, 3)
+    """
+    Uout = np.minimum(np.sqrt(Vdq[:, 0]**2 + Vdq[:, 1]**2) / Vdc * np.sqrt(3), 1)
+    angle = (theta_el + np.arctan2(Vdq[:, 1], Vdq[:, 0])) % (2 * np.pi)
+    sector = np.minimum(np.floor(angle / (np.pi / 3.0)) + 1, 6)
+
+    T1 = np.sqrt(3) * np.sin(sector * np.pi / 3 - angle) * Uout
+    T2 = np.sqrt(3) * np.sin(angle - (sector - 1) * np.pi / 3) * Uout
+    T0 = 1 - T1 - T2
+
+    index = sector.astype(int) - 1
+    T = _SVPWM_T1[index] * T1[:, None] + _SVPWM_T2[index] * T2[:, None] + T0[:, None] / 2
+
+    # Calculate the phase voltages, recentering them
+    average = np.mean(T, axis=1, keepdims=True)
+    return (T - average) * np.reshape(Vdc, (-1, 1)) / np.sqrt(3)
@@ -0,0 +1,87 @@
+# Fixtures shared by the unit tests.
+import os
+import numpy as np
+import pytest
+
+from nemo_bldc.ressources import DEFAULT_LIBRARY
+from nemo_bldc.simulation import ControlType, PIController, SignalSinus, SimulationCache, DiskSimulationCache, cached_simulate
+from nemo_bldc.simulation import simulate, simulate_multi_axis
+from nemo_bldc.simulation.kernel import HAS_NUMBA
+
+# Set to a directory to share the simulation results between the workers of
+# a parallel run (pytest -n, with pytest-xdist). The results of a previous
+# version of the code are never reused (see cache.sources_hash).
+CACHE_VARIABLE = "NEMO_BLDC_TEST_CACHE"
+
+
+@pytest.fixture(scope="session")
+def simulation_cache():
+    """
+    Cache of simulation results, shared by all the tests of a session (and
+    by the workers of a parallel run, see CACHE_VARIABLE).
+    """
+    directory = os.environ.get(CACHE_VARIABLE)
+    return SimulationCache(max_size=64) if directory is None else DiskSimulationCache(directory)
+
+
+@pytest.fixture(scope="session")
+def cached_simulation(simulation_cache):
+    """
+    simulate(), each scenario being simulated only once per session: the
+    results are shared between the tests, and must not be modified.
+    Not for the tests comparing backends: the backend is not part of the key.
+    """
+    def run(*args, **kwargs):
+        return cached_simulate(simulation_cache, *args, **kwargs)
+    return run
+
+
+@pytest.fixture(scope="session")
+def simulate_axes():
+    """
+    Simulate several scenarios of the same motor, one per target signal,
+    with their own inertia and friction (scalars, or arrays of the length of
+    target_signals), like the "auto" engine of simulate_batch: one compiled
+    simulate() per scenario if available, else all at once with
+    simulate_multi_axis.
+    Return: list of SimulationResult.
+    """
+    def run(motor, control_type, target_signals, duration, system_inertia, system_friction, *controllers,
+            control_loop_frequency=1000):
+        n = len(target_signals)
+        inertia, friction = np.broadcast_to(system_inertia, (n,)), np.broadcast_to(system_friction, (n,))
+        if HAS_NUMBA:
+            return [simulate(motor, control_type, target_signals[k], duration, inertia[k], friction[k], *controllers,
+                             control_loop_frequency=control_loop_frequency) for k in range(n)]
+        result = simulate_multi_axis([motor] * n, control_type, list(target_signals), duration, inertia, friction,
+                                     *controllers, control_loop_frequency=control_loop_frequency)
+        return [result.axis(k) for k in range(n)]
+    return run
+
+
+@pytest.fixture(scope="session")
+def position_scenario():
+    """
+    Arguments of simulate() for the reference position tracking scenario,
+    at 20kHz.
+    """
+    controllers = [PIController(2.0, 500.0, 30.0), PIController(100.0, 0.0, 10.0), PIController(10.0, 2.0, 10.0)]
+    return (DEFAULT_LIBRARY["MyActuator RMD-X6 V3"], ControlType.POSITION, SignalSinus(0.2, 0.0, 1.0, 0.0), 0.4, 0.1, 1.0,
+            *controllers)
+
+
+@pytest.fixture(scope="session")
+def gtk():
+    """
+    Gtk, initialized: the test is skipped if PyGObject is not installed, or
+    without a display (on a headless machine, run the tests with xvfb-run).
+    """
+    pytest.importorskip("gi")
+    import gi
+    gi.require_version("Gtk", "3.0")
+    from gi.repository import Gtk
+    initialized = Gtk.init_check()
+    # Depending on the version of PyGObject: a boolean, or (boolean, argv).
+    if not (initialized[0] if isinstance(initialized, tuple) else initialized):
+        pytest.skip("No display available for Gtk")
+    return Gtk
@@ -0,0 +1,44 @@
+import pytest
+import numpy as np
+from nemo_bldc.simulation import PIController, PIControllerBank, PIDController
+
+
+def test_pi_bank():
+    # A bank must behave exactly like the individual controllers.
+    controllers = [PIController(2.0, 500.0, 30.0),
+                   PIController(30.0, 5.0, 1.0),
+                   PIController(10.0, 0.0, 10.0),
+                   PIController(1.0, 100.0, 0.0)]
+    bank = PIControllerBank.FromControllers(controllers)
+    assert bank.shape == (4,)
+
+    rng = np.random.default_rng(0)
+    for _ in range(2):
+        for c in controllers:
+            c.reset_integral(0.1)
+        bank.reset_integral(0.1)
+        for e in rng.normal(0, 5.0, (500, 4)):
+            expected = [c.compute(x, 1e-3) for c, x in zip(controllers, e)]
+            assert np.allclose(bank.compute(e, 1e-3), expected)
+        assert np.allclose(bank.integral, [c.integral for c in controllers])
+
+    # Sweep: several sets of gains, broadcast over a second dimension.
+    bank = PIControllerBank(np.array([[1.0], [2.0]]), np.array([10.0, 20.0, 30.0]), 1.0)
+    assert bank.shape == (2, 3)
+    assert np.allclose(bank.compute(np.ones((2, 3)), 1.0), -np.array([[1.0], [2.0]]) * 2.0)
+
+
+def test_pid():
+    # Without derivative, a PID is a PI
+    pi = PIController(2.0, 50.0, 1.0)
+    pid = PIDController(2.0, 50.0, 0.0, 1.0)
+    for e in np.linspace(-1, 1, 100):
+        assert pid.compute(e, 1e-3) == pytest.approx(pi.compute(e, 1e-3))
+
+    # Derivative of a ramp, once the filter has converged
+    pid = PIDController(1.0, 0.0, 0.5, 1.0, derivative_cutoff=50.0)
+    for t in np.arange(0, 0.5, 1e-3):
+        u = pid.compute(3.0 * t, 1e-3)
+    assert u == pytest.approx(-(3.0 * t + 0.5 * 3.0))
+    pid.reset_integral()
+    assert pid.compute(1.0, 1e-3) == pytest.approx(-1.0)
@@ -3,8 +3,13 @@
 import pytest
 import numpy as np
 import copy
+import json
 
-from nemo_bldc.physics import Motor
+from nemo_bldc.physics import Motor, LookupTable, MotorLookupTables, get_battery_state, evaluate_power_bus, Transmission
+from nemo_bldc.physics import optimize_sizing, pareto_front, MotorIdentifier, MotorTolerances, tolerance_analysis, EfficiencyMaps
+from nemo_bldc.physics import evaluate_drive_cycle, MotorMagnetics, saturation_table
+from nemo_bldc.physics import mtpa_currents, current_references, torque_limits, CurrentReferenceTables, Inverter
+from nemo_bldc.simulation import simulate, ControlType, PIController, SignalSinus
 from nemo_bldc.ressources import DEFAULT_LIBRARY
 
 
@@ -64,3 +69,481 @@ def test_reduction():
 
     # Check conservation of power
     assert m.nominal_power == pytest.approx(a.nominal_power)
+
+
+def test_lookup_tables(tmp_path):
+    m = DEFAULT_LIBRARY["MyActuator RMD-X6 V3"]
+    tables = MotorLookupTables(m)
+
+    rng = np.random.default_rng(0)
+    tau = rng.uniform(-m.tau_max, m.tau_max, 10000)
+    w = rng.uniform(0, m.w_max_no_load, 10000)
+    with np.errstate(invalid="ignore"):
+        feasible = w <= m.compute_max_speed_deflux(tau)
+        for table, function, args in [
+            (tables.max_speed, m.compute_max_speed_deflux, (tau,)),
+            (tables.defluxing_current, m.compute_defluxing_current, (tau, w)),
+            (tables.thermal_power, m.compute_thermal_power, (tau, w)),
+        ]:
+            value = table(*args)
+            valid = np.isfinite(value) & feasible
+            assert np.mean(valid) > 0.98 * np.mean(feasible)
+            assert np.allclose(value[valid], function(*args)[valid], atol=1.5 * table.error)
+            # Scalar evaluation
+            assert table(*[float(a[0]) for a in args]) == pytest.approx(value[0], nan_ok=True)
+            # Points where the function is defined but the table is nan (at
+            # the boundary) are reported separately from the error.
+            assert 0 <= table.missing_fraction < 0.05
+            if table.missing_fraction > 0:
+                assert np.any(np.isnan(table(*args)) & np.isfinite(function(*args)))
+    # nan inputs give nan, e.g. when chaining tables outside the feasible region.
+    table = tables.thermal_power
+    assert np.isnan(table(np.nan, 1.0)) and np.isnan(table(1.0, np.nan)) and np.isnan(tables.max_speed(np.nan))
+    value = table(np.array([np.nan, 1.0]), np.array([1.0, 1.0]))
+    assert np.isnan(value[0]) and value[1] == pytest.approx(table(1.0, 1.0))
+    # Mixed scalar and array inputs are broadcast.
+    table = tables.thermal_power
+    assert np.allclose(table(float(tau[0]), w[:10]), table(np.full(10, tau[0]), w[:10]), equal_nan=True)
+    assert np.allclose(table(tau[:10], float(w[0])), table(tau[:10], np.full(10, w[0])), equal_nan=True)
+
+    # Symmetry for negative speeds
+    assert tables.compute_thermal_power(-1.0, -5.0) == pytest.approx(tables.compute_thermal_power(1.0, 5.0))
+
+    # Save and reload
+    tables.thermal_power.save(tmp_path / "table.npz")
+    table = LookupTable.FromFile(tmp_path / "table.npz")
+    assert np.allclose(table(tau, w), tables.thermal_power(tau, w), equal_nan=True)
+    assert table.missing_fraction == tables.thermal_power.missing_fraction
+
+
+def test_power_bus():
+    m = DEFAULT_LIBRARY["MyActuator RMD-X6 V3"]
+
+    # Voltage parameter
+    tau = np.linspace(0, m.tau_max, 10)
+    assert np.allclose(m.compute_max_speed_deflux(tau, U=m.U), m.compute_max_speed_deflux(tau))
+    U = np.linspace(0.5 * m.U, m.U, 10)
+    assert np.allclose(m.compute_max_speed_no_deflux(tau, U=U),
+                       [m.compute_max_speed_no_deflux(t, U=u) for t, u in zip(tau, U)])
+
+    # Several motors on the same bus.
+    t = np.linspace(0, 1, 1000)
+    tau = np.array([0.5 * m.tau_max * np.sin(2 * np.pi * f * t) for f in [1, 2, 3]])
+    w = np.array([20.0 * np.cos(2 * np.pi * f * t) for f in [1, 2, 3]])
+    result = evaluate_power_bus([m, m, m], m.U, 0.2, tau, w)
+    assert result.U.shape == t.shape
+    assert result.motor_power.shape == tau.shape
+    power = w * tau + 3 / 2 * m.R * (tau / m.kt_q_art)**2
+    assert np.allclose(result.motor_power, power)
+    U, I = get_battery_state(m.U, 0.2, np.sum(power, axis=0))
+    assert np.allclose(result.U, U)
+    assert np.allclose(result.I, I)
+    assert np.all(result.feasible)
+
+    # Voltage sag reduces the maximum speed.
+    result = evaluate_power_bus([m, m, m], m.U, 0.2, np.full((3, 1), m.tau_max), np.full((3, 1), 0.9 * m.w_max_at_max_torque))
+    assert result.U[0] < m.U
+    assert np.all(result.max_speed < m.w_max_at_max_torque)
+    assert not np.any(result.feasible)
+    # Overloaded battery
+    result = evaluate_power_bus([m], m.U, 100.0, [[m.tau_max]], [[10.0]])
+    assert np.isnan(result.U[0])
+    assert not result.feasible[0, 0]
+
+
+def test_transmission():
+    m = DEFAULT_LIBRARY["MyActuator RMD-X6 V3"]
+    tau = np.linspace(-m.tau_max, m.tau_max, 11)
+
+    # Ideal transmission: same as the reduction ratio of the motor
+    ideal = Transmission(m.rho)
+    assert np.allclose(ideal.compute_max_speed_no_deflux(m, tau), m.compute_max_speed_no_deflux(tau))
+    assert np.allclose(ideal.compute_max_speed_deflux(m, tau), m.compute_max_speed_deflux(tau))
+    assert np.allclose(ideal.compute_thermal_power(m, tau, 10.0), m.compute_thermal_power(tau, 10.0))
+
+    # Losses
+    t = Transmission(m.rho, efficiency=0.8, coulomb_friction=0.2, viscous_friction=0.01)
+    assert t.motor_torque(1.0, 10.0) == pytest.approx((1.0 + 0.2 + 0.1) / 0.8)
+    assert t.motor_torque(-2.0, 10.0) == pytest.approx((-2.0 + 0.2 + 0.1) * 0.8)
+    assert t.load_torque(t.motor_torque(tau, 10.0), 10.0) == pytest.approx(tau)
+    assert t.efficiency_at(0.5, 10.0) < t.efficiency_at(2.0, 10.0) < 0.8
+    w = t.compute_max_speed_no_deflux(m, tau)
+    assert np.all(w < m.compute_max_speed_no_deflux(tau))
+    assert np.allclose(w, t.apply(m).compute_max_speed_no_deflux(t.motor_torque(tau, w)))
+
+    # Several ratios in one call
+    ratios = np.array([4.0, 8.0, 16.0])
+    t = Transmission(ratios[:, None], efficiency=0.9, coulomb_friction=0.1)
+    assert t.reflected_inertia.shape == (3, 1)
+    w = t.compute_max_speed_deflux(m, tau)
+    assert w.shape == (3, len(tau))
+    for i, r in enumerate(ratios):
+        single = Transmission(r, efficiency=0.9, coulomb_friction=0.1)
+        assert np.allclose(w[i], single.compute_max_speed_deflux(m, tau))
+
+    with pytest.raises(ValueError):
+        Transmission(m.rho, backlash=0.01)
+
+
+def test_sizing():
+    rng = np.random.default_rng(0)
+    costs = rng.random((500, 3))
+    optimal = pareto_front(costs)
+    dominated = [np.any(np.all(costs <= c, axis=1) & np.any(costs < c, axis=1)) for c in costs]
+    assert np.array_equal(optimal, np.nonzero(np.logical_not(dominated))[0])
+    # Identical designs are all kept, or all dropped.
+    costs = np.concatenate([costs, costs[optimal[:5]], costs[:5]])
+    optimal = pareto_front(costs)
+    dominated = [np.any(np.all(costs <= c, axis=1) & np.any(costs < c, axis=1)) for c in costs]
+    assert np.array_equal(optimal, np.nonzero(np.logical_not(dominated))[0])
+
+    # Mission: sinusoidal motion
+    t = np.linspace(0, 1, 50)
+    tau = 3.0 * np.sin(2 * np.pi * t)
+    w = 10.0 * np.cos(2 * np.pi * t)
+    ratios = np.linspace(1, 20, 20)
+    voltages = [12.0, 24.0, 48.0]
+    result = optimize_sizing(DEFAULT_LIBRARY, tau, w, ratios, voltages)
+    assert len(result) > 0
+    assert np.all(np.diff(result.thermal_power) >= 0)
+    for k in range(len(result)):
+        m = result.get_motor(k)
+        assert np.all(np.abs(tau) <= m.tau_max)
+        assert np.all(np.abs(w) <= m.compute_max_speed_deflux(np.sign(w) * tau))
+        assert np.mean(m.compute_thermal_power(np.sign(w) * tau, np.abs(w))) == pytest.approx(result.thermal_power[k])
+        assert result.thermal_power[k] <= 3 / 2 * m.R * m.iq_nominal**2
+    # No other candidate is better on all criteria.
+    for name, m in DEFAULT_LIBRARY.items():
+        for ratio in ratios:
+            for U in voltages:
+                m = copy.deepcopy(m)
+                with np.errstate(invalid="ignore"):
+                    m.update_constants(U=U, reduction_ratio=ratio)
+                    w_max = m.compute_max_speed_deflux(np.sign(w) * tau)
+                    power = np.mean(m.compute_thermal_power(np.sign(w) * tau, np.abs(w)))
+                margin = np.min(np.minimum(1 - np.abs(tau) / m.tau_max, 1 - np.abs(w) / w_max))
+                if margin < 0 or not power <= 3 / 2 * m.R * m.iq_nominal**2:
+                    continue
+                better = (power < result.thermal_power) & (m.K_m_art / ratio < result.mass_proxy) & (margin > result.margin)
+                assert not np.any(better)
+    # Identical candidates (here, a duplicated voltage) are all kept.
+    duplicated = optimize_sizing(DEFAULT_LIBRARY, tau, w, ratios, voltages + [voltages[1]])
+    assert len(duplicated) == len(result) + np.sum(result.U == voltages[1])
+
+
+def test_identification():
+    m = DEFAULT_LIBRARY["MyActuator RMD-X6 V3"]
+    frequency = 20000
+    result = simulate(m, ControlType.VELOCITY, SignalSinus(3.0, 0.0, 5.0, 0.0), 0.5, 0.01, 0.1,
+                      PIController(2.0, 500.0, 30.0), PIController(1.0, 5.0, 10.0), control_loop_frequency=frequency)
+    tau = m.kt_q_art * result.idq[1]
+
+    # The simulation logs at step k the voltage applied since step k - 1.
+    for torque in [None, tau]:
+        identifier = MotorIdentifier(m.rho)
+        for k in range(0, len(result.time), 3000):
+            s = slice(k, k + 3001)
+            identifier.add_samples(1 / frequency, result.theta[s], result.dtheta[s], result.iphase[:, s],
+                                   result.Vphase[:, s][:, 1:], None if torque is None else torque[s])
+        p = identifier.get_parameters()
+        assert p["n"] == 2 * m.np
+        assert p["R"] == pytest.approx(m.R)
+        assert p["L"] == pytest.approx(m.L)
+        assert p["ke"] == pytest.approx(m.ke)
+        assert p["rms_error"] < 1e-6
+
+    # Noisy measurements
+    rng = np.random.default_rng(0)
+    identifier = MotorIdentifier(m.rho)
+    identifier.add_samples(1 / frequency, result.theta, result.dtheta, result.iphase + 0.001 * rng.standard_normal(result.iphase.shape),
+                           result.Vphase[:, 1:] + 0.01 * rng.standard_normal((3, len(result.time) - 1)), tau)
+    identified = identifier.get_motor(m.iq_max, m.iq_nominal, m.U)
+    assert identified.np == m.np
+    assert identified.R == pytest.approx(m.R, rel=0.05)
+    assert identified.ke == pytest.approx(m.ke, rel=0.01)
+
+
+def test_tolerances():
+    m = DEFAULT_LIBRARY["MyActuator RMD-X6 V3"]
+    tau = np.linspace(0, m.tau_max, 50)
+
+    # Without tolerances, all samples are the nominal motor.
+    result = tolerance_analysis(m, MotorTolerances(), 10, tau)
+    assert np.allclose(result.max_speed, m.compute_max_speed_deflux(tau))
+    assert np.allclose(result.percentile(50, defluxing=False), m.compute_max_speed_no_deflux(tau))
+
+    tolerances = MotorTolerances(R=0.05, L=0.05, ke=0.03, U=0.02, stator_temperature=(25, 100), rotor_temperature=(25, 80))
+    result = tolerance_analysis(m, tolerances, 2000, tau, seed=0)
+    assert result.max_speed.shape == (2000, 50)
+    # Samples match the evaluation of a single motor.
+    for k in [0, 100]:
+        single = Motor(2 * m.np, result.motors.R[k, 0], result.motors.L[k, 0], result.motors.ke[k, 0],
+                       m.iq_max, m.iq_nominal, result.motors.U[k, 0], m.rho)
+        reachable = tau <= single.tau_max
+        assert np.allclose(result.max_speed[k, reachable], single.compute_max_speed_deflux(tau[reachable]))
+        assert np.all(result.max_speed[k, ~reachable] == 0)
+
+    low, median, high = result.percentile([5, 50, 95])
+    assert np.all(low <= median) and np.all(median <= high)
+    # Feasibility is consistent with percentiles
+    w = np.linspace(0, 1.5 * m.w_max_no_load, 100)
+    feasibility = result.feasibility(w)
+    assert feasibility.shape == (50, 100)
+    assert np.allclose(feasibility[10], np.mean(w <= result.max_speed[:, 10:11], axis=0))
+    # Hot motors have less flux: they are faster at low torque, but most of
+    # them cannot reach the maximum torque.
+    assert median[0] > m.compute_max_speed_deflux(tau[0])
+    assert median[-1] == 0
+
+    # Margin of a mission, for each sample
+    mission = ([0.5 * m.tau_max, 0.2 * m.tau_max], [10.0, -20.0])
+    margin = result.compute_margin(*mission)
+    assert margin.shape == (2000,)
+    assert np.allclose(tolerance_analysis(m, MotorTolerances(), 5, tau).compute_margin(*mission), m.compute_margin(*mission))
+    assert np.min(margin) < m.compute_margin(*mission)
+
+    # The magnetic model is kept by the samples.
+    salient = copy.deepcopy(m)
+    salient.update_constants(magnetics=MotorMagnetics(0.6 * m.L, 1.4 * m.L, saturation_table(2 * m.iq_max, 2 * m.iq_max)))
+    result = tolerance_analysis(salient, MotorTolerances(), 10, tau)
+    assert result.motors.magnetics is salient.magnetics
+    with np.errstate(invalid="ignore"):
+        reachable = tau <= salient.tau_max
+        assert np.allclose(result.max_speed[:, reachable], salient.compute_max_speed_deflux(tau[reachable]))
+        assert not np.allclose(result.max_speed[:, reachable], m.compute_max_speed_deflux(tau[reachable]))
+
+
+def test_efficiency_maps(tmp_path):
+    maps = EfficiencyMaps.FromLibrary(DEFAULT_LIBRARY)
+    assert len(maps) == len(DEFAULT_LIBRARY)
+    assert maps.thermal_power.dtype == np.float32
+    assert maps.thermal_power.shape == (len(DEFAULT_LIBRARY), len(maps.tau), len(maps.w))
+
+    filename = str(tmp_path / "maps.npz")
+    maps.save(filename)
+    loaded = EfficiencyMaps.FromFile(filename)
+    assert loaded.names == maps.names
+    assert np.array_equal(loaded.mechanical_power, maps.mechanical_power, equal_nan=True)
+
+    for name, motor in DEFAULT_LIBRARY.items():
+        # Grid values match the motor model, and are nan outside of the envelope.
+        thermal = loaded.get(name, "thermal_power")
+        tau, w = np.meshgrid(*maps.axes(name), indexing="ij")
+        with np.errstate(invalid="ignore"):
+            # Unlimited speed at zero torque, when the motor can fully deflux.
+            max_speed = np.nan_to_num(motor.compute_max_speed_deflux(tau), nan=np.inf)
+            feasible = (np.abs(tau) <= motor.tau_max) & (w <= max_speed)
+        assert np.array_equal(np.isnan(thermal), ~feasible)
+        with np.errstate(invalid="ignore"):
+            reference = motor.compute_thermal_power(tau, w)
+        electrical = tau * w + reference
+        assert np.allclose(thermal[feasible], reference[feasible], rtol=1e-5, atol=1e-5 * np.nanmax(thermal))
+        assert np.allclose(loaded.get(name, "electrical_power")[feasible], electrical[feasible], rtol=1e-4, atol=1e-2)
+
+        # Interpolation, with symmetry for negative speeds.
+        rng = np.random.default_rng(0)
+        tau = rng.uniform(-0.5, 0.5, 100) * motor.tau_max
+        w = rng.uniform(-0.5, 0.5, 100) * motor.w_max_no_load
+        with np.errstate(invalid="ignore"):
+            reference = motor.compute_thermal_power(np.where(w < 0, -tau, tau), np.abs(w))
+        interpolated = loaded.interpolate(name, tau, w)
+        # Near the envelope, cells are partly outside: nan
+        valid = ~np.isnan(interpolated)
+        assert np.sum(valid) > 90
+        assert np.allclose(interpolated[valid], reference[valid], atol=1e-2 * np.nanmax(reference))
+        assert np.isnan(loaded.interpolate(name, 2 * motor.tau_max, 0.0))
+        # Same values when interpolating all the motors at once.
+        k = maps.names.index(name)
+        assert np.allclose(maps.interpolate_all(tau, w)[k], maps.interpolate(name, tau, w), rtol=1e-4,
+                           atol=1e-4 * np.nanmax(reference), equal_nan=True)
+
+    with pytest.raises(ValueError):
+        maps.get(maps.names[0], "torque")
+
+
+def test_drive_cycle():
+    maps = EfficiencyMaps.FromLibrary(DEFAULT_LIBRARY)
+    time = np.linspace(0, 10, 10001)
+    dt = time[1] - time[0]
+    for k, (name, motor) in enumerate(DEFAULT_LIBRARY.items()):
+        tau = 0.5 * motor.tau_max * np.sin(2 * np.pi * time)
+        w = 0.2 * motor.w_max_no_load * np.cos(np.pi * time)
+        result = evaluate_drive_cycle(maps, time, tau, w)
+        # Energies match the motor model, evaluated directly.
+        assert result.feasible[k]
+        thermal = motor.compute_thermal_power(np.where(w < 0, -tau, tau), np.abs(w))
+        assert np.isclose(result.thermal_energy[k], dt * np.sum(thermal[1:]), rtol=1e-3)
+        assert np.isclose(result.mechanical_energy[k], dt * np.sum(tau[1:] * w[1:]))
+        assert np.isclose(result.electrical_energy[k], result.mechanical_energy[k] + result.thermal_energy[k])
+        assert np.isclose(result.peak_electrical_power[k], np.max(tau * w + thermal), rtol=1e-3)
+        assert np.isclose(result.battery_energy[k], result.electrical_energy[k])
+        assert result[name]["min_battery_voltage"] == motor.U
+
+        # A battery resistor adds losses, and lowers the voltage.
+        with_battery = evaluate_drive_cycle(maps, time, tau, w, battery_resistance=0.1)
+        _, I = get_battery_state(motor.U, 0.1, tau * w + thermal)
+        assert np.isclose(with_battery.battery_energy[k], motor.U * dt * np.sum(I[1:]), rtol=1e-3)
+        assert with_battery.battery_energy[k] > with_battery.electrical_energy[k]
+        assert with_battery.min_battery_voltage[k] < motor.U
+
+        # Too much torque from t = 4s to 6s: these samples are reported, and
+        # not included in the energies.
+        overload = (time >= 4) & (time < 6)
+        overloaded = evaluate_drive_cycle(maps, time, np.where(overload, 2 * motor.tau_max, tau), w)
+        assert overloaded.violations[k] == np.sum(overload)
+        assert np.isclose(overloaded.violation_duration[k], 2.0)
+        assert overloaded.first_violation[k] == 4.0
+        assert not overloaded.feasible[k]
+        assert np.isclose(overloaded.thermal_energy[k], dt * np.sum(thermal[1:][~overload[1:]]), rtol=1e-3)
+
+    # Processing by chunks does not change the result.
+    chunked = evaluate_drive_cycle(DEFAULT_LIBRARY, time, tau, w, chunk_size=777)
+    for key, value in result[name].items():
+        assert np.allclose(value, chunked[name][key], equal_nan=True)
+
+
+def test_motor_magnetics():
+    m = DEFAULT_LIBRARY["MyActuator RMD-X6 V3"]
+    tau = np.linspace(-m.tau_max, m.tau_max, 11)[:, None]
+    w = np.linspace(0, 2 * m.w_max_no_load, 7)
+
+    # Without saliency nor saturation, same envelope as the ideal motor.
+    ideal = Motor.FromDict(m.to_dict())
+    ideal.update_constants(magnetics=MotorMagnetics(m.L, m.L))
+    with np.errstate(invalid="ignore"):
+        assert np.allclose(ideal.compute_max_speed_deflux(tau), m.compute_max_speed_deflux(tau), equal_nan=True)
+        assert np.allclose(ideal.compute_max_speed_no_deflux(tau), m.compute_max_speed_no_deflux(tau), equal_nan=True)
+        assert np.allclose(ideal.compute_thermal_power(tau, w), m.compute_thermal_power(tau, w), equal_nan=True)
+
+    # Saliency and saturation: the currents give the torque, and reach the
+    # voltage limit when defluxing.
+    magnetics = MotorMagnetics(0.6 * m.L, 1.4 * m.L, saturation_table(2 * m.iq_max, 2 * m.iq_max))
+    assert np.isclose(magnetics.inductances(2 * m.iq_max, 0.0)[1], 0.7 * m.L)
+    salient = Motor.FromDict(m.to_dict())
+    salient.update_constants(magnetics=magnetics)
+    tau = np.linspace(0.1, 0.9, 5) * m.tau_max
+    w = 0.5 * (salient.compute_max_speed_no_deflux(tau) + salient.compute_max_speed_deflux(tau))
+    i_d = salient.compute_defluxing_current(tau, w)
+    i_q = magnetics.quadrature_current(salient, tau, i_d)
+    assert np.all(i_d < 0)
+    L_d, L_q = magnetics.inductances(i_d, i_q)
+    assert np.allclose(m.kt_q_art * i_q + 3 / 2 * m.np * m.rho * (L_d - L_q) * i_d * i_q, tau)
+    w_el = m.np * m.rho * w
+    V = np.hypot(m.R * i_d - w_el * L_q * i_q, m.R * i_q + w_el * L_d * i_d + m.ke * m.rho * w)
+    assert np.allclose(V, m.U / np.sqrt(3), rtol=1e-5)
+    assert np.allclose(salient.compute_thermal_power(tau, w), 3 / 2 * m.R * (i_d**2 + i_q**2))
+
+    # Saved with the motor.
+    loaded = Motor.FromDict(json.loads(json.dumps(salient.to_dict())))
+    assert np.allclose(loaded.compute_thermal_power(tau, w), salient.compute_thermal_power(tau, w))
+    assert np.isclose(loaded.w_max_at_max_torque, salient.w_max_at_max_torque)
+
+    # Torque ripple: none for the ideal motor.
+    assert np.allclose(ideal.magnetics.torque_ripple(ideal, tau), 0, atol=1e-12)
+    cogging = MotorMagnetics(m.L, m.L, cogging_torque=0.05, cogging_periods=36)
+    assert np.allclose(cogging.torque_ripple(m, tau), 0.1, rtol=1e-3)
+    harmonics = MotorMagnetics(m.L, m.L, bemf_harmonics=[(5, 0.02, 0.0), (7, 0.01, 0.0)])
+    ripple = harmonics.torque_ripple(m, tau)
+    assert np.all(ripple > 0) and np.allclose(ripple / tau, ripple[0] / tau[0])
+
+
+def test_current_reference():
+    m = DEFAULT_LIBRARY["MyActuator RMD-X6 V3"]
+    tau = np.linspace(-m.tau_max, m.tau_max, 11)[:, None]
+    w = np.linspace(-m.w_max_no_load, m.w_max_no_load, 7)
+
+    # Ideal motor: no direct current below the voltage limit, and the same
+    # thermal power as the motor model.
+    i_d, i_q = current_references(m, tau, w)
+    feasible = ~np.isnan(i_d)
+    assert np.allclose(m.kt_q_art * i_q[feasible], np.broadcast_to(tau, i_d.shape)[feasible])
+    with np.errstate(invalid="ignore"):
+        assert np.allclose(3 / 2 * m.R * (i_d**2 + i_q**2)[feasible], m.compute_thermal_power(tau, w)[feasible])
+
+    # Saliency: the maximum torque per ampere needs less current than any
+    # other direct current giving the same torque.
+    salient = Motor.FromDict(m.to_dict())
+    salient.update_constants(magnetics=MotorMagnetics(0.6 * m.L, 1.4 * m.L, saturation_table(2 * m.iq_max, 2 * m.iq_max)))
+    tau = np.linspace(0.1, 1.0, 4) * m.tau_max
+    i_d, i_q = mtpa_currents(salient, tau)
+    assert np.all(i_d < 0) and np.allclose(salient.magnetics.torque(salient, 0.0, np.array([i_d, i_q])), tau)
+    other_d = np.linspace(-m.iq_max, 0, 201)[:, None]
+    other_q = salient.magnetics.quadrature_current(salient, tau, other_d)
+    assert np.all(i_d**2 + i_q**2 <= np.min(other_d**2 + other_q**2, axis=0) + 1e-9)
+    assert np.all(np.hypot(i_d, i_q) < tau / m.kt_q_art)
+
+    # The torque limits match the envelope of the motor, and are symmetric.
+    w = np.linspace(0.2, 1.0, 5) * m.w_max_at_max_torque
+    min_torque, max_torque, _, (i_d, i_q) = torque_limits(m, w)
+    assert np.allclose(max_torque, m.tau_max) and np.allclose(min_torque, -m.tau_max)
+    tau = np.linspace(0.1, 0.9, 5) * m.tau_max
+    with np.errstate(invalid="ignore"):
+        max_torque = torque_limits(m, m.compute_max_speed_deflux(tau))[1]
+        assert np.allclose(max_torque, tau, rtol=1e-2)
+    assert np.allclose(torque_limits(m, -w)[0], -torque_limits(m, w)[1])
+
+    # Tables: interpolated references, symmetric for negative speeds, and
+    # saturated at the torque limit.
+    tables = CurrentReferenceTables(salient)
+    tau = np.linspace(-0.9, 0.9, 5)[:, None] * m.tau_max
+    w = np.linspace(0, 0.8, 5) * m.w_max_no_load
+    i_d, i_q = tables(tau, w)
+    assert np.allclose(i_d, current_references(salient, tau, w)[0], atol=0.02 * m.iq_max)
+    assert np.allclose(i_q, current_references(salient, tau, w)[1], atol=0.02 * m.iq_max)
+    assert np.allclose(tables(-tau, -w)[0], i_d) and np.allclose(tables(-tau, -w)[1], -i_q)
+    assert np.allclose(tables(0.5 * m.tau_max, -0.1), (tables(-0.5 * m.tau_max, 0.1)[0], -tables(-0.5 * m.tau_max, 0.1)[1]))
+    w_max = 0.9 * tables.max_torque.axes[0][-1]
+    i_d, i_q = tables(2 * m.tau_max, w_max)
+    assert np.isclose(salient.magnetics.torque(salient, 0.0, np.array([i_d, i_q])), tables.max_torque(w_max), rtol=1e-2)
+
+    # Efficiency maps of a salient motor use its own model.
+    maps = EfficiencyMaps.FromLibrary({"salient": salient, "ideal": m})
+    t, s = maps.axes("salient")
+    thermal = maps.get("salient", "thermal_power")
+    inside = ~np.isnan(thermal)
+    with np.errstate(invalid="ignore"):
+        assert np.allclose(thermal[inside], salient.compute_thermal_power(t[:, None], s)[inside], rtol=1e-5, atol=1e-3)
+    assert maps.interpolate("salient", 0.5 * m.tau_max, 0.0) < maps.interpolate("ideal", 0.5 * m.tau_max, 0.0)
+
+
+def test_inverter(tmp_path):
+    m = DEFAULT_LIBRARY["MyActuator RMD-X6 V3"]
+    inverter = Inverter(on_resistance=0.01, switching_time=100e-9, dead_time=500e-9, diode_voltage=0.8)
+    frequency = 20000
+
+    # Mean losses: average of the instantaneous losses over an electrical period.
+    phase = np.linspace(0, 2 * np.pi, 3601)[:-1]
+    current = np.array([0.5, 2.0, 10.0])[:, None]
+    iphase = current * np.array([np.cos(phase), np.cos(phase - 2 * np.pi / 3), np.cos(phase + 2 * np.pi / 3)])[:, None]
+    losses = np.mean(inverter.compute_losses(iphase, m.U, frequency), axis=-1)
+    assert np.allclose(losses, inverter.compute_mean_losses(current[:, 0], m.U, frequency), rtol=1e-4)
+    # Conduction losses only: like an additional phase resistance.
+    tau = np.linspace(-m.tau_max, m.tau_max, 11)[:, None]
+    w = np.linspace(0, m.w_max_no_load, 7)
+    conduction = Inverter(on_resistance=0.01)
+    with np.errstate(invalid="ignore"):
+        assert np.allclose(conduction.compute_motor_losses(m, tau, w, frequency), 0.01 / m.R * m.compute_thermal_power(tau, w),
+                           equal_nan=True)
+
+    # Efficiency maps and drive cycle including the inverter losses.
+    library = {k: DEFAULT_LIBRARY[k] for k in ["MyActuator RMD-X6 V3", "MAD 5005"]}
+    ideal = EfficiencyMaps.FromLibrary(library)
+    maps = EfficiencyMaps.FromLibrary(library, inverter=inverter, commutation_frequency=frequency)
+    t, s = maps.axes("MAD 5005")
+    with np.errstate(invalid="ignore"):
+        expected = inverter.compute_motor_losses(library["MAD 5005"], t[:, None], s, frequency)
+    inside = ~np.isnan(maps.get("MAD 5005", "thermal_power"))
+    assert np.allclose(maps.get("MAD 5005", "inverter_power")[inside], expected[inside], rtol=1e-4)
+    assert np.allclose(maps.electrical_power, ideal.electrical_power + maps.inverter_power, equal_nan=True, rtol=1e-5)
+    assert np.nanmax(maps.efficiency - ideal.efficiency) <= 0
+    maps.save(tmp_path / "maps.npz")
+    assert np.array_equal(EfficiencyMaps.FromFile(tmp_path / "maps.npz").inverter_power, maps.inverter_power, equal_nan=True)
+    assert np.nanmax(ideal.inverter_power) == 0
+
+    time = np.linspace(0, 10, 1001)
+    tau = 0.3 * m.tau_max * np.sin(time)
+    w = 0.2 * m.w_max_no_load * np.cos(time)
+    result = evaluate_drive_cycle(maps, time, tau, w)
+    reference = evaluate_drive_cycle(ideal, time, tau, w)
+    assert np.all(result.inverter_energy > 0) and np.all(reference.inverter_energy == 0)
+    assert np.allclose(result.electrical_energy, reference.electrical_energy + result.inverter_energy)
@@ -1,6 +1,4 @@
-from nemo_bldc.nemo import nemo_main
-
-
-def test_nemo_build_gui():
+def test_nemo_build_gui(gtk):
     # Simply test if GUI works ok
+    from nemo_bldc.nemo import nemo_main
     nemo_main(is_unit_test=True)
@@ -0,0 +1,67 @@
+import pytest
+import numpy as np
+from nemo_bldc.simulation import SignalConstant, SignalSinus, SignalSum, SignalPiecewise, SignalTable
+from nemo_bldc.simulation.signal import SignalSquare, SignalTriangle, SignalRecording, csv_to_npy
+
+
+def test_sample():
+    # Sampling over a grid must match the pointwise evaluation
+    time = np.linspace(0, 2.0, 1001)
+    for signal in [SignalConstant(0, 0, 0, 1.5),
+                   SignalSinus(2.0, 0.3, 1.0, 0.5),
+                   SignalSquare(3.0, 0.0, 2.0, -1.0),
+                   SignalTriangle(1.0, 0.5, 1.0, 0.0)]:
+        value, derivative = signal.sample(time)
+        assert value.shape == time.shape
+        assert derivative.shape == time.shape
+        assert np.allclose(value, [signal.value(t) for t in time])
+        assert np.allclose(derivative, [signal.derivative(t) for t in time])
+        # Cached result is reused
+        assert signal.sample(time)[0] is value
+        assert signal.sample(time + 1)[0] is not value
+
+
+def test_composed_signals():
+    time = np.linspace(0, 2.0, 1001)
+    a = SignalSinus(2.0, 0.0, 1.0, 0.0)
+    b = SignalConstant(0, 0, 0, 2.0)
+
+    s = SignalSum(a, b)
+    assert np.allclose(s.value(time), a.value(time) + 2.0)
+    assert np.allclose(s.derivative(time), a.derivative(time))
+
+    s = SignalPiecewise([1.0], [a, b])
+    assert np.allclose(s.value(time), np.where(time < 1.0, a.value(time), 2.0))
+    assert np.allclose(s.derivative(time), np.where(time < 1.0, a.derivative(time), 0.0))
+    with pytest.raises(ValueError):
+        SignalPiecewise([1.0, 2.0], [a, b])
+
+    s = SignalTable(np.array([0.0, 1.0, 2.0]), np.array([0.0, 2.0, 1.0]))
+    assert s.value(0.5) == pytest.approx(1.0)
+    assert s.value(3.0) == pytest.approx(1.0)
+    assert np.allclose(s.derivative(np.array([0.5, 1.5, 3.0])), [2.0, -1.0, 0.0])
+
+
+def test_recording(tmp_path):
+    # Replay a recorded trajectory, stored in csv then converted to npy.
+    time = np.linspace(0, 10, 10001)
+    data = np.stack([time, np.sin(time)], axis=1)
+    np.savetxt(tmp_path / "log.csv", data, delimiter=",")
+    csv_to_npy(tmp_path / "log.csv", tmp_path / "log.npy", chunk_size=999)
+
+    signal = SignalRecording.FromFile(str(tmp_path / "log.npy"))
+    assert isinstance(signal.values, np.memmap)
+    assert np.allclose(signal.values, data[:, 1])
+
+    t = np.linspace(-1.0, 11.0, 2001)
+    assert np.allclose(signal.value(t), np.interp(t, time, data[:, 1]))
+    # Scalar evaluation (using the cursor) matches the vectorized one, in any order.
+    for times in [t, t[::-1]]:
+        assert np.allclose([signal.value(x) for x in times], signal.value(times))
+        assert np.allclose([signal.derivative(x) for x in times], signal.derivative(times))
+    assert np.allclose(signal.derivative(t), np.where((t < 0) | (t > 10), 0.0, np.cos(t)), atol=1e-6)
+
+    # Comment lines (header, annotations) are skipped, like by np.loadtxt.
+    (tmp_path / "comments.csv").write_text("# time,value\n0,1\n1,2\n# pause\n\n2,3  # end\n")
+    csv_to_npy(tmp_path / "comments.csv", tmp_path / "comments.npy", chunk_size=1)
+    assert np.array_equal(np.load(tmp_path / "comments.npy"), [[0, 1], [1, 2], [2, 3]])
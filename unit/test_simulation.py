@@ -1,11 +1,17 @@
+import os
 import pytest
 import numpy as np
 from bisect import bisect
 from nemo_bldc.ressources import DEFAULT_LIBRARY
-from nemo_bldc.simulation.simulate import simulate
-from nemo_bldc.simulation import simulate, ControlType, PIController, SignalConstant, SignalSinus
+from nemo_bldc.simulation.simulate import simulate, MotorSimulator
+from nemo_bldc.simulation.space_transforms import clarke_park
+from nemo_bldc.simulation import cache as cache_module
+from nemo_bldc.simulation import simulate, ControlType, PIController, PIDController, FieldWeakeningController, SignalConstant, SignalSinus, SensorModel
+from nemo_bldc.simulation import simulate_multi_axis, simulate_batch, scenario_key, SimulationCache, DiskSimulationCache, cached_simulate, LinearizedCascade, measure_frequency_response, estimate_frequency_response, SignalChirp, SignalMultisine
+from nemo_bldc.simulation import compute_metrics, electrical_power, cumulative_energy, magnetic_energy
+from nemo_bldc.physics import get_battery_state, Transmission, Motor, MotorMagnetics, saturation_table, mtpa_currents, CurrentReferenceTables, Inverter
 
-def test_simulation_current():
+def test_simulation_current(simulate_axes):
     # Test current mode simulation
     motor = DEFAULT_LIBRARY["MyActuator RMD-X6 V3"]
 
@@ -17,35 +23,37 @@ def test_simulation_current():
     current_controller = PIController(2.0, 500.0, 30.0)
     tau = motor.kt_q_art * signal.value(0)
 
-    for I in [0.1, 0.5]:
-        for nu in [0.2, 1.0]:
-            result = simulate(motor, ControlType.CURRENT, signal, duration, I, nu, current_controller, control_loop_frequency=frequency)
+    # All the (I, nu) pairs at once, the last one to test the velocity limit.
+    inertia = [0.1, 0.1, 0.5, 0.5, 0.001]
+    friction = [0.2, 1.0, 0.2, 1.0, 0.0]
+    results = simulate_axes(motor, ControlType.CURRENT, [signal] * 5, duration, inertia, friction, current_controller, control_loop_frequency=frequency)
+    reference = simulate(motor, ControlType.CURRENT, signal, duration, inertia[0], friction[0], current_controller, control_loop_frequency=frequency)
+    for field in ["theta", "dtheta", "idq", "iphase", "Vphase"]:
+        assert np.allclose(getattr(results[0], field), getattr(reference, field), atol=1e-9)
 
-            # Give time for convergence
-            idx = bisect(result.time, 0.1)
-            # Check current tracking
-            assert np.allclose(result.idq[:, idx:], result.idq_target[:, idx:], atol=0.01)
+    for I, nu, result in zip(inertia[:4], friction[:4], results):
+        # Give time for convergence
+        idx = bisect(result.time, 0.1)
+        # Check current tracking
+        assert np.allclose(result.idq[:, idx:], result.idq_target[:, idx:], atol=0.01)
 
-            # Check mechanical behavior
-            dtheta = tau / nu * (1 - np.exp(- nu / I * result.time))
-            assert np.allclose(result.dtheta[idx:], dtheta[idx:], atol=0.02)
-            assert np.allclose(np.diff(result.theta) * frequency, result.dtheta[1:], atol=0.001)
+        # Check mechanical behavior
+        dtheta = tau / nu * (1 - np.exp(- nu / I * result.time))
+        assert np.allclose(result.dtheta[idx:], dtheta[idx:], atol=0.02)
+        assert np.allclose(np.diff(result.theta) * frequency, result.dtheta[1:], atol=0.001)
 
-            # Test power conversation
-            p_elec = np.array([i.T @ u for i, u in zip(result.iphase.T, result.Vphase.T)])
-            p_meca = motor.kt_q_art * result.dtheta * result.idq[1]
-            p_th = 3 / 2 * motor.R * (result.idq[0]**2 + result.idq[1]**2)
-            assert np.allclose((p_meca + p_th)[idx:], p_elec[idx:], rtol=1e-3)
+        # Test power conversation
+        p_elec = electrical_power(result)
+        p_meca = motor.kt_q_art * result.dtheta * result.idq[1]
+        p_th = 3 / 2 * motor.R * (result.idq[0]**2 + result.idq[1]**2)
+        assert np.allclose((p_meca + p_th)[idx:], p_elec[idx:], rtol=1e-3)
 
     # Test velocity limit
-    I = 0.001
-    nu = 0.0
-    result = simulate(motor, ControlType.CURRENT, signal, duration, I, nu, current_controller, control_loop_frequency=frequency)
-
+    result = results[4]
     assert np.allclose(result.idq[:, -1000:], np.zeros((2, 1000)), atol=0.0001)
     assert np.allclose(result.dtheta[-1000:], motor.w_max_no_load, atol=0.0001)
 
-def test_simulation_velocity():
+def test_simulation_velocity(simulate_axes):
     # Test velocity mode simulation
     motor = DEFAULT_LIBRARY["MyActuator RMD-X6 V3"]
 
@@ -53,15 +61,20 @@ def test_simulation_velocity():
     duration = 0.4
     frequency = 20000
 
-    signal = SignalSinus(2.0, 0.0, 1.0, 0.0)
+    # Tracking of a sinus, and limit torque.
+    signals = [SignalSinus(2.0, 0.0, 1.0, 0.0), SignalConstant(0, 0, 0, 2.0)]
     current_controller = PIController(2.0, 500.0, 30.0)
     velocity_controller = PIController(30.0, 5.0, 10.0)
 
     I = 0.1
     nu = 1.0
 
-    result = simulate(motor, ControlType.VELOCITY, signal, duration, I, nu, current_controller, velocity_controller, control_loop_frequency=frequency)
+    results = simulate_axes(motor, ControlType.VELOCITY, signals, duration, I, nu, current_controller, velocity_controller, control_loop_frequency=frequency)
+    reference = simulate(motor, ControlType.VELOCITY, signals[0], duration, I, nu, current_controller, velocity_controller, control_loop_frequency=frequency)
+    for field in ["theta", "dtheta", "idq", "iphase", "Vphase"]:
+        assert np.allclose(getattr(results[0], field), getattr(reference, field), atol=1e-9)
 
+    signal, result = signals[0], results[0]
     assert np.allclose(result.vel_target, signal.value(result.time))
 
     # Give time for convergence
@@ -69,37 +82,542 @@ def test_simulation_velocity():
     assert np.allclose(result.dtheta[idx:], signal.value(result.time)[idx:], atol=0.05)
 
     # Check limit torque
-    signal = SignalConstant(0, 0, 0, 2.0)
-    result = simulate(motor, ControlType.VELOCITY, signal, duration, I, nu, current_controller, velocity_controller, control_loop_frequency=frequency)
-
+    signal, result = signals[1], results[1]
     idx = bisect(result.time, 0.1)
     assert np.allclose(result.dtheta[idx:], signal.value(result.time)[idx:], atol=0.05)
     assert np.allclose(motor.kt_q_art * result.idq[1, idx:], nu * signal.value(result.time)[idx:], atol=0.05)
 
 
-def test_simulation_position():
-    # Test velocity mode simulation
-    motor = DEFAULT_LIBRARY["MyActuator RMD-X6 V3"]
+def test_simulation_position(cached_simulation, position_scenario):
+    # Test position mode simulation
+    result = cached_simulation(*position_scenario, control_loop_frequency=20000)
+    signal = position_scenario[2]
 
-    # Parameters
-    duration = 0.4
+    assert np.allclose(result.pos_target, signal.value(result.time))
+    assert np.allclose(result.vel_target, signal.derivative(result.time))
+
+
+    # Give time for convergence
+    idx = bisect(result.time, 0.2)
+    assert np.allclose(result.theta[idx:], signal.value(result.time)[idx:], rtol=1e-2)
+
+
+def test_simulation_field_weakening():
+    # Field weakening makes it possible to go above the no-load speed
+    motor = DEFAULT_LIBRARY["MyActuator RMD-X6 V3"]
+    duration = 0.2
     frequency = 20000
+    signal = SignalConstant(0, 0, 0, 1.3 * motor.w_max_no_load)
+    current_controller = PIController(2.0, 500.0, 30.0)
+    velocity_controller = PIController(1.0, 5.0, 10.0)
+    I = 0.01
+    nu = 0.01
+
+    result = simulate(motor, ControlType.VELOCITY, signal, duration, I, nu, current_controller, velocity_controller,
+                      control_loop_frequency=frequency, current_feedforward=True)
+    assert result.dtheta[-1] == pytest.approx(motor.w_max_no_load, rel=0.01)
+
+    result = simulate(motor, ControlType.VELOCITY, signal, duration, I, nu, current_controller, velocity_controller,
+                      control_loop_frequency=frequency, current_feedforward=True,
+                      field_weakening=FieldWeakeningController(motor))
+    assert result.dtheta[-1] > 1.1 * motor.w_max_no_load
+    assert result.dtheta[-1] < motor.compute_max_speed_deflux(nu * result.dtheta[-1])
+    assert np.all(result.idq_target[0, -1000:] < 0)
+
+
+def test_simulation_low_frequency():
+    # Firmware-like control at 1kHz, with feed-forward: integration substeps
+    # keep the simulation stable.
+    motor = DEFAULT_LIBRARY["MyActuator RMD-X6 V3"]
+    signal = SignalSinus(0.5, 0.0, 1.0, 0.0)
+    current_controller = PIController(0.06, 3000.0, 30.0)
+    velocity_controller = PIDController(5.0, 20.0, 0.05, 10.0)
+    position_controller = PIController(20.0, 0.0, 10.0)
+    I = 0.1
+    nu = 1.0
+
+    args = (motor, ControlType.POSITION, signal, 1.0, I, nu, current_controller, velocity_controller, position_controller)
+    with pytest.raises(ArithmeticError):
+        simulate(*args, control_loop_frequency=1000)
+
+    result = simulate(*args, control_loop_frequency=1000, integration_substeps=10)
+    idx = bisect(result.time, 0.5)
+    error = np.max(np.abs(result.theta[idx:] - result.pos_target[idx:]))
+    result = simulate(*args, control_loop_frequency=1000, integration_substeps=10,
+                      current_feedforward=True, inertia_feedforward=True)
+    error_ff = np.max(np.abs(result.theta[idx:] - result.pos_target[idx:]))
+    assert error_ff < 0.01
+    assert error_ff < 0.1 * error
 
+
+def test_simulation_backends():
+    # The compiled kernel gives the same result as the python simulation
+    motor = DEFAULT_LIBRARY["MyActuator RMD-X6 V3"]
     signal = SignalSinus(0.2, 0.0, 1.0, 0.0)
+
+    for control_type, options in [(ControlType.CURRENT, {}),
+                                  (ControlType.VELOCITY, {"current_feedforward": True, "inertia_feedforward": True}),
+                                  (ControlType.POSITION, {"integration_substeps": 3})]:
+        results = []
+        for backend in ["python", "compiled"]:
+            controllers = [PIController(2.0, 500.0, 30.0), PIController(30.0, 5.0, 10.0), PIController(10.0, 2.0, 10.0)]
+            results.append(simulate(motor, control_type, signal, 0.05, 0.1, 1.0, *controllers,
+                                    control_loop_frequency=20000, backend=backend, **options))
+            if backend == "python":
+                integrals = [np.copy(c.integral) for c in controllers]
+        for field in ["theta", "dtheta", "idq", "iphase", "Vdq", "Vphase", "idq_target", "Vdq_target"]:
+            assert np.allclose(getattr(results[0], field), getattr(results[1], field), atol=1e-9)
+        for c, integral in zip(controllers, integrals):
+            assert np.allclose(c.integral, integral)
+
+    with pytest.raises(ValueError):
+        simulate(motor, ControlType.CURRENT, signal, 0.05, 0.1, 1.0, PIDController(1.0, 0.0, 0.0, 1.0), backend="compiled")
+
+
+def test_simulation_multi_axis():
+    # Independent axes behave like separate simulations
+    motors = [DEFAULT_LIBRARY["MyActuator RMD-X6 V3"], DEFAULT_LIBRARY["MyActuator RMD-X6 V2"]]
+    signals = [SignalSinus(0.2, 0.0, 1.0, 0.0), SignalSinus(0.5, 0.0, 2.0, 0.0)]
+    inertia = [0.1, 0.2]
+    friction = [1.0, 0.5]
+    controllers = [PIController(2.0, 500.0, 30.0), PIController(30.0, 5.0, 10.0), PIController(10.0, 2.0, 10.0)]
+    result = simulate_multi_axis(motors, ControlType.POSITION, signals, 0.05, inertia, friction, *controllers,
+                                 control_loop_frequency=20000, integration_substeps=2)
+    for k in range(2):
+        reference = simulate(motors[k], ControlType.POSITION, signals[k], 0.05, inertia[k], friction[k], *controllers,
+                             control_loop_frequency=20000, integration_substeps=2, backend="python")
+        axis = result.axis(k)
+        for field in ["theta", "dtheta", "idq", "iphase", "Vdq", "Vphase", "pos_target", "idq_target", "Vdq_target"]:
+            assert np.allclose(getattr(reference, field), getattr(axis, field), atol=1e-9)
+
+    # Shared battery: bus voltage drops with the power drawn by the motors
+    signals = [SignalConstant(0, 0, 0, 5.0)] * 2
+    result = simulate_multi_axis(motors, ControlType.CURRENT, signals, 0.05, inertia, friction, controllers[0],
+                                 control_loop_frequency=20000, battery_voltage=24.0, battery_resistance=0.2)
+    power = np.sum(result.iphase * result.Vphase, axis=(0, 1))
+    U, I = get_battery_state(24.0, 0.2, power[1:])
+    assert np.allclose(result.bus_voltage[1:], U)
+    assert np.allclose(result.bus_current[1:], I)
+    assert np.min(result.bus_voltage) < 24.0 - 0.1
+
+    # Coupling: two axes linked by a spring, applying opposite torques,
+    # reach the static equilibrium of the spring.
+    stiffness = 10 * np.array([[1.0, -1.0], [-1.0, 1.0]])
+    signals = [SignalConstant(0, 0, 0, 1.0 / motors[0].kt_q_art), SignalConstant(0, 0, 0, -1.0 / motors[1].kt_q_art)]
+    result = simulate_multi_axis(motors, ControlType.CURRENT, signals, 1.0, 0.01, 0.5, controllers[0],
+                                 control_loop_frequency=20000, coupling_stiffness=stiffness)
+    assert np.allclose(result.theta[:, -1], [0.05, -0.05], atol=1e-3)
+
+    # The derivative term of a PIDController is not supported.
+    for controller in [PIDController(2.0, 500.0, 0.1, 30.0), [PIDController(2.0, 500.0, 0.1, 30.0)] * 2]:
+        with pytest.raises(ValueError):
+            simulate_multi_axis(motors, ControlType.CURRENT, signals, 0.01, 0.01, 0.5, controller)
+
+
+def test_simulation_transmission():
+    motor = DEFAULT_LIBRARY["MyActuator RMD-X6 V3"]
     current_controller = PIController(2.0, 500.0, 30.0)
-    velocity_controller = PIController(100.0, 0.0, 10.0)
-    position_controller = PIController(10.0, 2.0, 10.0)
+    velocity_controller = PIController(30.0, 5.0, 10.0)
+    signal = SignalSinus(0.5, 0.0, 2.0, 0.0)
+
+    # An ideal transmission changes nothing.
+    reference = simulate(motor, ControlType.VELOCITY, signal, 0.1, 0.1, 1.0, current_controller, velocity_controller,
+                         control_loop_frequency=20000, backend="python")
+    result = simulate(motor, ControlType.VELOCITY, signal, 0.1, 0.1, 1.0, current_controller, velocity_controller,
+                      control_loop_frequency=20000, transmission=Transmission(motor.rho))
+    assert np.allclose(reference.theta, result.theta)
+    assert np.allclose(reference.idq, result.idq)
 
+    # Friction and efficiency: the motor provides more torque.
+    transmission = Transmission(motor.rho, efficiency=0.9, coulomb_friction=0.3, viscous_friction=0.1, rotor_inertia=1e-4)
+    signal = SignalConstant(0, 0, 0, 2.0)
+    result = simulate(motor, ControlType.VELOCITY, signal, 0.5, 0.1, 1.0, current_controller, velocity_controller,
+                      control_loop_frequency=20000, transmission=transmission)
+    idx = bisect(result.time, 0.3)
+    assert np.allclose(result.dtheta[idx:], 2.0, atol=0.01)
+    assert np.allclose(motor.kt_q_art * result.idq[1, idx:], transmission.motor_torque(1.0 * 2.0, 2.0), rtol=0.02)
+
+    # Backlash: the load lags behind the motor by half the gap, plus the deflection.
+    transmission = Transmission(motor.rho, rotor_inertia=1e-4, backlash=0.02, stiffness=1000.0, damping=1.0)
+    signal = SignalConstant(0, 0, 0, 2.0)
+    result = simulate(motor, ControlType.CURRENT, signal, 0.5, 0.01, 1.0, current_controller,
+                      control_loop_frequency=20000, transmission=transmission)
+    tau = motor.kt_q_art * 2.0
+    assert result.theta_load is not result.theta
+    assert result.theta_load[-1] > 0
+    assert result.theta[-1] - result.theta_load[-1] == pytest.approx(0.01 + tau / 1000.0, rel=0.01)
+    assert result.dtheta_load[-1] == pytest.approx(tau / 1.0, rel=0.01)
+
+
+def test_simulation_batch():
+    motors = [DEFAULT_LIBRARY["MyActuator RMD-X6 V3"], DEFAULT_LIBRARY["MyActuator RMD-X6 V2"]]
+    signal = SignalSinus(0.2, 0.0, 1.0, 0.0)
+    controllers = [PIController(2.0, 500.0, 30.0), PIController(30.0, 5.0, 10.0), PIController(10.0, 2.0, 10.0)]
+    args = (ControlType.VELOCITY, signal, 0.02, 0.1, 1.0, *controllers)
+
+    references = [simulate(m, *args, control_loop_frequency=20000, backend="python") for m in motors]
+    for engine in ["batched", "sequential", "process"]:
+        results = simulate_batch(motors, *args, control_loop_frequency=20000, engine=engine)
+        for reference, result in zip(references, results):
+            for field in ["theta", "dtheta", "idq", "iphase", "Vdq", "Vphase", "idq_target"]:
+                assert np.allclose(getattr(reference, field), getattr(result, field), atol=1e-9)
+    # The process engine simulates the same motors as the other engines: an
+    # inductance that does not survive a round-trip in mH gives the same result.
+    motor = Motor(1, 1, 1, 1, 1, 1, 48, 1)
+    motor.copy(motors[0])
+    motor.update_constants(L=next(L for L in motors[0].L * np.linspace(1.0, 2.0, 1001) if L * 1000.0 / 1000.0 != L))
+    sequential, process = [simulate_batch([motor], *args, control_loop_frequency=20000, engine=engine)[0] for engine in ["sequential", "process"]]
+    assert np.array_equal(sequential.idq, process.idq) and process.motor is motor
+
+    # The key depends on the motor constants and the scenario, not on the
+    # name of the motor or the state of the controllers.
+    renamed = Motor(1, 1, 1, 1, 1, 1, 48, 1)
+    renamed.copy(motors[0])
+    renamed.name = "Renamed"
+    assert scenario_key(motors[0], *args) == scenario_key(renamed, *args)
+    assert scenario_key(motors[0], *args) != scenario_key(motors[1], *args)
+    assert scenario_key(motors[0], *args) != scenario_key(motors[0], *args[:2], 0.03, *args[3:])
+    key = scenario_key(motors[0], *args)
+    controllers[0].integral = 12.0
+    assert scenario_key(motors[0], *args) == key
+
+    # Cached motors are not simulated again
+    cache = SimulationCache()
+    results = simulate_batch(motors, *args, control_loop_frequency=20000, cache=cache)
+    assert len(cache) == 2
+    modified = Motor(1, 1, 1, 1, 1, 1, 48, 1)
+    modified.copy(motors[1])
+    modified.update_constants(U=36.0)
+    new_results = simulate_batch([renamed, modified], *args, control_loop_frequency=20000, cache=cache)
+    assert new_results[0] is results[0]
+    assert new_results[1] is not results[1]
+    assert len(cache) == 3
+
+
+def test_simulation_disk_cache(tmp_path, monkeypatch):
+    motor = DEFAULT_LIBRARY["MyActuator RMD-X6 V3"]
+    signal = SignalSinus(0.2, 0.0, 1.0, 0.0)
+    controllers = [PIController(2.0, 500.0, 30.0), PIController(30.0, 5.0, 10.0), PIController(10.0, 2.0, 10.0)]
+    args = (motor, ControlType.POSITION, signal, 0.02, 0.1, 1.0, *controllers)
+    other_args = (motor, ControlType.POSITION, signal, 0.02, 0.2, 1.0, *controllers)
 
+    cache = DiskSimulationCache(str(tmp_path))
+    reference = cached_simulate(cache, *args, control_loop_frequency=20000)
+    assert len(cache) == 1
+    # A new cache on the same directory (e.g. a new session) reuses the result.
+    cache = DiskSimulationCache(str(tmp_path))
+    result = cached_simulate(cache, *args, control_loop_frequency=20000)
+    assert len(cache) == 1
+    assert result.control_type == ControlType.POSITION
+    assert result.motor.to_dict() == motor.to_dict()
+    assert result.theta_load is result.theta
+    for field in ["time", "theta", "dtheta", "idq", "iphase", "Vdq", "Vphase", "pos_target", "idq_target"]:
+        assert np.array_equal(getattr(reference, field), getattr(result, field))
+    cached_simulate(cache, *other_args, control_loop_frequency=20000)
+    assert len(cache) == 2
+
+    # Least recently used results are removed first.
+    size = max(f.stat().st_size for f in tmp_path.iterdir())
+    cache = DiskSimulationCache(str(tmp_path), max_size=int(2.5 * size))
+    key = scenario_key(*args, control_loop_frequency=20000)
+    assert cache.get(key) is not None
+    cached_simulate(cache, *args[:4], 0.3, *args[5:], control_loop_frequency=20000)
+    assert len(cache) == 2
+    assert key in cache
+    assert scenario_key(*other_args, control_loop_frequency=20000) not in cache
+
+    # Results of another version of the simulation code are not reused.
+    monkeypatch.setattr(cache_module, "sources_hash", lambda: "other version")
+    assert key not in cache
+    monkeypatch.undo()
+    assert key in cache
+
+    # Another process may remove a result at any time ; a failed write leaves
+    # no temporary file.
+    path = cache._path(key)
+    os.remove(path)
+    cache._touch(path)
+    monkeypatch.setattr(np, "savez", lambda *args, **kwargs: 1 / 0)
+    with pytest.raises(ZeroDivisionError):
+        cache.put(key, reference)
+    monkeypatch.undo()
+    assert not any(f.suffix == ".tmp" for f in tmp_path.iterdir())
+    cache.clear()
+    assert len(cache) == 0
+
+
+def test_simulation_frequency_analysis():
+    # The linearized model gives the small-signal response of simulate()
+    motor = DEFAULT_LIBRARY["MyActuator RMD-X6 V3"]
+    controllers = [PIController(2.0, 500.0, 30.0), PIController(5.0, 5.0, 10.0), PIController(10.0, 0.5, 10.0)]
+    frequency = 20000
+    for control_type, amplitude in [(ControlType.CURRENT, 1.0), (ControlType.VELOCITY, 1.0), (ControlType.POSITION, 1e-4)]:
+        model = LinearizedCascade(motor, control_type, 0.01, 0.1, *controllers, control_loop_frequency=frequency)
+        assert model.is_stable
+        f = 50.0
+        response = model.frequency_response([f]).closed_loop[0]
+        result = simulate(motor, control_type, SignalSinus(f, 0, amplitude, 0), 0.4, 0.01, 0.1, *controllers,
+                          control_loop_frequency=frequency)
+        output = {ControlType.CURRENT: result.idq[1], ControlType.VELOCITY: result.dtheta, ControlType.POSITION: result.theta}[control_type]
+        # Steady-state amplitude and phase, by least squares
+        mask = result.time > 0.2
+        t = result.time[mask]
+        X = np.stack([np.sin(2 * np.pi * f * t), np.cos(2 * np.pi * f * t), np.ones(len(t))], axis=1)
+        c = np.linalg.lstsq(X, output[mask], rcond=None)[0]
+        assert np.allclose((c[0] + 1j * c[1]) / amplitude, response, atol=1e-4)
+
+    # Velocity loop: margins and step response
+    model = LinearizedCascade(motor, ControlType.VELOCITY, 0.01, 0.1, *controllers, control_loop_frequency=frequency)
+    response = model.frequency_response(np.logspace(0, 3.5, 500))
+    assert 70 < response.bandwidth < 90
+    assert 80 < response.phase_margin < 90
+    assert response.gain_margin > 20
+    step = model.step_response(0.1)
+    result = simulate(motor, ControlType.VELOCITY, SignalConstant(0, 0, 0, 0.1), 0.1, 0.01, 0.1, *controllers,
+                      control_loop_frequency=frequency)
+    assert np.allclose(step.output * 0.1, result.dtheta, atol=1e-5)
+    assert step.overshoot < 1 and 0 < step.rise_time < step.settling_time < 0.02
+
+    # Too high gains make the loop unstable
+    model = LinearizedCascade(motor, ControlType.CURRENT, 0.01, 0.1, PIController(200.0, 500.0, 30.0), control_loop_frequency=frequency)
+    assert not model.is_stable
+
+
+def test_simulation_frequency_measurement():
+    motor = DEFAULT_LIBRARY["MyActuator RMD-X6 V3"]
+    controllers = [PIController(2.0, 500.0, 30.0), PIController(5.0, 5.0, 10.0), PIController(10.0, 0.5, 10.0)]
+    model = LinearizedCascade(motor, ControlType.VELOCITY, 0.01, 0.1, *controllers, control_loop_frequency=20000)
+
+    # Sine sweep, all frequencies at once
+    frequency = np.array([50.0, 100.0, 200.0, 500.0])
+    measured = measure_frequency_response(motor, ControlType.VELOCITY, frequency, 1.0, 0.01, 0.1, *controllers,
+                                          control_loop_frequency=20000, settling_time=0.05)
+    assert np.allclose(measured.closed_loop, model.frequency_response(frequency).closed_loop, atol=1e-3)
+    assert np.isnan(measured.phase_margin)
+
+    # Broadband excitations: chirp and multisine
+    for signal, start_time in [(SignalChirp(10, 2000, 0.5), 0.0), (SignalMultisine(np.arange(1, 100) * 20.0, 0.1), 0.05)]:
+        result = simulate(motor, ControlType.VELOCITY, signal, 0.5, 0.01, 0.1, *controllers, control_loop_frequency=20000)
+        estimate = estimate_frequency_response(result, 2000, start_time=start_time)
+        selected = (estimate.frequency > 20) & (estimate.frequency < 1000) & (estimate.coherence > 0.99)
+        if isinstance(signal, SignalMultisine):
+            # Only the excited frequencies are meaningful
+            selected &= np.isin(estimate.frequency, signal.frequencies)
+        assert np.sum(selected) > 40
+        reference = model.frequency_response(estimate.frequency[selected]).closed_loop
+        assert np.allclose(estimate.closed_loop[selected], reference, atol=0.05)
+
+    # The chirp frequency sweeps from start to end frequency
+    signal = SignalChirp(10, 1000, 1.0)
+    assert np.allclose(signal.frequency(np.array([0.0, 0.5, 1.0, 2.0])), [10, 100, 1000, 1000])
+    t = np.linspace(0, 2, 100001)
+    assert np.allclose(np.gradient(signal.value(t), t)[1:-1], signal.derivative(t)[1:-1], atol=0.01 * 2 * np.pi * 1000)
+
+
+def test_simulation_metrics():
+    motor = DEFAULT_LIBRARY["MyActuator RMD-X6 V3"]
+    controllers = [PIController(2.0, 500.0, 30.0), PIController(5.0, 5.0, 10.0), PIController(10.0, 0.5, 10.0)]
+    signal = SignalConstant(0, 0, 0, 10.0)
+    result = simulate(motor, ControlType.VELOCITY, signal, 0.2, 0.01, 0.1, *controllers, control_loop_frequency=20000)
+
+    metrics = compute_metrics(result)
+    # Energy balance
+    assert metrics.electrical_energy > 0
+    assert abs(metrics.energy_balance_error) < 1e-2 * metrics.electrical_energy
+    # Rotational energy and friction losses are provided by the motor
+    w = result.dtheta
+    friction = cumulative_energy(0.1 * w**2, result.time[1])[-1]
+    assert np.isclose(metrics.mechanical_energy, 0.5 * 0.01 * w[-1]**2 + friction, rtol=1e-2)
+    assert np.isclose(metrics.peak_iq, np.max(np.abs(result.idq[1])))
+    assert np.isclose(metrics.rms_tracking_error, np.sqrt(np.mean((result.dtheta - 10.0)**2)))
+    assert np.isclose(metrics.step.output[-1], 10.0, rtol=1e-2)
+    assert 0 < metrics.step.rise_time < metrics.step.settling_time
+    assert 0 <= metrics.voltage_saturation <= 1
+
+    # The result does not depend on the chunk size
+    chunked = compute_metrics(result, start_time=0.05, chunk_size=1000)
+    reference = compute_metrics(result, start_time=0.05)
+    for name in ["electrical_energy", "joule_energy", "energy_balance_error", "rms_iq", "max_tracking_error", "voltage_saturation"]:
+        assert np.isclose(getattr(chunked, name), getattr(reference, name))
+    assert np.allclose(chunked.rms_phase_current, reference.rms_phase_current)
+
+    # With a magnetic model, the reluctance torque, back-EMF harmonics and
+    # cogging torque are included: the mechanical energy is the one received
+    # by the rotor.
+    salient = Motor.FromDict(motor.to_dict())
+    magnetics = MotorMagnetics(0.6 * motor.L, 1.4 * motor.L, bemf_harmonics=[(5, 0.02, 0.0)], cogging_torque=0.05, cogging_periods=36)
+    salient.update_constants(magnetics=magnetics)
+    result = simulate(salient, ControlType.CURRENT, SignalConstant(0, 0, 0, 2.0), 0.1, 0.01, 0.1, PIController(0.5, 2000, 10),
+                      control_loop_frequency=20000, current_direct_target=SignalConstant(0, 0, 0, -10.0))
+    metrics = compute_metrics(result)
+    w = result.dtheta
+    received = 0.5 * 0.01 * w[-1]**2 + cumulative_energy(0.1 * w**2, result.time[1])[-1]
+    assert np.isclose(metrics.mechanical_energy, received, rtol=2e-3)
+    assert not np.isclose(cumulative_energy(motor.kt_q_art * result.idq[1] * w, result.time[1])[-1], received, rtol=2e-2)
+    i_d, i_q = result.idq[:, -1]
+    stored = 3 / 4 * (0.6 * i_d**2 + 1.4 * i_q**2) * motor.L + 0.05 / (36 * motor.rho) * np.cos(36 * motor.rho * result.theta[-1])
+    assert np.isclose(magnetic_energy(result)[-1], stored)
+
+    # Step metrics are relative to the final value: nan when it is zero.
+    result = simulate(motor, ControlType.VELOCITY, SignalConstant(), 0.01, 0.01, 0.1, *controllers, control_loop_frequency=20000)
+    step = compute_metrics(result).step
+    assert np.isnan(step.rise_time) and np.isnan(step.overshoot) and np.isnan(step.settling_time)
+
+
+def test_simulation_magnetics():
+    motor = DEFAULT_LIBRARY["MyActuator RMD-X6 V3"]
+    frequency = 20000
+    current_controller = PIController(0.5, 2000, 10)
+    args = (ControlType.VELOCITY, SignalSinus(2, 0, 10, 0), 0.1, 1e-4, 1e-4, current_controller, PIController(0.5, 10, 10))
+
+    # Without saliency, saturation or harmonics, the model is the ideal one.
+    ideal = Motor.FromDict(motor.to_dict())
+    ideal.update_constants(magnetics=MotorMagnetics(motor.L, motor.L))
+    reference = simulate(motor, *args, control_loop_frequency=frequency, backend="python")
+    result = simulate(ideal, *args, control_loop_frequency=frequency)
+    assert np.allclose(result.iphase, reference.iphase, atol=1e-9)
+    assert np.allclose(result.theta, reference.theta, atol=1e-12)
+    with pytest.raises(ValueError):
+        simulate(ideal, *args, control_loop_frequency=frequency, backend="compiled")
+
+    # Saliency: reluctance torque with a negative direct current, measured
+    # through the acceleration of a free inertia.
+    magnetics = MotorMagnetics(0.6 * motor.L, 1.4 * motor.L, saturation_table(2 * motor.iq_max, 2 * motor.iq_max))
+    salient = Motor.FromDict(motor.to_dict())
+    salient.update_constants(magnetics=magnetics)
     I = 0.1
-    nu = 1.0
+    result = simulate(salient, ControlType.CURRENT, SignalConstant(0, 0, 0, 2.0), 0.1, I, 0.0, current_controller,
+                      control_loop_frequency=frequency, current_direct_target=SignalConstant(0, 0, 0, -3.0))
+    assert np.allclose(result.idq[:, -1], [-3.0, 2.0], atol=0.05)
+    tau = magnetics.torque(salient, result.theta[:-1], result.idq[:, :-1])
+    assert np.all(tau[-100:] > motor.kt_q_art * result.idq[1, -101:-1])
+    assert np.allclose(I * np.diff(result.dtheta) * frequency, tau, atol=1e-9)
 
-    result = simulate(motor, ControlType.POSITION, signal, duration, I, nu, current_controller, velocity_controller, position_controller, control_loop_frequency=frequency)
+    # Cogging: zero mean torque ripple, at the given number of periods per turn.
+    cogging = Motor.FromDict(motor.to_dict())
+    cogging.update_constants(magnetics=MotorMagnetics(motor.L, motor.L, cogging_torque=0.5, cogging_periods=36))
+    speed = SignalConstant(0, 0, 0, 10.0)
+    result = simulate(cogging, ControlType.VELOCITY, speed, 0.5, 1e-3, 0.0, current_controller, PIController(0.05, 10, 10),
+                      control_loop_frequency=frequency, inertia_feedforward=True)
+    half = len(result.time) // 2
+    iq = result.idq[1, half:]
+    # The velocity loop fights the cogging torque: the current ripples at
+    # the cogging frequency, with a zero mean.
+    assert np.ptp(iq) * motor.kt_q_art > 0.2
+    assert abs(np.mean(iq)) * motor.kt_q_art < 0.02
+    spectrum = np.abs(np.fft.rfft(iq - np.mean(iq)))
+    peak = np.fft.rfftfreq(len(iq), 1 / frequency)[np.argmax(spectrum)]
+    assert np.isclose(peak, 36 * motor.rho * np.mean(result.dtheta[half:]) / (2 * np.pi), rtol=0.02)
 
-    assert np.allclose(result.pos_target, signal.value(result.time))
-    assert np.allclose(result.vel_target, signal.derivative(result.time))
 
+def test_simulation_current_reference():
+    motor = DEFAULT_LIBRARY["MyActuator RMD-X6 V3"]
+    frequency = 20000
+    current_controller = PIController(0.5, 2000, 10)
+    salient = Motor.FromDict(motor.to_dict())
+    salient.update_constants(magnetics=MotorMagnetics(0.6 * motor.L, 1.4 * motor.L, saturation_table(2 * motor.iq_max, 2 * motor.iq_max)))
+    tables = CurrentReferenceTables(salient)
 
-    # Give time for convergence
+    # The quadrature current target is a torque target, obtained with the
+    # maximum torque per ampere currents.
+    I = 0.1
+    result = simulate(salient, ControlType.CURRENT, SignalConstant(0, 0, 0, 4.0), 0.1, I, 0.0, current_controller,
+                      control_loop_frequency=frequency, current_reference=tables)
+    i_d, i_q = mtpa_currents(salient, 4.0 * motor.kt_q_art)
+    assert np.allclose(result.idq_target[:, -1], [i_d, i_q], atol=0.02)
+    assert np.allclose(result.idq[:, -1], [i_d, i_q], atol=0.05)
+    tau = salient.magnetics.torque(salient, result.theta[-2], result.idq[:, -2])
+    assert tau == pytest.approx(4.0 * motor.kt_q_art, rel=0.01)
+    assert np.hypot(i_d, i_q) < 4.0
+
+    with pytest.raises(ValueError):
+        simulate(salient, ControlType.CURRENT, SignalConstant(0, 0, 0, 4.0), 0.1, I, 0.0, current_controller,
+                 control_loop_frequency=frequency, current_reference=tables, field_weakening=FieldWeakeningController(salient))
+
+
+def test_simulation_inverter():
+    motor = DEFAULT_LIBRARY["MyActuator RMD-X6 V3"]
+    inverter = Inverter(on_resistance=0.01, switching_time=100e-9, dead_time=500e-9)
+    args = (motor, ControlType.CURRENT, SignalConstant(0, 0, 0, 5.0), 0.05, 1e-2, 1.0, PIController(0.5, 2000, 10))
+
+    # Losses of each step, from the phase currents, at the commutation frequency.
+    result = simulate(*args, control_loop_frequency=20000, commutation_frequency=40000, inverter=inverter)
+    assert np.allclose(result.inverter_losses, inverter.compute_losses(result.iphase, motor.U, 40000))
+    half = len(result.time) // 2
+    mean_losses = inverter.compute_mean_losses(np.hypot(*result.idq[:, -1]), motor.U, 40000)
+    assert np.mean(result.inverter_losses[half:]) == pytest.approx(mean_losses, rel=0.02)
+    assert compute_metrics(result).inverter_energy > 0
+    assert np.all(simulate(*args, control_loop_frequency=20000).inverter_losses == 0)
+
+
+def test_simulation_switching():
+    motor = DEFAULT_LIBRARY["MyActuator RMD-X6 V3"]
+    dt = 1e-4
+
+    # At constant speed, the switched inverter gives the same mean currents
+    # as the mean voltages of svpwm (finely integrated).
+    means = []
+    for substeps, frequency in [(100, None), (1, 20000)]:
+        simulator = MotorSimulator(motor, 1e6, 0.0, dt, SignalConstant(), substeps, switching_frequency=frequency)
+        simulator.state[1] = 8.0
+        idq = []
+        for _ in range(200):
+            simulator.step(np.array([0.0, 10.0]), 0.0)
+            idq.append(clarke_park(motor.np * motor.rho * simulator.state[0], simulator.state[2:5]))
+        means.append(np.mean(idq[100:], axis=0))
+    assert np.allclose(means[0], means[1], rtol=1e-2)
+
+    # Current control: the target is tracked, with a ripple inversely
+    # proportional to the commutation frequency.
+    args = (motor, ControlType.CURRENT, SignalConstant(0, 0, 0, 3.0), 0.02, 1e3, 0.0, PIController(0.5, 2000, 10))
+    ripple = []
+    for frequency in [20000, 40000]:
+        result = simulate(*args, control_loop_frequency=10000, commutation_frequency=frequency, switching=True)
+        assert np.allclose(result.idq[:, -1], [0.0, 3.0], atol=0.01)
+        ripple.append(np.mean(result.current_ripple[:, -50:]))
+    assert ripple[0] > 0.1 and ripple[0] / ripple[1] == pytest.approx(2.0, rel=0.05)
+    assert np.all(simulate(*args, control_loop_frequency=10000).current_ripple == 0)
+
+    with pytest.raises(ValueError):
+        simulate(*args, control_loop_frequency=10000, switching=True, backend="compiled")
+    salient = Motor.FromDict(motor.to_dict())
+    salient.update_constants(magnetics=MotorMagnetics(0.6 * motor.L, 1.4 * motor.L))
+    with pytest.raises(ValueError):
+        simulate(salient, *args[1:], control_loop_frequency=10000, switching=True)
+
+
+def test_simulation_sensors(cached_simulation, position_scenario):
+    motor = DEFAULT_LIBRARY["MyActuator RMD-X6 V3"]
+    dt = 1e-3
+
+    # Encoder: truncated rotor position, velocity from successive positions,
+    # and computation delay.
+    sensors = SensorModel(encoder_resolution=1000, delay=2)
+    sensors.reset(motor, dt)
+    theta = 0.01 * np.arange(10)
+    measured = np.array([sensors.measure(x, 10.0, np.zeros(3))[:2] for x in theta])
+    count = 2 * np.pi / 1000 / motor.rho
+    expected = np.floor(theta / count + 1e-9) * count
+    assert np.allclose(measured[2:, 0], expected[:-2])
+    assert np.allclose(measured[:3, 0], 0) and np.allclose(measured[3:, 1], np.diff(expected)[:-2] / dt)
+
+    # Current sensors: gaussian noise, drawn by blocks, then quantized.
+    sensors = SensorModel(current_noise=0.1, current_resolution=0.01, block_size=64)
+    sensors.reset(motor, dt)
+    idq = np.array([sensors.measure(0.3, 0.0, np.array([1.0, -0.5, -0.5]))[2] for _ in range(5000)])
+    assert np.allclose(np.mean(idq, axis=0), clarke_park(motor.np * motor.rho * 0.3, np.array([1.0, -0.5, -0.5])), atol=0.01)
+    assert np.allclose(np.std(idq, axis=0), 0.1 * np.sqrt(2 / 3), rtol=0.05)
+    assert np.allclose(np.round(idq / 0.01 * 3 / 2) * 0.01 / (3 / 2), idq, atol=0.01)
+
+    # Perfect sensors do not change the simulation ; realistic ones still
+    # track the target, with the same result for the same seed.
+    args = position_scenario
+    reference = cached_simulation(*args, control_loop_frequency=20000)
+    result = simulate(*args, control_loop_frequency=20000, sensors=SensorModel())
+    assert np.allclose(result.theta, reference.theta, atol=1e-12) and np.allclose(result.idq, reference.idq, atol=1e-9)
+    sensors = SensorModel(encoder_resolution=2**14, current_noise=0.05, current_resolution=0.02, delay=1, velocity_cutoff=500)
+    result = simulate(*args, control_loop_frequency=20000, sensors=sensors)
+    assert not np.array_equal(result.theta, reference.theta)
     idx = bisect(result.time, 0.2)
-    assert np.allclose(result.theta[idx:], signal.value(result.time)[idx:], rtol=1e-2)
+    assert np.allclose(result.theta[idx:], reference.theta[idx:], atol=2e-3)
+    assert np.array_equal(simulate(*args, control_loop_frequency=20000, sensors=sensors).theta, result.theta)